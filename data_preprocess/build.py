@@ -0,0 +1,312 @@
+"""
+Streaming dataset builder.
+
+build: read the raw sources lazily, drop questions already seen (normalized question hash, across sources),
+       and write every source as parquet shards of row groups plus a manifest.json
+
+    python build.py build --output_dir /data/train/pool \
+        --source orz_math=/data/Open-Reasoner-Zero/orz_math_57k_collected.json \
+        --source medqa=/data/medqa/train_data.jsonl \
+        --source medmcqa=/data/medmcqa/train_data.jsonl
+
+mix: sample rows of the built sources into one training parquet. Only the manifest and the shards are read,
+     so a new mix does not touch the raw sources. Values are row counts, or weights of --total rows.
+     A source smaller than its count is repeated, as merge.py did.
+
+    python build.py mix --manifest /data/train/pool/manifest.json --output /data/train/merge.parquet \
+        --mix orz_math=6348 --mix medqa=4146 --mix medmcqa=6348
+"""
+import os
+import re
+import json
+import random
+import hashlib
+import argparse
+import unicodedata
+
+import numpy as np
+from tqdm import tqdm
+import pyarrow.parquet as pq
+import pyarrow as pa
+
+from prompt import *
+from math_orz import MATH_PROMPT
+
+
+def iter_json(path, chunk_size=1 << 20):
+    """Items of a JSONL file, or of a JSON array file decoded one element at a time"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        started = False
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            pos = 0
+            while True:
+                while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ","):
+                    pos += 1
+                if not started and pos < len(buffer):
+                    assert buffer[pos] == "[", f"{path} is not a JSON array"
+                    started = True
+                    pos += 1
+                    continue
+                if pos < len(buffer) and buffer[pos] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # the element continues in the next chunk
+                    break
+                if end == len(buffer) and chunk:
+                    # a number may continue in the next chunk too
+                    break
+                yield item
+                pos = end
+            buffer = buffer[pos:]
+            if not chunk:
+                assert not buffer.strip(), f"truncated JSON array in {path}"
+                return
+
+
+def mcqa_row(data_source, item):
+    return {
+        "data_source": data_source,
+        "reward_actor": "RewardActorMCQA",
+        "prompt": R1_ORIGIN_PROMPT_ADD_LANGUAGE.format(prompt=item["reformat_question"]),
+        "reward_model": {
+            "style": "rule",
+            "ground_truth": item["options"][item["label"]]
+        },
+        "extra_info": {
+            "original_question": item["question"],
+            "question": item["reformat_question"], # 必须存在，用来 verify
+            "options": item["options"],
+        }
+    }
+
+
+def orz_math_row(data_source, item):
+    prompt = random.choice(MATH_PROMPT).format(prompt=item[0]["value"])
+    return {
+        "data_source": data_source,
+        "reward_actor": "RewardActorMath",
+        "prompt": R1_ORIGIN_PROMPT_ADD_LANGUAGE.format(prompt=prompt),
+        "reward_model": {
+            "style": "rule",
+            "ground_truth": item[1]["ground_truth"]["value"]
+        },
+        "extra_info": {
+            "question": item[0]["value"],
+            "ground_truth": item[1]["ground_truth"]["value"],
+        }
+    }
+
+
+# data_source -> row builder of one raw item, the same rows as medqa.py / medmcqa.py / math_orz.py
+SOURCES = {
+    "medqa": mcqa_row,
+    "medmcqa": mcqa_row,
+    "orz_math": orz_math_row,
+}
+
+
+def question_hash(question):
+    """Hash of the question with case, unicode forms, punctuation and whitespace normalized away"""
+    question = unicodedata.normalize("NFKC", question).lower()
+    question = " ".join(re.sub(r"[^\w]+", " ", question).split())
+    return int.from_bytes(hashlib.blake2b(question.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class ShardWriter:
+    """Parquet shards of at most `shard_rows` rows, written `row_group_size` rows at a time"""
+
+    def __init__(self, output_dir, row_group_size=1024, shard_rows=65536):
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.shard_rows = shard_rows
+        self.shards = []
+        self.rows = []
+        self.writer = None
+        self.path = None
+        self.shard_num_rows = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = pa.Table.from_pylist(self.rows)
+        self.rows = []
+        if self.writer is not None:
+            # a later row group may carry struct fields the shard schema has not seen, e.g. another option key
+            schema = pa.unify_schemas([self.writer.schema, table.schema], promote_options="permissive")
+            if schema.equals(self.writer.schema) and self.shard_num_rows + len(table) <= self.shard_rows:
+                self.writer.write_table(table.cast(schema))
+                self.shard_num_rows += len(table)
+                return
+            self.close_shard()
+        self.path = os.path.join(self.output_dir, f"part-{len(self.shards):05d}.parquet")
+        self.writer = pq.ParquetWriter(self.path + ".tmp", table.schema)
+        self.writer.write_table(table)
+        self.shard_num_rows = len(table)
+
+    def close_shard(self):
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+        self.shards.append({"path": os.path.basename(self.path), "num_rows": self.shard_num_rows})
+        self.writer = None
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.close_shard()
+        return self.shards
+
+
+def build(sources, output_dir, row_group_size, shard_rows):
+    seen = set()
+    manifest = {"row_group_size": row_group_size, "sources": {}}
+    for data_source, path in sources:
+        make_row = SOURCES[data_source]
+        writer = ShardWriter(os.path.join(output_dir, data_source), row_group_size, shard_rows)
+        num_rows = num_duplicates = 0
+        for item in tqdm(iter_json(path), desc=data_source):
+            row = make_row(data_source, item)
+            key = question_hash(row["extra_info"]["question"])
+            if key in seen:
+                num_duplicates += 1
+                continue
+            seen.add(key)
+            row["extra_info"]["index"] = num_rows
+            writer.write(row)
+            num_rows += 1
+        manifest["sources"][data_source] = {
+            "input": path,
+            "num_rows": num_rows,
+            "num_duplicates": num_duplicates,
+            "shards": [{**shard, "path": os.path.join(data_source, shard["path"])} for shard in writer.close()],
+        }
+        print(f"{data_source}: {num_rows} rows, {num_duplicates} duplicates dropped")
+
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    print(f"manifest written to {manifest_path}")
+
+
+def mix_counts(manifest, mix, total=None):
+    """Rows taken from every source: the given counts, or `total` split by the given weights"""
+    for data_source in mix:
+        assert data_source in manifest["sources"], f"{data_source} is not in the manifest"
+    if total is None:
+        return {data_source: int(value) for data_source, value in mix.items()}
+    weight_sum = sum(mix.values())
+    return {data_source: int(round(total * value / weight_sum)) for data_source, value in mix.items()}
+
+
+def row_repeats(num_rows, count, rng):
+    """How many times every row is taken: whole copies of the source, then a sample without replacement"""
+    if count == 0:
+        return np.zeros(num_rows, dtype=np.int64)
+    repeats = np.full(num_rows, count // num_rows, dtype=np.int64)
+    if count % num_rows:
+        repeats[rng.choice(num_rows, count % num_rows, replace=False)] += 1
+    return repeats
+
+
+def mix(manifest_path, mix, output_path, total=None, seed=0, row_group_size=None):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(manifest_path)
+    row_group_size = row_group_size or manifest["row_group_size"]
+    counts = mix_counts(manifest, mix, total)
+    rng = np.random.default_rng(seed)
+
+    shard_paths = {
+        data_source: [os.path.join(root, shard["path"]) for shard in manifest["sources"][data_source]["shards"]]
+        for data_source in counts
+    }
+    schema = pa.unify_schemas([pq.read_schema(path) for paths in shard_paths.values() for path in paths],
+                              promote_options="permissive").remove_metadata()
+
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    writer = pq.ParquetWriter(output_path + ".tmp", schema)
+    pending, num_pending = [], 0
+    for data_source, count in counts.items():
+        assert count == 0 or manifest["sources"][data_source]["num_rows"] > 0, f"{data_source} has no rows"
+        repeats = row_repeats(manifest["sources"][data_source]["num_rows"], count, rng)
+        offset = 0
+        for path in shard_paths[data_source]:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=row_group_size):
+                take = np.repeat(np.arange(len(batch)), repeats[offset:offset + len(batch)])
+                offset += len(batch)
+                if len(take) == 0:
+                    continue
+                batch = batch.take(pa.array(take))
+                pending.append(pa.record_batch([
+                    batch.column(field.name).cast(field.type)
+                    if field.name in batch.schema.names else pa.nulls(len(batch), field.type)
+                    for field in schema
+                ], schema=schema))
+                num_pending += len(batch)
+                if num_pending >= row_group_size:
+                    writer.write_table(pa.Table.from_batches(pending), row_group_size=row_group_size)
+                    pending, num_pending = [], 0
+        print(f"{data_source}: {count} rows from {manifest['sources'][data_source]['num_rows']}")
+    if pending:
+        writer.write_table(pa.Table.from_batches(pending), row_group_size=row_group_size)
+    writer.close()
+    os.replace(output_path + ".tmp", output_path)
+    print(f"{sum(counts.values())} rows written to {output_path}")
+
+
+def parse_pairs(values, cast):
+    pairs = []
+    for value in values:
+        name, _, rest = value.partition("=")
+        assert rest, f"expected name=value, got {value}"
+        pairs.append((name, cast(rest)))
+    return pairs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--source", action="append", required=True,
+                              help=f"data_source=path, data_source in {list(SOURCES)}. Earlier sources win on duplicates")
+    build_parser.add_argument("--output_dir", type=str, required=True)
+    build_parser.add_argument("--row_group_size", type=int, default=1024)
+    build_parser.add_argument("--shard_rows", type=int, default=65536)
+
+    mix_parser = subparsers.add_parser("mix")
+    mix_parser.add_argument("--manifest", type=str, required=True)
+    mix_parser.add_argument("--mix", action="append", required=True, help="data_source=rows, or a weight with --total")
+    mix_parser.add_argument("--total", type=int, default=None)
+    mix_parser.add_argument("--output", type=str, required=True)
+    mix_parser.add_argument("--seed", type=int, default=0)
+    mix_parser.add_argument("--row_group_size", type=int, default=None, help="the one of the manifest by default")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        sources = parse_pairs(args.source, str)
+        for data_source, _ in sources:
+            assert data_source in SOURCES, f"unknown data_source {data_source}, expected one of {list(SOURCES)}"
+        build(sources, args.output_dir, args.row_group_size, args.shard_rows)
+    else:
+        mix(args.manifest, dict(parse_pairs(args.mix, float)), args.output, args.total, args.seed, args.row_group_size)
@@ -0,0 +1,113 @@
+import time
+import argparse
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+from verl.trainer.ppo.core_algos import compute_grpo_outcome_advantage, compute_rloo_outcome_advantage
+
+
+def loop_grpo_outcome_advantage(token_level_rewards, eos_mask, index, epsilon=1e-6):
+    # the per-sample python implementation that compute_grpo_outcome_advantage replaced
+    response_length = token_level_rewards.shape[-1]
+    scores = token_level_rewards.sum(dim=-1)
+    id2score = defaultdict(list)
+    id2mean = {}
+    id2std = {}
+    with torch.no_grad():
+        bsz = scores.shape[0]
+        for i in range(bsz):
+            id2score[index[i]].append(scores[i])
+        for idx in id2score:
+            if len(id2score[idx]) == 1:
+                id2mean[idx] = torch.tensor(0.0)
+                id2std[idx] = torch.tensor(1.0)
+            else:
+                id2mean[idx] = torch.mean(torch.tensor(id2score[idx]))
+                id2std[idx] = torch.std(torch.tensor([id2score[idx]]))
+        for i in range(bsz):
+            scores[i] = (scores[i] - id2mean[index[i]]) / (id2std[index[i]] + epsilon)
+        scores = scores.unsqueeze(-1).tile([1, response_length]) * eos_mask
+    return scores, scores
+
+
+def loop_rloo_outcome_advantage(token_level_rewards, eos_mask, index, epsilon=1e-6):
+    # the per-sample python implementation that compute_rloo_outcome_advantage replaced
+    response_length = token_level_rewards.shape[-1]
+    scores = token_level_rewards.sum(dim=-1)
+    id2score = defaultdict(list)
+    id2mean = {}
+    with torch.no_grad():
+        bsz = scores.shape[0]
+        for i in range(bsz):
+            id2score[index[i]].append(scores[i])
+        for idx in id2score:
+            if len(id2score[idx]) == 1:
+                id2mean[idx] = torch.tensor(0.0)
+            else:
+                id2mean[idx] = torch.mean(torch.tensor(id2score[idx]))
+        for i in range(bsz):
+            response_num = len(id2score[index[i]])
+            if response_num > 1:
+                scores[i] = scores[i] * response_num / (response_num - 1) - id2mean[index[i]] * response_num / (response_num - 1)
+        scores = scores.unsqueeze(-1).tile([1, response_length]) * eos_mask
+    return scores, scores
+
+
+def make_batch(num_prompts, group_size, response_length, seed=0):
+    rng = np.random.default_rng(seed)
+    bsz = num_prompts * group_size
+    uids = np.array([f"uid-{i}" for i in range(num_prompts)], dtype=object)
+    index = np.repeat(uids, group_size)
+    # shuffle like _balance_batch does
+    index = index[rng.permutation(bsz)]
+    lengths = rng.integers(1, response_length + 1, size=bsz)
+    eos_mask = (torch.arange(response_length)[None, :] < torch.from_numpy(lengths)[:, None]).float()
+    token_level_rewards = torch.zeros(bsz, response_length)
+    # outcome reward on the last valid token, with the discrete levels used by the reward actors
+    token_level_rewards[torch.arange(bsz), torch.from_numpy(lengths - 1)] = torch.from_numpy(
+        rng.choice([0.0, 0.05, 0.1, 0.5, 1.0], size=bsz)).float()
+    return token_level_rewards, eos_mask, index
+
+
+def timeit(fn, repeat, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        stt = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - stt)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_prompts", type=int, nargs="+", default=[16, 128, 512])
+    parser.add_argument("--group_sizes", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--response_length", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'estimator':<8} {'prompts':>8} {'group':>6} {'bsz':>7} {'loop (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8} {'max_abs_diff':>13}")
+    for name, reference, vectorized in [
+        ("grpo", loop_grpo_outcome_advantage, compute_grpo_outcome_advantage),
+        ("rloo", loop_rloo_outcome_advantage, compute_rloo_outcome_advantage),
+    ]:
+        for num_prompts in args.num_prompts:
+            for group_size in args.group_sizes:
+                token_level_rewards, eos_mask, index = make_batch(num_prompts, group_size, args.response_length)
+                expected, _ = reference(token_level_rewards, eos_mask, index)
+                actual, _ = vectorized(token_level_rewards, eos_mask, index)
+                max_abs_diff = (expected - actual).abs().max().item()
+                if group_size == 1:
+                    assert torch.equal(expected, actual), "singleton groups must match exactly"
+                else:
+                    assert torch.allclose(expected, actual, atol=1e-5), f"mismatch: {max_abs_diff}"
+                t_loop = timeit(reference, args.repeat, token_level_rewards, eos_mask, index)
+                t_vec = timeit(vectorized, args.repeat, token_level_rewards, eos_mask, index)
+                print(f"{name:<8} {num_prompts:>8} {group_size:>6} {num_prompts * group_size:>7} "
+                      f"{t_loop * 1000:>12.2f} {t_vec * 1000:>16.2f} {t_loop / t_vec:>7.1f}x {max_abs_diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import time
+import argparse
+
+import torch
+
+from verl.utils.torch_functional import (entropy_from_logits, logprobs_and_entropy_from_logits, logprobs_from_logits,
+                                         logprobs_from_logits_naive)
+
+
+def reset_peak_memory(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        return torch.cuda.memory_allocated()
+    # writing 5 to clear_refs resets VmHWM, the peak resident set size of the process
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return read_status("VmRSS")
+
+
+def peak_memory(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated()
+    return read_status("VmHWM")
+
+
+def read_status(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def reference(logits, labels):
+    # the path of DataParallelPPOActor._forward_micro_batch without logprob_chunk_size
+    return logprobs_from_logits(logits, labels), entropy_from_logits(logits)
+
+
+def chunked(token_chunk_size):
+
+    def fn(logits, labels):
+        return logprobs_and_entropy_from_logits(logits, labels, token_chunk_size=token_chunk_size)
+
+    return fn
+
+
+def run(fn, logits, labels, grad_logprobs, grad_entropy, backward):
+    """(logprobs, entropy, logits grad, seconds, peak bytes above the inputs)"""
+    logits = logits.detach().requires_grad_(backward)
+    start = reset_peak_memory(logits.device)
+    stt = time.perf_counter()
+    with torch.set_grad_enabled(backward):
+        logprobs, entropy = fn(logits, labels)
+        if backward:
+            (logprobs.float() * grad_logprobs + entropy.float() * grad_entropy).sum().backward()
+    if logits.device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - stt
+    peak = peak_memory(logits.device) - start
+    return logprobs.detach().float(), entropy.detach().float(), logits.grad, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_tokens", type=int, default=4096)
+    parser.add_argument("--vocab_size", type=int, default=152064)
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "bfloat16"])
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--token_chunk_size", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--backward", action="store_true", help="also time the gradient, as in update_policy")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    logits = (torch.randn(args.num_tokens, args.vocab_size, device=device) * 4).to(getattr(torch, args.dtype))
+    labels = torch.randint(0, args.vocab_size, (args.num_tokens,), device=device)
+    grad_logprobs = torch.randn(args.num_tokens, device=device)
+    grad_entropy = torch.randn(args.num_tokens, device=device)
+    print(f"logits {tuple(logits.shape)} {args.dtype} on {device}: "
+          f"{logits.numel() * logits.element_size() / 1024**2:.0f} MB")
+
+    # numerical reference in fp32 (fp64 on CPU) with the unchunked log_softmax / softmax
+    ref_dtype = torch.float64 if device.type == "cpu" else torch.float32
+    exact = logits.detach().to(ref_dtype).requires_grad_(args.backward)
+    with torch.set_grad_enabled(args.backward):
+        exact_logprobs = logprobs_from_logits_naive(exact, labels)
+        exact_entropy = entropy_from_logits(exact)
+        if args.backward:
+            (exact_logprobs * grad_logprobs + exact_entropy * grad_entropy).sum().backward()
+    exact_logprobs, exact_entropy = exact_logprobs.detach(), exact_entropy.detach()
+    exact_grad = exact.grad
+    del exact
+
+    print(f"{'method':<16} {'time (s)':>9} {'peak (MB)':>10} {'logprob err':>12} {'entropy err':>12} {'grad err':>10}")
+    methods = [("reference", reference)] + [(f"chunked {size}", chunked(size)) for size in args.token_chunk_size]
+    for name, fn in methods:
+        logprobs, entropy, grad, elapsed, peak = run(fn, logits, labels, grad_logprobs, grad_entropy, args.backward)
+        grad_err = (grad.to(ref_dtype) - exact_grad).abs().max().item() if args.backward else float("nan")
+        print(f"{name:<16} {elapsed:>9.3f} {peak / 1024**2:>10.0f} "
+              f"{(logprobs.to(ref_dtype) - exact_logprobs).abs().max().item():>12.2e} "
+              f"{(entropy.to(ref_dtype) - exact_entropy).abs().max().item():>12.2e} {grad_err:>10.2e}")
+        del logprobs, entropy, grad
+
+
+if __name__ == "__main__":
+    main()
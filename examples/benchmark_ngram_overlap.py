@@ -0,0 +1,106 @@
+import time
+import argparse
+
+import numpy as np
+
+from verl.workers.reward_manager.metric import calculate_ngram_overlap_by_group, ngram_sketches, pairwise_sketch_jaccard
+
+
+def exact_ngram_overlap(response_token_list, ngram_num=3):
+    # the pairwise set implementation that calculate_ngram_overlap replaced
+    response_ngram_list = []
+    for response_token in response_token_list:
+        response_ngram = []
+        for i in range(len(response_token) - ngram_num + 1):
+            response_ngram.append(tuple(response_token[i:i+ngram_num]))
+        response_ngram_list.append(response_ngram)
+    ngram_overlap_list = []
+    for i in range(len(response_ngram_list)):
+        for j in range(i+1, len(response_ngram_list)):
+            ngram_overlap = len(set(response_ngram_list[i]) & set(response_ngram_list[j])) * 1.0 / len(set(response_ngram_list[i]) | set(response_ngram_list[j]))
+            ngram_overlap_list.append(ngram_overlap)
+    return sum(ngram_overlap_list) * 1.0 / len(ngram_overlap_list)
+
+
+def exact_pairwise_jaccard(response_token_list, ngram_num=3):
+    # exact Jaccard of the n-gram sets of every pair (i < j), in np.triu_indices order
+    ngram_sets = [set(tuple(response[i:i + ngram_num]) for i in range(len(response) - ngram_num + 1))
+                  for response in response_token_list]
+    left, right = np.triu_indices(len(ngram_sets), k=1)
+    return np.array([len(ngram_sets[i] & ngram_sets[j]) / len(ngram_sets[i] | ngram_sets[j])
+                     for i, j in zip(left, right)])
+
+
+def check_pairwise_sketch_jaccard(sketch_size=256, group_size=16, max_length=2000):
+    # fixed seed, so the same pairs are compared on every run. A bottom-k estimate of one pair has a
+    # standard error of sqrt(J * (1 - J) / k) <= 0.5 / sqrt(k): every pair must be within 4 standard errors,
+    # and the mean over the pairs within 0.5 / sqrt(k)
+    rng = np.random.default_rng(1234)
+    group = [response.tolist() for response in make_group(rng, group_size, max_length)]
+    expected = exact_pairwise_jaccard(group)
+    actual = pairwise_sketch_jaccard(ngram_sketches(group, sketch_size=sketch_size))
+    pair_tolerance, mean_tolerance = 2.0 / np.sqrt(sketch_size), 0.5 / np.sqrt(sketch_size)
+    max_abs_err = np.abs(expected - actual).max()
+    mean_err = abs(expected.mean() - actual.mean())
+    print(f"pairwise_sketch_jaccard vs exact, {len(expected)} pairs, sketch {sketch_size}: "
+          f"max_abs_err {max_abs_err:.4f} (tolerance {pair_tolerance:.4f}), "
+          f"mean_err {mean_err:.4f} (tolerance {mean_tolerance:.4f})")
+    assert max_abs_err <= pair_tolerance, f"pairwise sketch estimate off by {max_abs_err}"
+    assert mean_err <= mean_tolerance, f"mean sketch estimate off by {mean_err}"
+
+
+def make_group(rng, group_size, max_length, vocab_size=32000):
+    # token arrays, as metric_experience passes them. Rollouts of one prompt share a common "solution"
+    # with random edits, so the overlap is neither 0 nor 1
+    base = rng.integers(0, vocab_size, size=max_length)
+    group = []
+    for _ in range(group_size):
+        length = int(rng.integers(max_length // 4, max_length + 1))
+        response = base[:length].copy()
+        mutate = rng.random(length) < rng.uniform(0.01, 0.3)
+        response[mutate] = rng.integers(0, 200, size=mutate.sum())
+        group.append(response)
+    return group
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_prompts", type=int, default=8)
+    parser.add_argument("--group_sizes", type=int, nargs="+", default=[8, 16, 64])
+    parser.add_argument("--max_length", type=int, default=7000)
+    parser.add_argument("--sketch_size", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_pairwise_sketch_jaccard()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'group':>6} {'sketch':>7} {'exact (s)':>10} {'sketch (s)':>11} {'speedup':>8} "
+          f"{'max_abs_err':>12} {'metric_err':>11}")
+    for group_size in args.group_sizes:
+        groups = [make_group(rng, group_size, args.max_length) for _ in range(args.num_prompts)]
+        stt = time.perf_counter()
+        expected = np.array([exact_ngram_overlap([response.tolist() for response in group]) for group in groups])
+        t_exact = time.perf_counter() - stt
+        for sketch_size in args.sketch_size:
+            stt = time.perf_counter()
+            actual = np.array(calculate_ngram_overlap_by_group(groups, sketch_size=sketch_size))
+            t_sketch = time.perf_counter() - stt
+            max_abs_err = np.abs(expected - actual).max()
+            # the logged value is the mean over prompts
+            metric_err = abs(expected.mean() - actual.mean())
+            print(f"{group_size:>6} {sketch_size:>7} {t_exact:>10.2f} {t_sketch:>11.3f} {t_exact / t_sketch:>7.1f}x "
+                  f"{max_abs_err:>12.4f} {metric_err:>11.4f}")
+            # a single pair has a standard error of at most 0.5 / sqrt(sketch_size), the group mean is tighter
+            assert max_abs_err < 1.5 / np.sqrt(sketch_size), f"sketch estimate off by {max_abs_err}"
+
+    # short responses have unions smaller than the sketch, where the estimate must be exact
+    groups = [make_group(rng, 8, 40) for _ in range(args.num_prompts)]
+    expected = np.array([exact_ngram_overlap([response.tolist() for response in group]) for group in groups])
+    actual = np.array(calculate_ngram_overlap_by_group(groups, sketch_size=256))
+    assert np.allclose(expected, actual), "small sets must match exactly"
+    print("small sets: exact match")
+
+
+if __name__ == "__main__":
+    main()
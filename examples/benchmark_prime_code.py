@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+from verl.utils.reward_score.prime_code import compute_score
+from verl.utils.reward_score.prime_code.sandbox_pool import get_sandbox_pool
+from verl.utils.reward_score.prime_code.testing_util import run_test
+from verl.utils.reward_score.prime_code.utils import check_correctness
+
+
+def _temp_run(sample, generation, debug, result, metadata_list, timeout):
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        sys.stderr = devnull
+        try:
+            res, metadata = run_test(in_outs=sample, test=generation, debug=debug, timeout=timeout)
+            result.append(res)
+            metadata_list.append(metadata)
+        except Exception:
+            result.append([-1 for i in range(len(sample['inputs']))])
+            metadata_list.append({})
+
+
+def process_check_correctness(in_outs, generation, timeout=10, debug=True):
+    # the Manager + Process per completion implementation that the sandbox pool replaced
+    manager = multiprocessing.Manager()
+    result = manager.list()
+    metadata_list = manager.list()
+    p = multiprocessing.Process(target=_temp_run, args=(in_outs, generation, debug, result, metadata_list, timeout))
+    p.start()
+    p.join(timeout=timeout + 1)
+    if p.is_alive():
+        p.kill()
+    if not result:
+        result = [[-1 for i in range(len(in_outs["inputs"]))]]
+    return result[0], list(metadata_list)
+
+
+STDIN_SOLUTION = """
+n = int(input())
+print(sum(int(x) for x in input().split()[:n]))
+"""
+
+WRONG_SOLUTION = """
+n = int(input())
+print(n)
+"""
+
+LOOPING_SOLUTION = """
+while True:
+    pass
+"""
+
+
+def make_test_cases(num_tests):
+    inputs, outputs = [], []
+    for i in range(num_tests):
+        values = list(range(i, i + 5))
+        inputs.append(f"5\n{' '.join(map(str, values))}\n")
+        outputs.append(f"{sum(values)}\n")
+    return {"inputs": inputs, "outputs": outputs}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_completions", type=int, default=32)
+    parser.add_argument("--num_tests", type=int, default=10)
+    parser.add_argument("--num_workers", type=int, default=None)
+    args = parser.parse_args()
+
+    test_cases = make_test_cases(args.num_tests)
+    completions = [f"```python{STDIN_SOLUTION if i % 2 == 0 else WRONG_SOLUTION}```" for i in range(args.num_completions)]
+
+    stt = time.time()
+    get_sandbox_pool(num_workers=args.num_workers).run_many([(test_cases, "print(1)", 5, False)])
+    print(f"pool start: {time.time() - stt:.2f}s")
+
+    # one global check per completion, as compute_score does first
+    stt = time.time()
+    reference = [process_check_correctness(test_cases, c.split('```python')[-1].split('```')[0], 5, False)[0] for c in completions]
+    process_time = time.time() - stt
+    stt = time.time()
+    pooled = [check_correctness(test_cases, c.split('```python')[-1].split('```')[0], 5, False)[0] for c in completions]
+    pool_time = time.time() - stt
+    assert [list(map(bool, r)) for r in reference] == [list(map(bool, r)) for r in pooled], "results differ"
+    print(f"check_correctness: process per completion {process_time:.2f}s, "
+          f"sandbox pool {pool_time:.2f}s ({process_time / pool_time:.1f}x)")
+
+    # compute_score of the failing completions submits the per-test-case checks as one batch
+    stt = time.time()
+    scores = [compute_score(c, test_cases, continuous=True)[0] for c in completions]
+    print(f"compute_score: {time.time() - stt:.2f}s for {len(completions)} completions, mean score {sum(scores) / len(scores):.2f}")
+
+    stt = time.time()
+    result, metadata = check_correctness(test_cases, LOOPING_SOLUTION, timeout=1, debug=False)
+    print(f"looping solution: {result[:3]}... killed after {time.time() - stt:.2f}s, "
+          f"{get_sandbox_pool().timeout_count} timeouts, {get_sandbox_pool().restart_count} restarts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset, get_worker_info
+from transformers import AutoTokenizer
+
+from verl.utils.dataset.rl_dataset import RLHFDataset
+from verl.utils.model import compute_position_id_with_mask
+
+
+# the pandas DataFrame backend that the memory mapped Arrow file replaced, with the same pre-tokenized ids
+class PandasRLHFDataset(RLHFDataset):
+
+    def _open(self):
+        super()._open()
+        self.dataframe = pd.concat([pd.read_parquet(f) for f in self.parquet_files]).iloc[self.rows]
+        del self.table
+
+    def __getitem__(self, item):
+        row_dict = self.dataframe.iloc[item].to_dict()
+        chat = row_dict.pop(self.prompt_key)
+        ids = self.prompt_values[self.prompt_offsets[item]:self.prompt_offsets[item + 1]]
+        input_ids = np.full((1, self.max_prompt_length), self.tokenizer.pad_token_id, dtype=np.int64)
+        input_ids[0, self.max_prompt_length - len(ids):] = ids
+        attention_mask = np.zeros((1, self.max_prompt_length), dtype=np.int64)
+        attention_mask[0, self.max_prompt_length - len(ids):] = 1
+        input_ids = torch.from_numpy(input_ids)
+        attention_mask = torch.from_numpy(attention_mask)
+        position_ids = compute_position_id_with_mask(attention_mask)
+        row_dict['input_ids'] = input_ids[0]
+        row_dict['attention_mask'] = attention_mask[0]
+        row_dict['position_ids'] = position_ids[0]
+        row_dict["index"] = row_dict.get("extra_info", {}).get("index", 0)
+        return row_dict
+
+
+def make_parquet(path, num_rows, question_length, seed=0):
+    """MCQA-like rows with nested extra_info / options structs"""
+    rng = np.random.default_rng(seed)
+    words = np.array(["patient", "presents", "with", "fever", "and", "the", "most", "likely", "diagnosis", "is"])
+    rows = []
+    for i in range(num_rows):
+        question = " ".join(rng.choice(words, question_length))
+        rows.append({
+            "data_source": "medqa",
+            "reward_actor": "RewardActorMCQA",
+            "prompt": f"User: {question}\nAssistant: <think>",
+            "reward_model": {"style": "rule", "ground_truth": "A"},
+            "extra_info": {
+                "index": i,
+                "question": question,
+                "options": {key: " ".join(rng.choice(words, 8)) for key in "ABCDE"},
+            },
+        })
+    pd.DataFrame(rows).to_parquet(path)
+
+
+def read_smaps_rollup():
+    """(rss, pss, private) of the current process in MB"""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    private = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return values.get("Rss", 0), values.get("Pss", 0), private
+
+
+# memory of the dataloader worker right after it started, and the number of items it read
+_worker_baseline = None
+_worker_items = 0
+
+
+def _record_baseline(worker_id):
+    global _worker_baseline
+    _worker_baseline = read_smaps_rollup()
+
+
+class MemoryProbe(Dataset):
+    """Returns how much the memory of the dataloader worker grew, every `interval` items (smaps is slow to read)"""
+
+    def __init__(self, dataset, interval=256):
+        self.dataset = dataset
+        self.interval = interval
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, item):
+        global _worker_items
+        self.dataset[item]
+        _worker_items += 1
+        if _worker_items % self.interval:
+            return get_worker_info().id, None
+        return get_worker_info().id, [now - start for now, start in zip(read_smaps_rollup(), _worker_baseline)]
+
+
+def worker_memory(dataset, num_workers, indices):
+    loader = DataLoader(MemoryProbe(dataset),
+                        batch_size=64,
+                        num_workers=num_workers,
+                        sampler=indices,
+                        collate_fn=lambda batch: batch,
+                        worker_init_fn=_record_baseline,
+                        multiprocessing_context="fork")
+    last = {}
+    for batch in loader:
+        for worker_id, memory in batch:
+            if memory is not None:
+                last[worker_id] = memory
+    return np.mean([m[0] for m in last.values()]), np.mean([m[1] for m in last.values()]), np.mean(
+        [m[2] for m in last.values()])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", type=str, required=True)
+    parser.add_argument("--num_rows", type=int, default=100000)
+    parser.add_argument("--question_length", type=int, default=200)
+    parser.add_argument("--max_prompt_length", type=int, default=1024)
+    parser.add_argument("--num_items", type=int, default=None, help="items read per backend, all by default")
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--tokenize_num_workers", type=int, default=0)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    cache_dir = args.cache_dir or tempfile.mkdtemp()
+    parquet_file = os.path.join(cache_dir, "benchmark.parquet")
+    if not os.path.exists(parquet_file):
+        make_parquet(parquet_file, args.num_rows, args.question_length)
+    kwargs = dict(parquet_files=parquet_file,
+                  tokenizer=tokenizer,
+                  max_prompt_length=args.max_prompt_length,
+                  apply_chat_template=False,
+                  cache_dir=cache_dir,
+                  tokenize_num_workers=args.tokenize_num_workers)
+
+    stt = time.time()
+    RLHFDataset(**kwargs)
+    print(f"first build (parquet -> arrow + pre-tokenization): {time.time() - stt:.2f}s")
+
+    # memory columns are growths in MB: of the main process while building the dataset, and of every
+    # dataloader worker (mean over workers) while reading the items in random order
+    print(f"{'backend':<8} {'init (s)':>9} {'items/s':>9} {'main rss':>9} {'worker rss':>11} {'worker pss':>11} "
+          f"{'worker private':>15}")
+    for name, cls in (("pandas", PandasRLHFDataset), ("arrow", RLHFDataset)):
+        start_rss = read_smaps_rollup()[0]
+        stt = time.time()
+        dataset = cls(**kwargs)
+        init_time = time.time() - stt
+        main_rss = read_smaps_rollup()[0] - start_rss
+
+        num_items = min(args.num_items or len(dataset), len(dataset))
+        indices = random.Random(1).sample(range(len(dataset)), num_items)
+        stt = time.time()
+        for i in indices:
+            dataset[i]
+        throughput = len(indices) / (time.time() - stt)
+
+        rss, pss, private = worker_memory(dataset, args.num_workers, indices)
+        print(f"{name:<8} {init_time:>9.2f} {throughput:>9.0f} {main_rss:>9.1f} {rss:>11.1f} {pss:>11.1f} "
+              f"{private:>15.1f}")
+        del dataset
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import time
+import heapq
+import argparse
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from tensordict import TensorDict
+
+from verl.utils.seqlen_balancing import (karmarkar_karp, karmarkar_karp_vectorized, greedy_partition,
+                                         get_seqlen_balanced_partitions, rearrange_micro_batches, seqlen_cost)
+
+
+# the State/Set based implementation that karmarkar_karp replaced
+def reference_karmarkar_karp(seqlen_list: List[int], k_partitions: int, equal_size: bool):
+    # see: https://en.wikipedia.org/wiki/Largest_differencing_method
+    class Set:
+
+        def __init__(self) -> None:
+            self.sum = 0
+            self.items = []
+
+        def add(self, idx: int, val: int):
+            self.items.append((idx, val))
+            self.sum += val
+
+        def merge(self, other):
+            for idx, val in other.items:
+                self.items.append((idx, val))
+                self.sum += val
+
+        def __lt__(self, other):
+            if self.sum != other.sum:
+                return self.sum < other.sum
+            if len(self.items) != len(other.items):
+                return len(self.items) < len(other.items)
+            return self.items < other.items
+
+    class State:
+
+        def __init__(self, items: List[Tuple[int, int]], k: int) -> None:
+            self.k = k
+            # sets should always be decreasing order
+            self.sets = [Set() for _ in range(k)]
+            assert len(items) in [1, k], f"{len(items)} not in [1, {k}]"
+            for i, (idx, seqlen) in enumerate(items):
+                self.sets[i].add(idx=idx, val=seqlen)
+            self.sets = sorted(self.sets, reverse=True)
+
+        def spread(self):
+            return self.sets[0].sum - self.sets[-1].sum
+
+        def get_partitions(self):
+            partitions = []
+            for i in range(len(self.sets)):
+                cur_partition = []
+                for idx, _ in self.sets[i].items:
+                    cur_partition.append(idx)
+                partitions.append(cur_partition)
+            return partitions
+
+        def merge(self, other):
+            for i in range(self.k):
+                self.sets[i].merge(other.sets[self.k - 1 - i])
+            self.sets = sorted(self.sets, reverse=True)
+
+        @property
+        def spread(self) -> int:
+            return self.sets[0].sum - self.sets[-1].sum
+
+        def __lt__(self, other):
+            # least heap, let the state with largest spread to be popped first,
+            # if the spread is the same, let the state who has the largest set
+            # to be popped first.
+            if self.spread != other.spread:
+                return self.spread > other.spread
+            return self.sets[0] > other.sets[0]
+
+        def __repr__(self) -> str:
+            repr_str = "["
+            for i in range(self.k):
+                if i > 0:
+                    repr_str += ","
+                repr_str += "{"
+                for j, (_, seqlen) in enumerate(self.sets[i].items):
+                    if j > 0:
+                        repr_str += ","
+                    repr_str += str(seqlen)
+                repr_str += "}"
+            repr_str += "]"
+            return repr_str
+
+    sorted_seqlen_list = sorted([(seqlen, i) for i, seqlen in enumerate(seqlen_list)])
+    states_pq = []
+    if equal_size:
+        assert len(seqlen_list) % k_partitions == 0, f"{len(seqlen_list)} % {k_partitions} != 0"
+        for offset in range(0, len(sorted_seqlen_list), k_partitions):
+            items = []
+            for i in range(k_partitions):
+                seqlen, idx = sorted_seqlen_list[offset + i]
+                items.append((idx, seqlen))
+            heapq.heappush(states_pq, State(items=items, k=k_partitions))
+    else:
+        for seqlen, idx in sorted_seqlen_list:
+            heapq.heappush(states_pq, State(items=[(idx, seqlen)], k=k_partitions))
+
+    while len(states_pq) > 1:
+        state0 = heapq.heappop(states_pq)
+        state1 = heapq.heappop(states_pq)
+        # merge states
+        state0.merge(state1)
+        heapq.heappush(states_pq, state0)
+
+    final_state = states_pq[0]
+    partitions = final_state.get_partitions()
+    if equal_size:
+        for i, partition in enumerate(partitions):
+            assert len(partition) * \
+                k_partitions == len(seqlen_list), f"{len(partition)} * {k_partitions} != {len(seqlen_list)}"
+    return partitions
+
+
+def reference_rearrange(batch, partitions):
+    # the one-row-slice concatenation that rearrange_micro_batches replaced
+    return [torch.cat([batch[idx:idx + 1] for idx in partition]) for partition in partitions]
+
+
+def spread(costs, partitions):
+    sums = [sum(costs[i] for i in partition) for partition in partitions]
+    return (max(sums) - min(sums)) / (sum(sums) / len(sums))
+
+
+def timeit(fn, repeat, *args, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        stt = time.perf_counter()
+        out = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - stt)
+    return best, out
+
+
+def make_seqlens(rng, num_prompts, group_size, max_prompt_length, max_response_length):
+    # rollouts of one prompt share the prompt length, response lengths are long tailed
+    prompt_lengths = np.repeat(rng.integers(32, max_prompt_length, size=num_prompts), group_size)
+    response_lengths = np.minimum(rng.lognormal(np.log(max_response_length / 4), 0.8, size=num_prompts * group_size),
+                                  max_response_length).astype(np.int64) + 1
+    uids = np.repeat(np.arange(num_prompts), group_size)
+    return (prompt_lengths + response_lengths).tolist(), uids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1024, 4096, 8192])
+    parser.add_argument("--group_size", type=int, default=16)
+    parser.add_argument("--world_size", type=int, default=8)
+    parser.add_argument("--max_prompt_length", type=int, default=1024)
+    parser.add_argument("--max_response_length", type=int, default=8192)
+    parser.add_argument("--attn_coef", type=float, default=1.0 / (6 * 3584))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("dp rank balancing (equal_size=True), spread = (max - min) / mean of the partition costs")
+    print(f"{'bsz':>6} {'method':<26} {'time (ms)':>10} {'token spread':>13} {'cost spread':>12}")
+    for bsz in args.batch_sizes:
+        seqlens, uids = make_seqlens(rng, bsz // args.group_size, args.group_size, args.max_prompt_length,
+                                     args.max_response_length)
+        costs = seqlen_cost(seqlens, args.attn_coef)
+        methods = [
+            ("reference karmarkar_karp", reference_karmarkar_karp, (seqlens, args.world_size, True), {}),
+            ("greedy_partition", greedy_partition, (seqlens, args.world_size, True), {}),
+            ("karmarkar_karp", karmarkar_karp, (seqlens, args.world_size, True), {}),
+            ("karmarkar_karp_vectorized", karmarkar_karp_vectorized, (seqlens, args.world_size, True), {}),
+            ("karmarkar_karp + attn cost", karmarkar_karp, (costs, args.world_size, True), {}),
+            ("keep uid groups", get_seqlen_balanced_partitions, (seqlens, args.world_size, True), {"group_ids": uids}),
+        ]
+        for name, fn, fn_args, fn_kwargs in methods:
+            t, partitions = timeit(fn, args.repeat, *fn_args, **fn_kwargs)
+            print(f"{bsz:>6} {name:<26} {t * 1000:>10.2f} {spread(seqlens, partitions):>13.4f} "
+                  f"{spread(costs, partitions):>12.4f}")
+
+    print("\nmicro batch gathering")
+    print(f"{'bsz':>6} {'micro':>6} {'torch.cat (ms)':>15} {'index (ms)':>11} {'speedup':>8}")
+    seq_len = 2048
+    for bsz in (256, 1024):
+        seqlens = rng.integers(64, seq_len + 1, size=bsz)
+        attention_mask = (torch.arange(seq_len)[None, :] < torch.from_numpy(seqlens)[:, None]).long()
+        batch = TensorDict({
+            'input_ids': torch.randint(0, 32000, (bsz, seq_len)),
+            'attention_mask': attention_mask,
+            'position_ids': torch.arange(seq_len).expand(bsz, seq_len).clone(),
+            'old_log_probs': torch.randn(bsz, seq_len),
+            'advantages': torch.randn(bsz, seq_len),
+        }, batch_size=bsz)
+        t_new, (micro_batches, partitions) = timeit(rearrange_micro_batches, args.repeat, batch, seq_len * 16)
+        t_old, reference = timeit(reference_rearrange, args.repeat, batch, partitions)
+        for micro_batch, expected in zip(micro_batches, reference):
+            assert all(torch.equal(micro_batch[key], expected[key]) for key in expected.keys())
+        print(f"{bsz:>6} {len(partitions):>6} {t_old * 1000:>15.2f} {t_new * 1000:>11.2f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
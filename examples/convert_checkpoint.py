@@ -1,49 +1,218 @@
 import os
+import json
+import time
+import struct
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoConfig, AutoTokenizer
 import torch
-from glob import glob
-from collections import defaultdict
+
+SAFETENSORS_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+# state dicts of every rank, memory mapped once per worker process
+_rank_state_dicts = None
+
+
+def load_rank_state_dict(actor_path, world_size, rank):
+    # mmap keeps the shards in the page cache instead of reading them into process memory
+    return torch.load(os.path.join(actor_path, f"model_world_size_{world_size}_rank_{rank}.pt"),
+                      map_location="cpu", mmap=True, weights_only=False)
+
+
+def _init_worker(actor_path, world_size):
+    global _rank_state_dicts
+    _rank_state_dicts = [load_rank_state_dict(actor_path, world_size, rank) for rank in range(world_size)]
+
+
+def local_offsets(global_shape, mesh, placements, rank):
+    """
+    (offsets, local shape) of the shard held by `rank`, following the torch.chunk split used by DTensor
+    for every Shard placement of the mesh. Returns None for a replica that is not the first one.
+    """
+    coordinate = (mesh.mesh == rank).nonzero()[0].tolist()
+    offsets = [0] * len(global_shape)
+    shape = list(global_shape)
+    for mesh_dim, placement in enumerate(placements):
+        if placement.is_shard():
+            dim = placement.dim
+            chunk = -(-shape[dim] // mesh.size(mesh_dim))
+            start = min(coordinate[mesh_dim] * chunk, shape[dim])
+            offsets[dim] += start
+            shape[dim] = min(chunk, shape[dim] - start)
+        elif coordinate[mesh_dim] != 0:
+            # replicated (or partial, which FSDP does not produce) along this mesh dim
+            return None
+    return offsets, shape
+
+
+def tensor_meta(value):
+    """global shape and dtype of a state dict entry, DTensor and ShardedTensor report the full shape"""
+    return list(value.shape), value.dtype
+
+
+def output_dtype_and_nbytes(meta, dtype=None):
+    shape, key_dtype = meta
+    if dtype is not None and key_dtype.is_floating_point:
+        key_dtype = dtype
+    return key_dtype, torch.Size(shape).numel() * torch.empty((), dtype=key_dtype).element_size()
+
+
+def assemble(key, dtype=None):
+    """Full tensor of `key` built from the local shards of every rank."""
+    values = [state_dict[key] for state_dict in _rank_state_dicts]
+    first = values[0]
+    if hasattr(first, "placements"):
+        # DTensor
+        full = torch.empty(first.shape, dtype=first.dtype)
+        for rank, value in enumerate(values):
+            located = local_offsets(first.shape, first.device_mesh, first.placements, rank)
+            if located is None:
+                continue
+            offsets, shape = located
+            index = tuple(slice(o, o + s) for o, s in zip(offsets, shape))
+            full[index] = value.to_local().reshape(shape)
+    elif hasattr(first, "local_shards"):
+        # ShardedTensor keeps the offsets of its shards in the metadata
+        full = torch.empty(first.shape, dtype=first.dtype)
+        for value in values:
+            for shard in value.local_shards():
+                index = tuple(slice(o, o + s)
+                              for o, s in zip(shard.metadata.shard_offsets, shard.metadata.shard_sizes))
+                full[index] = shard.tensor
+    else:
+        full = first
+    if dtype is not None and full.is_floating_point():
+        full = full.to(dtype)
+    return full.contiguous()
+
+
+def write_safetensors(path, keys, metas, dtype=None):
+    """
+    Write one safetensors file, one tensor at a time. The header is computed from the shapes up front,
+    so no more than one full tensor is ever held in memory.
+    """
+    header = {"__metadata__": {"format": "pt"}}
+    offset = 0
+    for key in keys:
+        key_dtype, nbytes = output_dtype_and_nbytes(metas[key], dtype)
+        header[key] = {
+            "dtype": SAFETENSORS_DTYPES[key_dtype],
+            "shape": metas[key][0],
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # the data section must start 8 byte aligned
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for key in keys:
+            tensor = assemble(key, dtype)
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().data)
+            del tensor
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def plan_shards(keys, metas, max_shard_bytes, dtype=None):
+    """Split the keys, in order, into files of at most max_shard_bytes (a larger tensor gets its own file)."""
+    shards = [[]]
+    shard_bytes = 0
+    total_bytes = 0
+    for key in keys:
+        _, nbytes = output_dtype_and_nbytes(metas[key], dtype)
+        if shards[-1] and shard_bytes + nbytes > max_shard_bytes:
+            shards.append([])
+            shard_bytes = 0
+        shards[-1].append(key)
+        shard_bytes += nbytes
+        total_bytes += nbytes
+    return shards, total_bytes
+
 
 def main():
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--step", type=str)
+    parser.add_argument("--step", type=str, help="global step to convert, or `latest` for the last committed one")
     parser.add_argument("--checkpoint_inputpath", type=str)
     parser.add_argument("--checkpoint_outputpath", type=str)
     parser.add_argument("--world_size", type=int)
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--max_shard_size_gb", type=float, default=2.0)
+    parser.add_argument("--dtype", type=str, default=None, choices=["bfloat16", "float16", "float32"],
+                        help="cast floating point weights, keeps the saved dtype by default")
     args = parser.parse_args()
 
     step = args.step
     checkpoint_inputpath = args.checkpoint_inputpath
     checkpoint_outputpath = args.checkpoint_outputpath
     world_size = args.world_size
+    dtype = getattr(torch, args.dtype) if args.dtype else None
+
+    if step == "latest":
+        # only committed checkpoints are listed here, see RayPPOTrainer._save_checkpoint
+        with open(f"{checkpoint_inputpath}/latest_checkpointed_iteration.txt") as f:
+            step = f.read().strip()
 
-    state_dict = defaultdict(list)
+    stt = time.time()
+    actor_path = f"{checkpoint_inputpath}/global_step_{step}/actor"
+    output_path = f"{checkpoint_outputpath}/global_step_{step}"
+    os.makedirs(output_path, exist_ok=True)
 
-    for rank in range(world_size):
-        filepath = f"{checkpoint_inputpath}/global_step_{step}/actor/model_world_size_{world_size}_rank_{rank}.pt"
-        print('loading', filepath)
-        this_state_dict = torch.load(filepath)
-        for key, value in this_state_dict.items():
-            state_dict[key].append(value.to_local())
+    config = AutoConfig.from_pretrained(f"{actor_path}/huggingface")
+    config.save_pretrained(output_path)
 
-    for key in state_dict:
-        state_dict[key] = torch.cat(state_dict[key], dim=0)
+    # shapes and placements only, the tensor data stays on disk
+    state_dict = load_rank_state_dict(actor_path, world_size, 0)
+    metas = {key: tensor_meta(value) for key, value in state_dict.items()}
+    keys = list(metas.keys())
+    if getattr(config, "tie_word_embeddings", False) and "model.embed_tokens.weight" in metas:
+        # save_pretrained does not store the tied copy either
+        keys = [key for key in keys if key != "lm_head.weight"]
+    del state_dict
 
-    os.makedirs(f"{checkpoint_outputpath}/global_step_{step}", exist_ok=True)
+    shards, total_bytes = plan_shards(keys, metas, int(args.max_shard_size_gb * 1024**3), dtype)
+    if len(shards) == 1:
+        filenames = ["model.safetensors"]
+    else:
+        filenames = [f"model-{i + 1:05d}-of-{len(shards):05d}.safetensors" for i in range(len(shards))]
 
-    config = AutoConfig.from_pretrained(f"{checkpoint_inputpath}/global_step_{step}/actor/huggingface")
-    config.save_pretrained(f"{checkpoint_outputpath}/global_step_{step}")
+    print(f"writing {len(keys)} tensors ({total_bytes / 1024**3:.2f} GB) into {len(shards)} files")
+    with ProcessPoolExecutor(max_workers=min(args.num_workers, len(shards)),
+                             initializer=_init_worker,
+                             initargs=(actor_path, world_size)) as executor:
+        futures = [
+            executor.submit(write_safetensors, os.path.join(output_path, filename), shard, metas, dtype)
+            for filename, shard in zip(filenames, shards)
+        ]
+        for future in futures:
+            print("saved", future.result())
 
-    model = AutoModelForCausalLM.from_config(config)
-    model.load_state_dict(state_dict)
+    if len(shards) > 1:
+        index = {
+            "metadata": {"total_size": total_bytes},
+            "weight_map": {key: filename for filename, shard in zip(filenames, shards) for key in shard},
+        }
+        with open(os.path.join(output_path, "model.safetensors.index.json"), "w") as f:
+            json.dump(index, f, indent=2)
 
-    model.save_pretrained(f"{checkpoint_outputpath}/global_step_{step}", max_shard_size="10GB")
+    tokenizer = AutoTokenizer.from_pretrained(f"{actor_path}/huggingface")
+    tokenizer.save_pretrained(output_path)
+    print(f"converted global_step_{step} in {time.time() - stt:.1f}s")
 
-    tokenizer = AutoTokenizer.from_pretrained(f"{checkpoint_inputpath}/global_step_{step}/actor/huggingface")
-    tokenizer.save_pretrained(f"{checkpoint_outputpath}/global_step_{step}")
-    
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
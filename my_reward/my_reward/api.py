@@ -8,6 +8,10 @@ import traceback
 # import commentjson
 import re
 import time
+import random
+import queue
+import asyncio
+import threading
 import httpx
 from collections import defaultdict
 from typing import List, Dict
@@ -144,6 +148,255 @@ def oneapi_post_by_langchain(
 
     return result
 
+class AsyncJudgeClient:
+    """
+    Native asyncio client for an OpenAI-compatible judge server.
+
+    One client owns a persistent event loop thread and a pooled `httpx.AsyncClient`, so the
+    connections survive across `batch_compute_score` calls. Requests are issued through a sliding
+    window whose size follows AIMD: it grows by about one slot per round trip while latency stays
+    close to the observed floor, and halves on 429/5xx/timeouts (at most once per round trip).
+    """
+
+    RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+    # seconds, caps both the exponential backoff and a server supplied Retry-After
+    MAX_RETRY_DELAY = 30
+
+    def __init__(
+        self,
+        url,
+        key="EMPTY",
+        max_concurrency: int=8,
+        max_concurrency_limit: int=None,
+        min_concurrency: int=1,
+        max_retries: int=3,
+        timeout: float=1200.0,
+        latency_tolerance: float=2.0,
+    ):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.min_window = max(1, min_concurrency)
+        self.max_window = max(max_concurrency_limit or max_concurrency * 4, self.min_window)
+        self.window = float(min(max(max_concurrency, self.min_window), self.max_window))
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.latency_ewma = None
+        self.latency_min = None
+        self.last_decrease = 0.0
+        self.stats = defaultdict(int)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="judge-client", daemon=True)
+        self._thread.start()
+        # loop-bound objects must be created inside the loop
+        self._client, self._cond = asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        client = httpx.AsyncClient(
+            base_url=f"{self.url}/v1",
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.key}",
+            },
+            limits=httpx.Limits(max_connections=self.max_window, max_keepalive_connections=self.max_window),
+            timeout=httpx.Timeout(self.timeout, connect=60.0),
+        )
+        return client, asyncio.Condition()
+
+    async def _acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+
+    async def _release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _on_success(self, latency):
+        self.stats["success"] += 1
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.9 * self.latency_ewma + 0.1 * latency
+        self.latency_min = latency if self.latency_min is None else min(self.latency_min, latency)
+        if self.latency_ewma <= self.latency_min * self.latency_tolerance:
+            # additive increase: roughly +1 slot per window of successful replies
+            self.window = min(self.max_window, self.window + 1.0 / self.window)
+        else:
+            # the server is queueing, back off gently
+            self.window = max(self.min_window, self.window - 0.5 / self.window)
+
+    def _on_overload(self):
+        self.stats["overload"] += 1
+        now = time.time()
+        # multiplicative decrease, once per round trip so a burst of errors does not collapse the window
+        if now - self.last_decrease >= (self.latency_ewma or 1.0):
+            self.window = max(self.min_window, self.window / 2.0)
+            self.last_decrease = now
+            self.stats["decrease"] += 1
+
+    async def _post(self, payload, model):
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            await self._acquire()
+            stt = time.time()
+            try:
+                response = await self._client.post("/chat/completions", json=payload)
+                if response.status_code in self.RETRY_STATUS:
+                    self._on_overload()
+                    retry_after = response.headers.get("retry-after")
+                    print(f"########### ONEAPI Error: judge server returned {response.status_code}")
+                else:
+                    # any other error (400/401/404/422, a malformed reply) fails the same way on every retry
+                    try:
+                        response.raise_for_status()
+                        message = response.json()["choices"][0]["message"]
+                    except Exception as e:
+                        print(f"########### ONEAPI Error, not retried: {e}")
+                        self.stats["failure"] += 1
+                        return None
+                    self._on_success(time.time() - stt)
+                    if model == "deepseek-r1":
+                        return [message.get("content"), message.get("reasoning_content", "")]
+                    return message.get("content")
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                self._on_overload()
+                print(f"########### ONEAPI Error: {e}")
+            finally:
+                await self._release()
+            if attempt == self.max_retries:
+                # the verdict has failed, waiting would only delay the reward step
+                break
+            self.stats["retry"] += 1
+            try:
+                delay = min(float(retry_after), self.MAX_RETRY_DELAY)
+            except (TypeError, ValueError):
+                delay = min(2 ** attempt, self.MAX_RETRY_DELAY) + random.random()
+            await asyncio.sleep(delay)
+        self.stats["failure"] += 1
+        return None
+
+    async def _indexed_post(self, i, payload, model):
+        return i, await self._post(payload, model)
+
+    async def _stream(self, payloads, model, output_queue):
+        tasks = [asyncio.ensure_future(self._indexed_post(i, payload, model)) for i, payload in enumerate(payloads)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                output_queue.put(await future)
+        except Exception as e:
+            print(f"########### ONEAPI Error: {e}")
+            traceback.print_exc()
+            for task in tasks:
+                task.cancel()
+            output_queue.put(e)
+
+    def stream(
+        self,
+        prompt,
+        model="",
+        system_prompt=None,
+        max_tokens: int=4096,
+        temperature: float=0.9,
+        top_p: float=1.0,
+    ):
+        """
+        Yield `(index, content)` pairs in completion order. `content` is None if every retry failed.
+        """
+        if isinstance(prompt, str):
+            prompt = [prompt]
+        if system_prompt is None or isinstance(system_prompt, str):
+            system_prompt = [system_prompt for _ in range(len(prompt))]
+
+        payloads = []
+        for p, sys_p in zip(prompt, system_prompt):
+            messages = []
+            if sys_p:
+                messages.append({"role": "system", "content": sys_p})
+            messages.append({"role": "user", "content": p})
+            payload = {
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "top_p": top_p,
+            }
+            if max_tokens > 0:
+                payload["max_tokens"] = max_tokens
+            payloads.append(payload)
+
+        output_queue = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._stream(payloads, model, output_queue), self._loop)
+        for _ in range(len(payloads)):
+            item = output_queue.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_judge_clients = {}
+_judge_clients_lock = threading.Lock()
+
+def get_judge_client(url, key="EMPTY", **kwargs):
+    """
+    Return the process-wide `AsyncJudgeClient` for (url, key) and the client options in `kwargs`,
+    creating it on first use. Callers with different options get their own client and window.
+    """
+    client_key = (url, key, tuple(sorted(kwargs.items())))
+    with _judge_clients_lock:
+        client = _judge_clients.get(client_key)
+        if client is None:
+            client = AsyncJudgeClient(url, key=key, **kwargs)
+            _judge_clients[client_key] = client
+    return client
+
+def oneapi_stream_by_async(
+    prompt,
+    url,
+    model="",
+    key="EMPTY",
+    system_prompt=None,
+    max_tokens: int=4096,
+    temperature: float=0.9,
+    top_p: float=1.0,
+    max_concurrency: int=8,
+    max_concurrency_limit: int=None,
+    **kwargs,
+):
+    """
+    Same arguments as `oneapi_post_by_langchain`, but yields `(index, content)` as soon as each
+    judge reply arrives. `max_concurrency` is the initial window, `max_concurrency_limit` its cap.
+    """
+    client = get_judge_client(
+        url,
+        key=key,
+        max_concurrency=max_concurrency,
+        max_concurrency_limit=max_concurrency_limit,
+    )
+    yield from client.stream(
+        prompt,
+        model=model,
+        system_prompt=system_prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+    )
+
+def oneapi_post_by_async(prompt, url, **kwargs):
+    if isinstance(prompt, str):
+        prompt = [prompt]
+    result = [None for _ in prompt]
+    for i, res in oneapi_stream_by_async(prompt, url, **kwargs):
+        result[i] = res
+    return result
+
 def read_json(sample, default=Dict):
     if default == List:
         result = []
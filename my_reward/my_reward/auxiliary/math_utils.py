@@ -3,6 +3,8 @@ import re
 
 from sympy.parsing.latex import parse_latex
 
+from my_reward.auxiliary.repetition import repetition_score
+
 try:
     from math_verify import parse, verify
 except ImportError:
@@ -11,44 +13,7 @@ except ImportError:
     verify = None
 
 def repeatness(s: str):
-
-    def ranks(l):
-        index = {v: i for i, v in enumerate(sorted(set(l)))}
-        return [index[v] for v in l]
-
-    def suffixArray(s):
-        line = ranks(s)
-        # print(line)
-        n, k, ans, sa = len(s), 1, line, [0] * len(s)
-        while k < n - 1:
-            line = ranks(list(zip_longest(line, islice(line, k, None), fillvalue=-1)))
-            ans, k = line, k << 1
-        for i, k in enumerate(ans):
-            sa[k] = i
-        return ans, sa
-
-    def lcp(arr, suffixArr, inv_suff):
-        n, ans, k = len(arr), [0] * len(arr), 0
-        for i in range(n):
-            if inv_suff[i] == n - 1:
-                k = 0
-                continue
-            j = suffixArr[inv_suff[i] + 1]
-            while i + k < n and j + k < n and arr[i + k] == arr[j + k]:
-                k += 1
-            ans[inv_suff[i]] = k
-            if k > 0:
-                k -= 1
-
-        return ans
-
-    arr = [ord(i) for i in s]
-    n = len(arr)
-    if n <= 1:
-        return 0
-    c, sa = suffixArray(arr)
-    cnt = sum(lcp(arr, sa, c))
-    return (cnt * 2 / (n * (n + 1))) > 0.2
+    return repetition_score(s) > 0.2
 
 SUBSTITUTIONS = [
     ("an ", ""),
@@ -418,6 +383,24 @@ async def is_equal(str1, str2, executor, math_mode="legacy"):
     return await is_latex_equal(str1, str2, executor, math_mode)
 
 
+def batch_is_equal(pairs, pool):
+    """
+    Synchronous, batched `is_equal` with math_mode="math_verify" on a `MathVerifyPool`.
+    Returns a list of `(equal_flag, timeout_flag)`.
+    """
+    results = [None] * len(pairs)
+    verify_index = []
+    for i, (str1, str2) in enumerate(pairs):
+        if is_equiv(str1, str2):
+            results[i] = (True, False)
+        else:
+            verify_index.append(i)
+    verify_results = pool.verify_many([pairs[i] for i in verify_index])
+    for i, result in zip(verify_index, verify_results):
+        results[i] = result
+    return results
+
+
 def solution2answer(solution: str, math_mode="eval_peeking") -> str:
     answer = solution
     if math_mode == "eval_peeking":
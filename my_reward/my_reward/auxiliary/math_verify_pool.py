@@ -0,0 +1,181 @@
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+from multiprocessing.connection import wait
+
+def _verify_worker(conn, parse_cache_size):
+    """
+    Worker loop: import math_verify once, then answer `(str1, str2)` requests with
+    `verify(parse(str1), parse(str2))` until the pipe is closed. parse() results are memoized
+    because ground truths and common answers repeat across rollouts.
+    """
+    from math_verify import parse, verify
+    cached_parse = lru_cache(maxsize=parse_cache_size)(parse)
+    conn.send("READY")
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+        str1, str2 = msg
+        try:
+            result = bool(verify(cached_parse(str1), cached_parse(str2)))
+        except Exception:
+            result = False
+        conn.send(result)
+
+
+class _Worker:
+
+    def __init__(self, ctx, parse_cache_size):
+        self.conn, child_conn = ctx.Pipe(duplex=True)
+        self.process = ctx.Process(target=_verify_worker, args=(child_conn, parse_cache_size), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.num_tasks = 0
+        self.ready = False
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        self.conn.close()
+
+
+class MathVerifyPool:
+    """
+    Persistent pool of warm math_verify worker processes.
+
+    Unlike threads, a task that exceeds `timeout` is stopped for real: its worker is killed and replaced.
+    Workers are also recycled after `max_tasks_per_worker` tasks to bound the growth of sympy caches.
+    """
+
+    def __init__(
+        self,
+        num_workers: int=None,
+        timeout: float=1.0,
+        max_tasks_per_worker: int=2000,
+        parse_cache_size: int=4096,
+        mp_context: str="forkserver",
+    ):
+        self.num_workers = num_workers or os.cpu_count()
+        self.timeout = timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.parse_cache_size = parse_cache_size
+        self._ctx = multiprocessing.get_context(mp_context)
+        self._lock = threading.Lock()
+        self._workers = [_Worker(self._ctx, self.parse_cache_size) for _ in range(self.num_workers)]
+        self.timeout_count = 0
+        self.restart_count = 0
+
+    def _replace(self, worker):
+        worker.kill()
+        self._workers[self._workers.index(worker)] = _Worker(self._ctx, self.parse_cache_size)
+        self.restart_count += 1
+
+    def _check_ready(self, worker):
+        # the first message of a worker announces that math_verify is imported,
+        # so the import never counts against a task timeout
+        try:
+            worker.ready = worker.conn.recv() == "READY"
+        except (EOFError, OSError):
+            worker.ready = False
+        if not worker.ready:
+            # almost always deterministic (e.g. math_verify is not installed), do not respawn forever
+            raise RuntimeError("math_verify worker failed to start")
+
+    def verify_many(self, pairs):
+        """
+        Run `verify(parse(a), parse(b))` for every `(a, b)` in `pairs`.
+
+        Returns a list of `(equal_flag, timeout_flag)` in input order. Identical pairs are computed once.
+        """
+        unique_pairs = list(dict.fromkeys(pairs))
+        unique_results = {}
+        with self._lock:
+            pending = deque(unique_pairs)
+            busy = {}
+            while pending or busy:
+                for worker in list(self._workers):
+                    if not pending:
+                        break
+                    if worker in busy or not worker.ready:
+                        continue
+                    pair = pending.popleft()
+                    try:
+                        worker.conn.send(pair)
+                    except (BrokenPipeError, OSError):
+                        pending.appendleft(pair)
+                        self._replace(worker)
+                        continue
+                    busy[worker] = (pair, time.monotonic())
+
+                starting = [worker for worker in self._workers if not worker.ready]
+                if busy:
+                    next_deadline = min(start for _, start in busy.values()) + self.timeout
+                    wait_timeout = max(0.0, next_deadline - time.monotonic())
+                else:
+                    wait_timeout = None
+                ready = set(wait([worker.conn for worker in list(busy.keys()) + starting], timeout=wait_timeout))
+
+                for worker in starting:
+                    if worker.conn in ready:
+                        self._check_ready(worker)
+
+                for worker in list(busy.keys()):
+                    if worker.conn not in ready:
+                        continue
+                    pair, _ = busy.pop(worker)
+                    try:
+                        unique_results[pair] = (worker.conn.recv(), False)
+                    except (EOFError, OSError):
+                        # the worker died, e.g. killed by the OOM killer
+                        unique_results[pair] = (False, False)
+                        self._replace(worker)
+                        continue
+                    worker.num_tasks += 1
+                    if worker.num_tasks >= self.max_tasks_per_worker:
+                        self._replace(worker)
+
+                now = time.monotonic()
+                for worker, (pair, start) in list(busy.items()):
+                    if now - start >= self.timeout:
+                        busy.pop(worker)
+                        unique_results[pair] = (False, True)
+                        self.timeout_count += 1
+                        self._replace(worker)
+
+        return [unique_results[pair] for pair in pairs]
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                try:
+                    worker.conn.send(None)
+                except Exception:
+                    pass
+                worker.kill()
+            self._workers = []
+
+
+_math_verify_pool = None
+_math_verify_pool_lock = threading.Lock()
+
+def get_math_verify_pool(num_workers: int=None, timeout: float=1.0, **kwargs):
+    """
+    Return the process-wide `MathVerifyPool`, starting its workers on first use.
+    """
+    global _math_verify_pool
+    with _math_verify_pool_lock:
+        if _math_verify_pool is None:
+            _math_verify_pool = MathVerifyPool(num_workers=num_workers, timeout=timeout, **kwargs)
+            atexit.register(_math_verify_pool.shutdown)
+    return _math_verify_pool
@@ -0,0 +1,127 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from my_reward.utils.time_utils import timeprint
+
+def _codes(s: str):
+    # code points of the characters, without a Python loop
+    return np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32)
+
+
+def suffix_array(codes):
+    """
+    Suffix array by prefix doubling, every round is one vectorized sort.
+
+    Returns `(sa, levels)`: `sa[r]` is the start of the suffix with rank r, and `levels[k][i]` is the
+    rank of the first 2**k characters of the suffix at i. The last level has all ranks distinct.
+    """
+    n = len(codes)
+    rank = np.unique(codes, return_inverse=True)[1].astype(np.int64).reshape(-1)
+    levels = [rank]
+    k = 1
+    while n > 0 and rank.max() < n - 1:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n - k] = rank[k:]
+        rank = np.unique(rank * (n + 1) + (second + 1), return_inverse=True)[1].astype(np.int64).reshape(-1)
+        levels.append(rank)
+        k <<= 1
+    sa = np.empty(n, dtype=np.int64)
+    sa[rank] = np.arange(n)
+    return sa, levels
+
+
+def lcp_array(sa, levels):
+    """
+    Longest common prefix of every pair of suffixes adjacent in `sa`, length n - 1.
+
+    All pairs are resolved together by binary lifting over the doubling ranks: at level k the two
+    suffixes share their next 2**k characters iff their level-k ranks are equal. This gives the same
+    result as Kasai's algorithm without a per-character Python loop.
+    """
+    n = len(sa)
+    i = sa[:-1].copy()
+    j = sa[1:].copy()
+    lcp = np.zeros(max(n - 1, 0), dtype=np.int64)
+    for k in range(len(levels) - 1, -1, -1):
+        # position n is the end of the string, it never equals a real rank
+        rank = np.append(levels[k], -1)
+        same = rank[i] == rank[j]
+        step = same.astype(np.int64) << k
+        lcp += step
+        i += step
+        j += step
+    return lcp
+
+
+def repetition_score(s: str):
+    """
+    Sum of the LCPs of adjacent suffixes divided by the sum of the lengths of all suffixes.
+    The higher the score, the higher the proportion of repeated substrings. Score range: [0, 1]
+    """
+    n = len(s)
+    if n <= 1:
+        return 0
+    sa, levels = suffix_array(_codes(s))
+    cnt = int(lcp_array(sa, levels).sum())
+    return cnt * 2 / (n * (n + 1))
+
+
+def _repetition_score_chunk(texts):
+    return [repetition_score(s) for s in texts]
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def _get_executor(num_workers: int):
+    with _executors_lock:
+        executor = _executors.get(num_workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            _executors[num_workers] = executor
+    return executor
+
+
+def _drop_executor(num_workers: int, executor):
+    with _executors_lock:
+        if _executors.get(num_workers) is executor:
+            del _executors[num_workers]
+    executor.shutdown(wait=False)
+
+
+def batch_repetition_score(texts, num_workers: int=0, chunk_size: int=16):
+    """
+    `repetition_score` of every text. With `num_workers > 0` chunks are fanned out to a persistent
+    process pool, which only pays off for large batches of long responses.
+    """
+    texts = list(texts)
+    if num_workers <= 0 or len(texts) <= chunk_size:
+        return _repetition_score_chunk(texts)
+    # interleave by length so every chunk gets a similar amount of work
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    num_chunks = (len(texts) + chunk_size - 1) // chunk_size
+    chunks = [order[c::num_chunks] for c in range(num_chunks)]
+    chunk_texts = [[texts[i] for i in chunk] for chunk in chunks]
+    for attempt in range(2):
+        executor = _get_executor(num_workers)
+        try:
+            chunk_scores_list = list(executor.map(_repetition_score_chunk, chunk_texts))
+            break
+        except BrokenProcessPool:
+            # a dead worker breaks the pool for good, start a new one so later batches still work
+            _drop_executor(num_workers, executor)
+            if attempt == 1:
+                raise
+            timeprint("WARNING: repetition process pool is broken, retrying on a new pool")
+    scores = [None] * len(texts)
+    for chunk, chunk_scores in zip(chunks, chunk_scores_list):
+        for i, score in zip(chunk, chunk_scores):
+            scores[i] = score
+    return scores
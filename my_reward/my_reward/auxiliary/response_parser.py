@@ -0,0 +1,176 @@
+import re
+from bisect import bisect_left
+
+# chat template tokens that may follow the answer or end the prompt
+END_TOKENS = ["</s>", "<|im_end|>", "<|endoftext|>", "<|end_of_sentence|>"]
+
+THINK_OPEN, THINK_CLOSE, ANSWER_OPEN, ANSWER_CLOSE = "<think>", "</think>", "<answer>", "</answer>"
+TAGS = [THINK_OPEN, THINK_CLOSE, ANSWER_OPEN, ANSWER_CLOSE]
+
+TAG_PATTERN = re.compile(r"</?(?:think|answer)>")
+LEADING_SPACE = re.compile(r"\s*")
+
+
+def _strip_span(s: str, start: int, end: int):
+    """(start, end) of s[start:end].strip() in s, without copying the slice"""
+    start = LEADING_SPACE.match(s, start, end).end()
+    while end > start and s[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def endswith_think(s: str):
+    for x in END_TOKENS:
+        s = s.replace(x, "")
+    s = s.strip()
+    return s.endswith(THINK_OPEN)
+
+
+class ParsedResponse:
+    """
+    Everything the reward actors read from the layout of one response, from a single scan for the tags.
+
+    `think` / `answer` are the think and answer contents with the tags removed and stripped, `think_span` /
+    `answer_span` their (start, end) in the response. `tags` maps every tag to its positions, `trailing` is
+    what follows the first </answer> apart from END_TOKENS and whitespace (None without </answer>).
+    `think_in_prompt` / `answer_tag_in_prompt` describe the prompt when it was given to the parser.
+    """
+
+    __slots__ = [
+        "response", "overlong", "think_in_prompt", "answer_tag_in_prompt", "tags", "stripped_span", "think_span",
+        "answer_span", "think", "answer", "trailing"
+    ]
+
+    def __init__(self, response: str, overlong: bool = False, think_in_prompt: bool = None,
+                 answer_tag_in_prompt: bool = None):
+        self.response = response
+        self.overlong = overlong
+        self.think_in_prompt = think_in_prompt
+        self.answer_tag_in_prompt = answer_tag_in_prompt
+
+        self.tags = {tag: [] for tag in TAGS}
+        for match in TAG_PATTERN.finditer(response):
+            self.tags[match.group()].append(match.start())
+        self.stripped_span = _strip_span(response, 0, len(response))
+
+        # think / answer as get_think_and_answer splits them: an opening <think> at the very start is dropped,
+        # the think ends at the first </think>, and the answer is inside the first <answer>...</answer> after it
+        think_start = len(THINK_OPEN) if self._first(THINK_OPEN) == 0 else 0
+        think_end = self._first(THINK_CLOSE)
+        if think_end is not None:
+            self.think_span = _strip_span(response, think_start, think_end)
+            answer_start = think_end + len(THINK_CLOSE)
+        else:
+            self.think_span = (0, 0)
+            answer_start = think_start
+        answer_open = self._first(ANSWER_OPEN, answer_start)
+        if answer_open is not None:
+            answer_start = answer_open + len(ANSWER_OPEN)
+        answer_end = self._first(ANSWER_CLOSE, answer_start)
+        self.answer_span = _strip_span(response, answer_start, len(response) if answer_end is None else answer_end)
+        self.think = response[self.think_span[0]:self.think_span[1]]
+        self.answer = response[self.answer_span[0]:self.answer_span[1]]
+
+        answer_close = self._first(ANSWER_CLOSE)
+        if answer_close is None:
+            self.trailing = None
+        else:
+            trailing = response[answer_close + len(ANSWER_CLOSE):self.stripped_span[1]]
+            for x in END_TOKENS:
+                trailing = trailing.replace(x, "")
+            self.trailing = trailing.strip()
+
+    def _first(self, tag: str, start: int = 0):
+        """Position of the first `tag` at or after `start`, None if there is none"""
+        positions = self.tags[tag]
+        i = bisect_left(positions, start)
+        return positions[i] if i < len(positions) else None
+
+    @property
+    def tag_counts(self):
+        return {tag: len(positions) for tag, positions in self.tags.items()}
+
+    def format_score(self, not_need_think_at_start: bool = None, not_need_answer_tag: bool = None):
+        """
+        Score of the think/answer layout, see score_think_pattern. The flags default to what the parser found
+        in the prompt: no <think> is needed when the prompt already ends with one, no <answer> tag when the
+        prompt does not ask for it.
+        """
+        if not_need_think_at_start is None:
+            not_need_think_at_start = bool(self.think_in_prompt)
+        if not_need_answer_tag is None:
+            not_need_answer_tag = not self.answer_tag_in_prompt
+        start, end = self.stripped_span
+        num_think_open = len(self.tags[THINK_OPEN])
+        # 1. Whether it starts with "<think>"
+        if not not_need_think_at_start and self._first(THINK_OPEN) != start:
+            return 0.0
+        # 2. Whether it contains "<think>...</think>" only once and does not contain <answer>...</answer> inside
+        # 2.1 Whether there are multiple "<think>"
+        if num_think_open > (0 if not_need_think_at_start else 1):
+            return 0.0
+        # 2.2 Whether there are multiple "</think>"
+        if len(self.tags[THINK_CLOSE]) > 1:
+            return 0.0
+        think_end = self._first(THINK_CLOSE)
+        first_answer_tag = min(self.tags[ANSWER_OPEN][:1] + self.tags[ANSWER_CLOSE][:1], default=None)
+        # 2.3 Whether it contains "</think>"
+        if think_end is None:
+            if first_answer_tag is not None:
+                return 0.0
+            # over max length
+            return 0.4 if self.overlong else 0.0
+        # 2.4 Must not contain <answer> </answer>
+        if first_answer_tag is not None and first_answer_tag < think_end:
+            return 0.0
+        # 3. Whether it contains <answer>...</answer> only once and must be after "<think>...</think>"
+        answer_start = LEADING_SPACE.match(self.response, think_end + len(THINK_CLOSE), end).end()
+        if answer_start >= end:
+            return 0.0
+        if not_need_answer_tag:
+            return 1.0
+        # 3.1 Whether it contains <answer>
+        # 3.2 Whether there is extra content before <answer>
+        # 3.3 Whether there is only one <answer>
+        if self._first(ANSWER_OPEN) != answer_start or len(self.tags[ANSWER_OPEN]) > 1:
+            return 0.0
+        # 3.4 Whether it contains </answer>
+        # over max length
+        if not self.tags[ANSWER_CLOSE]:
+            return 0.5 if self.overlong else 0.0
+        # 3.5 Whether there is extra content after </answer>
+        if self.trailing:
+            return 0.0
+        return 1.0
+
+
+def parse_response(response: str, finish_reason: str = None, prompt: str = None):
+    """Parse one response, `prompt` fills in the defaults of ParsedResponse.format_score"""
+    if prompt is None:
+        return ParsedResponse(response, overlong=(finish_reason == "length"))
+    return ParsedResponse(
+        response,
+        overlong=(finish_reason == "length"),
+        think_in_prompt=endswith_think(prompt),
+        answer_tag_in_prompt=(ANSWER_OPEN in prompt),
+    )
+
+
+def parse_responses(response_list, finish_reason_list=None, prompt_list=None):
+    """
+    Parse a batch of responses. The rollouts of one prompt share its string, so every distinct prompt
+    is only looked at once.
+    """
+    if finish_reason_list is None:
+        finish_reason_list = [None] * len(response_list)
+    if prompt_list is None:
+        return [parse_response(response, finish_reason)
+                for response, finish_reason in zip(response_list, finish_reason_list)]
+    prompt_flags = {}
+    parsed_list = []
+    for response, finish_reason, prompt in zip(response_list, finish_reason_list, prompt_list):
+        flags = prompt_flags.get(prompt)
+        if flags is None:
+            flags = prompt_flags[prompt] = (endswith_think(prompt), ANSWER_OPEN in prompt)
+        parsed_list.append(ParsedResponse(response, (finish_reason == "length"), *flags))
+    return parsed_list
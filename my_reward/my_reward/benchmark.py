@@ -0,0 +1,499 @@
+"""
+Offline reward benchmark: replay the samples PrimeSaveRewardManager saved (`..._step_N.jsonl` or `.parquet`)
+through the reward actors, against a local stub of the OpenAI-compatible judge server.
+
+    python -m my_reward.benchmark run --samples "/ckpt/samples/train_step_*.jsonl" \
+        --judge_latency 0.5 --judge_error_rate 0.02
+
+    # every sample through compute_score_by_actor, as the reward manager calls it
+    python -m my_reward.benchmark run --samples /ckpt/samples/train_step_10.parquet --mode pipeline
+
+    # only the stub judge, e.g. for a training run with my_reward_verify_url=http://127.0.0.1:8000
+    python -m my_reward.benchmark serve --port 8000 --judge_latency 0.5
+
+Every saved step is replayed as one batch. In "actor" mode the actors run in this process and the time of
+each batch is split into format check, answer extraction, verify and penalty. "pipeline" mode goes through
+compute_score_by_actor of verl, with its process pool and concurrent actor groups, and reports the seconds
+of every actor instead.
+"""
+import re
+import glob
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import contextlib
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import my_reward
+
+STAGES = ["format", "extraction", "verify", "penalty"]
+
+ANSWER_PATTERN = re.compile(r"## Student's Answer:\n(.*?)\n## Correct Answer:\n(.*?)\n## Misleading Options:", re.DOTALL)
+
+
+class _StubJudgeHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        stt = time.time()
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        latency = server.sample_latency()
+        time.sleep(latency)
+        dice = server.rng_random()
+        if dice < server.error_rate:
+            server.record("error", time.time() - stt)
+            self._reply(503, {"error": {"message": "stub judge overloaded"}})
+            return
+        if dice < server.error_rate + server.bad_reply_rate:
+            server.record("bad_reply", time.time() - stt)
+            content = "I cannot grade this answer."
+        else:
+            server.record("ok", time.time() - stt)
+            content = server.judge(payload)
+        self._reply(200, {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+
+class StubJudgeServer(ThreadingHTTPServer):
+    """
+    OpenAI-compatible `/v1/chat/completions` that grades like the real judge of RewardActorMCQA: score 2 when
+    the student's answer equals the correct answer, else 0. Every request sleeps a latency drawn around
+    `latency`, fails with 503 with probability `error_rate`, or returns an unparseable reply with
+    probability `bad_reply_rate`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, latency_jitter=0.5, error_rate=0.0,
+                 bad_reply_rate=0.0, seed=0):
+        super().__init__((host, port), _StubJudgeHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.bad_reply_rate = bad_reply_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.counts = Counter()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sample_latency(self):
+        if self.latency <= 0:
+            return 0.0
+        with self._lock:
+            # lognormal with mean `latency`, the long tail of a loaded server
+            sigma = self.latency_jitter
+            return self.latency * math.exp(self._rng.gauss(-sigma * sigma / 2, sigma))
+
+    def rng_random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def record(self, kind, latency):
+        with self._lock:
+            self.counts[kind] += 1
+            self.latencies.append(latency)
+
+    def judge(self, payload):
+        prompt = payload["messages"][-1]["content"]
+        match = ANSWER_PATTERN.search(prompt)
+        correct = match is not None and match.group(1).strip().lower() == match.group(2).strip().lower()
+        return "```json\n" + json.dumps({"reason": "stub judge", "score": 2 if correct else 0}) + "\n```"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-judge", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def load_batches(patterns, batch_size=None, limit=None):
+    """Samples of every saved step as a list of batches, each a list of sample dicts"""
+    from verl.workers.reward_manager.sample_writer import read_samples
+
+    paths = []
+    for pattern in patterns:
+        # the prompt side tables of parquet shards are read with their samples
+        matched = sorted([path for path in glob.glob(pattern) if not path.endswith(".prompts.parquet")], key=_step_of)
+        assert matched, f"no samples match {pattern}"
+        paths.extend(matched)
+
+    batches = []
+    num_samples = 0
+    for path in paths:
+        records = read_samples(path).to_dict("records")
+        for record in records:
+            # pandas fills missing values with nan
+            for key in ("finish_reason", "reward_actor"):
+                if not isinstance(record.get(key), str):
+                    record[key] = None
+        if limit is not None:
+            records = records[:limit - num_samples]
+        if records:
+            batches.append(records)
+        num_samples += len(records)
+        if limit is not None and num_samples >= limit:
+            break
+
+    if batch_size:
+        samples = [record for batch in batches for record in batch]
+        batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+    return paths, batches
+
+
+def _step_of(path):
+    match = re.search(r"step_(\d+)", path)
+    return (int(match.group(1)) if match else -1, path)
+
+
+def resolve_actors(batches, actor=None, actor_map=None):
+    """Set `reward_actor` of every sample: --actor, then --actor_map, then the actor saved with the sample"""
+    actor_map = actor_map or {}
+    for batch in batches:
+        for record in batch:
+            name = actor or actor_map.get(record["data_source"]) or record.get("reward_actor")
+            # samples saved before the reward_actor column was written need the mapping
+            assert name is not None, \
+                f"no reward actor saved for data_source {record['data_source']}, pass --actor or --actor_map"
+            assert hasattr(my_reward.contrib, name), f"unknown reward actor {name}"
+            record["reward_actor"] = name
+
+
+@contextlib.contextmanager
+def stage_timing(actor_cls, stage_time):
+    """
+    Add the seconds `actor_cls.batch_compute_score` spends in its format check, answer extraction (the parse of
+    the think and answer of every response) and penalty to `stage_time` while active. Verify is what remains
+    of the batch.
+    """
+    patched = []
+
+    def timed(fn, stage):
+
+        def wrapper(*args, **kwargs):
+            stt = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stage_time[stage] += time.perf_counter() - stt
+
+        return wrapper
+
+    for name, stage in (("parse_responses", "extraction"), ("compute_format_score", "format"),
+                        ("add_penalty", "penalty")):
+        original = actor_cls.__dict__.get(name)
+        bound = getattr(actor_cls, name)
+        setattr(actor_cls, name, staticmethod(timed(bound, stage)))
+        patched.append((actor_cls, name, original))
+    try:
+        yield
+    finally:
+        for owner, name, original in reversed(patched):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+
+def run_actor_mode(params, batch):
+    """(results, {actor: seconds}, {actor: {stage: seconds}}) of one batch, every actor in this process"""
+    groups = defaultdict(list)
+    for i, record in enumerate(batch):
+        groups[record["reward_actor"]].append(i)
+
+    results = [None] * len(batch)
+    actor_time = {}
+    actor_stage_time = {}
+    for name, index_list in groups.items():
+        actor_cls = getattr(my_reward.contrib, name)
+        stage_time = defaultdict(float)
+        stt = time.perf_counter()
+        with stage_timing(actor_cls, stage_time):
+            actor_results = actor_cls.batch_compute_score(
+                params=params,
+                data_source_list=[batch[i]["data_source"] for i in index_list],
+                prompt_str_list=[batch[i]["prompt_str"] for i in index_list],
+                response_str_list=[batch[i]["response_str"] for i in index_list],
+                ground_truth_list=[batch[i]["ground_truth"] for i in index_list],
+                extra_info_list=[batch[i]["extra_info"] for i in index_list],
+                finish_reason_list=[batch[i]["finish_reason"] for i in index_list],
+            )
+        actor_time[name] = time.perf_counter() - stt
+        stage_time["verify"] = max(0.0, actor_time[name] - sum(stage_time.values()))
+        actor_stage_time[name] = stage_time
+        for i, result in zip(index_list, actor_results):
+            results[i] = result
+    return results, actor_time, actor_stage_time
+
+
+def run_pipeline_mode(params, batch):
+    from verl.workers.reward_manager.remote import compute_score_by_actor
+
+    actor_time = {}
+    results = compute_score_by_actor(
+        params,
+        actor_list=[record["reward_actor"] for record in batch],
+        data_source_list=[record["data_source"] for record in batch],
+        prompt_str_list=[record["prompt_str"] for record in batch],
+        response_str_list=[record["response_str"] for record in batch],
+        ground_truth_list=[record["ground_truth"] for record in batch],
+        extra_info_list=[record["extra_info"] for record in batch],
+        finish_reason_list=[record["finish_reason"] for record in batch],
+        timing_raw=actor_time,
+    )
+    return results, actor_time, {}
+
+
+def judge_client_stats(url):
+    # only the clients and pools the actors started, a benchmark without RewardActorMCQA opens no connection
+    from my_reward import api
+    stats = {}
+    for (client_url, _, _), client in list(api._judge_clients.items()):
+        if client_url == url:
+            for name, value in client.stats.items():
+                stats[name] = stats.get(name, 0) + value
+    return stats
+
+
+def math_verify_timeout_count():
+    from my_reward.auxiliary import math_verify_pool
+    pool = math_verify_pool._math_verify_pool
+    return pool.timeout_count if pool is not None else 0
+
+
+def reason_of(result):
+    reason = str(result.get("reason", "")) if isinstance(result, dict) else type(result).__name__
+    # the judge reply is appended to the reason of a failed verify
+    return "ERROR IN VERIFY" if reason.startswith("ERROR IN VERIFY") else reason
+
+
+def benchmark(args):
+    paths, batches = load_batches(args.samples, args.batch_size, args.limit)
+    resolve_actors(batches, args.actor, dict(parse_pairs(args.actor_map)))
+    num_samples = sum(len(batch) for batch in batches)
+    print(f"{num_samples} samples in {len(batches)} batches from {len(paths)} files")
+
+    server = None
+    url = args.judge_url
+    if url is None:
+        server = StubJudgeServer(
+            port=args.port, latency=args.judge_latency, latency_jitter=args.judge_latency_jitter,
+            error_rate=args.judge_error_rate, bad_reply_rate=args.judge_bad_reply_rate, seed=args.seed).start()
+        url = server.url
+        print(f"stub judge at {url}")
+
+    # the defaults of get_my_reward_params
+    params = {
+        "url": url,
+        "model": args.judge_model,
+        "key": "EMPTY",
+        "max_concurrency": args.max_concurrency,
+        "max_concurrency_limit": None,
+        "max_tokens": 4096,
+        "verdict_cache_size": args.verdict_cache_size,
+        "verdict_cache_path": None,
+        "math_verify_num_workers": args.math_verify_num_workers,
+        "math_verify_timeout": args.math_verify_timeout,
+        "repetition_penalty": args.repetition_penalty,
+        "repetition_num_workers": 0,
+        "concurrent_actors": True,
+        "actor_process_workers": args.actor_process_workers,
+        "actor_chunk_size": args.actor_chunk_size,
+    }
+    run_batch = run_actor_mode if args.mode == "actor" else run_pipeline_mode
+
+    # start the judge client and the worker pools outside of the measurement
+    for batch in batches[:args.warmup]:
+        run_batch(params, batch)
+    judge_stats = judge_client_stats(url)
+    math_timeouts = math_verify_timeout_count()
+    if server is not None:
+        server.latencies, server.counts = [], Counter()
+
+    batch_latencies = []
+    actor_time = defaultdict(float)
+    actor_samples = Counter()
+    stage_time = defaultdict(lambda: defaultdict(float))
+    reasons = Counter()
+    stt = time.perf_counter()
+    for _ in range(args.repeat):
+        for batch in batches:
+            batch_stt = time.perf_counter()
+            results, batch_actor_time, batch_stage_time = run_batch(params, batch)
+            batch_latencies.append(time.perf_counter() - batch_stt)
+            for name, seconds in batch_actor_time.items():
+                actor_time[name] += seconds
+            for name, stages in batch_stage_time.items():
+                for stage, seconds in stages.items():
+                    stage_time[name][stage] += seconds
+            for record, result in zip(batch, results):
+                actor_samples[record["reward_actor"]] += 1
+                reasons[(record["reward_actor"], reason_of(result))] += 1
+    elapsed = time.perf_counter() - stt
+    total = num_samples * args.repeat
+
+    judge_stats = {key: value - judge_stats.get(key, 0) for key, value in judge_client_stats(url).items()}
+    math_timeouts = math_verify_timeout_count() - math_timeouts
+    report = {
+        "mode": args.mode,
+        "samples": total,
+        "seconds": elapsed,
+        "samples_per_second": total / elapsed,
+        "batch_latency_p50": percentile(batch_latencies, 50),
+        "batch_latency_p99": percentile(batch_latencies, 99),
+        "actors": {
+            name: {
+                "samples": actor_samples[name],
+                "seconds": actor_time[name],
+                "samples_per_second": actor_samples[name] / actor_time[name] if actor_time[name] else float("nan"),
+                "stages": dict(stage_time[name]),
+                "reasons": {reason: count for (actor, reason), count in sorted(reasons.items()) if actor == name},
+            } for name in sorted(actor_samples)
+        },
+        "timeouts": {
+            "math_verify": math_timeouts,
+            "judge_failures": judge_stats.get("failure", 0),
+            "judge_retries": judge_stats.get("retry", 0),
+        },
+    }
+    if server is not None:
+        report["judge"] = {
+            "requests": dict(server.counts),
+            "latency_p50": percentile(server.latencies, 50),
+            "latency_p99": percentile(server.latencies, 99),
+        }
+        server.stop()
+
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['samples']} samples in {report['seconds']:.2f}s: {report['samples_per_second']:.1f} samples/s, "
+          f"batch latency p50 {report['batch_latency_p50']:.3f}s p99 {report['batch_latency_p99']:.3f}s")
+    header = f"{'actor':<18} {'samples':>8} {'seconds':>9} {'samples/s':>10}"
+    if report["mode"] == "actor":
+        header += "".join(f" {stage:>16}" for stage in STAGES)
+    print(header)
+    for name, actor in report["actors"].items():
+        line = f"{name:<18} {actor['samples']:>8} {actor['seconds']:>9.2f} {actor['samples_per_second']:>10.1f}"
+        if report["mode"] == "actor":
+            for stage in STAGES:
+                seconds = actor["stages"].get(stage, 0.0)
+                share = seconds / actor["seconds"] * 100 if actor["seconds"] else 0.0
+                line += f" {seconds:>8.3f}s ({share:>3.0f}%)"
+        print(line)
+    for name, actor in report["actors"].items():
+        print(f"{name} reasons: " + ", ".join(f"{reason} {count}" for reason, count in actor["reasons"].items()))
+    timeouts = report["timeouts"]
+    print(f"timeouts: math_verify {timeouts['math_verify']}, judge failures {timeouts['judge_failures']} "
+          f"(retries {timeouts['judge_retries']})")
+    if "judge" in report:
+        judge = report["judge"]
+        print(f"stub judge: {judge['requests']}, latency p50 {judge['latency_p50']:.3f}s p99 {judge['latency_p99']:.3f}s")
+
+
+def parse_pairs(values, cast=str):
+    pairs = []
+    for value in values:
+        name, _, rest = value.partition("=")
+        assert rest, f"expected name=value, got {value}"
+        pairs.append((name, cast(rest)))
+    return pairs
+
+
+def add_judge_arguments(parser):
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--judge_latency", type=float, default=0.0, help="mean seconds per judge request")
+    parser.add_argument("--judge_latency_jitter", type=float, default=0.5, help="sigma of the lognormal latency")
+    parser.add_argument("--judge_error_rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--judge_bad_reply_rate", type=float, default=0.0, help="fraction of unparseable verdicts")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay saved reward samples through the reward actors")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--samples", action="append", required=True, help="saved sample files, globs allowed")
+    run_parser.add_argument("--mode", type=str, default="actor", choices=["actor", "pipeline"])
+    run_parser.add_argument("--actor", type=str, default=None, help="score every sample with this actor")
+    run_parser.add_argument("--actor_map", action="append", default=[], help="data_source=RewardActorXxx")
+    run_parser.add_argument("--batch_size", type=int, default=None, help="one batch per saved step by default")
+    run_parser.add_argument("--limit", type=int, default=None, help="replay at most this many samples")
+    run_parser.add_argument("--repeat", type=int, default=1)
+    run_parser.add_argument("--warmup", type=int, default=1, help="batches replayed before the measurement")
+    run_parser.add_argument("--judge_url", type=str, default=None, help="a real judge instead of the stub")
+    run_parser.add_argument("--judge_model", type=str, default="")
+    run_parser.add_argument("--max_concurrency", type=int, default=8)
+    run_parser.add_argument("--verdict_cache_size", type=int, default=0,
+                            help="0 sends every answer to the judge, as on the first steps of a run")
+    run_parser.add_argument("--math_verify_num_workers", type=int, default=None)
+    run_parser.add_argument("--math_verify_timeout", type=float, default=1.0)
+    run_parser.add_argument("--repetition_penalty", type=float, default=0.0)
+    run_parser.add_argument("--actor_process_workers", type=int, default=4)
+    run_parser.add_argument("--actor_chunk_size", type=int, default=None)
+    run_parser.add_argument("--output", type=str, default=None, help="also write the report as json")
+    add_judge_arguments(run_parser)
+
+    serve_parser = subparsers.add_parser("serve")
+    add_judge_arguments(serve_parser)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        benchmark(args)
+    else:
+        server = StubJudgeServer(
+            port=args.port or 8000, latency=args.judge_latency, latency_jitter=args.judge_latency_jitter,
+            error_rate=args.judge_error_rate, bad_reply_rate=args.judge_bad_reply_rate, seed=args.seed)
+        print(f"stub judge at {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,49 @@
 import re
 import math
 from my_reward.utils.time_utils import timeprint
-from my_reward.auxiliary.format_reward import (
-    score_think_pattern,
-    endswith_think, 
-    get_think_and_answer
+from my_reward.auxiliary.response_parser import (
+    parse_response,
+    parse_responses
 )
 from my_reward.auxiliary.language_reward import (
     score_language_consistency,
 )
+from my_reward.auxiliary.repetition import batch_repetition_score
+from my_reward.utils.verdict_cache import normalize_answer
 
 class RewardActorBase:
 
     default = 0.0
+    # where compute_score_by_actor runs batch_compute_score:
+    #   "cpu": GIL-bound python work, runs in a worker process
+    #   "network": waits on remote services, runs in a thread
+    #   "pooled": hands its heavy work to its own process pool, runs in a thread
+    resource_profile = "cpu"
+
+    @classmethod
+    def parse_responses(
+        cls,
+        prompt_str_list,
+        response_str_list,
+        finish_reason_list=None
+    ):
+        """
+        Parse every response once, the records are passed to the format score, the answer extraction and
+        the penalties instead of the response strings being scanned again by each of them
+        """
+        return parse_responses(response_str_list, finish_reason_list, prompt_str_list)
 
     @classmethod
     def compute_format_score(
         cls, 
         prompt, 
         response, 
-        finish_reason=None
+        finish_reason=None,
+        parsed=None
     ):
-        result = score_think_pattern(
-            response, 
-            not_need_think_at_start=endswith_think(prompt), 
-            not_need_answer_tag=("<answer>" not in prompt),
-            overlong=(finish_reason == "length"))
-        return float(result)
+        if parsed is None:
+            parsed = parse_response(response, finish_reason, prompt=prompt)
+        return float(parsed.format_score())
 
     @classmethod
     def compute_language_score(
@@ -39,37 +56,64 @@ class RewardActorBase:
     @classmethod
     def compute_think_length_score(
         cls, 
-        response
+        response,
+        parsed=None
     ):
         """
         思考长度相对答案长度，越长得分越高，大于 2 倍以上 clip
         """
-        think_str, answer_str = get_think_and_answer(response)
-        think_str_length = len(think_str)
-        answer_str_length = len(answer_str)
+        if parsed is None:
+            parsed = parse_response(response)
+        think_str_length = len(parsed.think)
+        answer_str_length = len(parsed.answer)
         if answer_str_length == 0:
             return 0.0
         # return (1.0 - math.exp(- min(think_str_length / answer_str_length, 2))) / (1.0 - math.exp(-2))
         return (1.0 - math.exp(- min(think_str_length / answer_str_length, 2))) / 0.8646647167
 
+    @classmethod
+    def extract_answer(
+        cls,
+        response,
+        parsed=None
+    ):
+        """
+        Canonical final answer of a response, responses with the same answer form one vote in maj@k
+        """
+        if parsed is None:
+            parsed = parse_response(response)
+        return normalize_answer(parsed.answer)
+
     @classmethod
     def add_penalty(
         cls, 
         result, 
         prompt_str_list, 
         response_str_list, 
-        extra_info_list
+        extra_info_list,
+        repetition_penalty: float=0.0,
+        repetition_num_workers: int=0,
+        parsed_list=None
     ):
         timeprint(f"### start calculating penalty")
-        for i, (prompt_str, response_str, extra_info) in enumerate(zip(
-            prompt_str_list, response_str_list, extra_info_list)):
+        # reward -= repetition_penalty * repeatness score, disabled by default
+        if repetition_penalty > 0:
+            repetition_scores = batch_repetition_score(response_str_list, num_workers=repetition_num_workers)
+        else:
+            repetition_scores = [0.0] * len(response_str_list)
+        if parsed_list is None:
+            parsed_list = parse_responses(response_str_list)
+        for i, (prompt_str, response_str, extra_info, parsed) in enumerate(zip(
+            prompt_str_list, response_str_list, extra_info_list, parsed_list)):
+            # the verdict before any penalty, 1.0 means correct
+            result[i]["verdict_reward"] = result[i]["reward"]
             question = extra_info["question"]
-            think_str, answer_str = get_think_and_answer(response_str)
-            think_language_score = cls.compute_language_score(response=think_str, prompt=question)
-            answer_language_score = cls.compute_language_score(response=answer_str, prompt=question)
+            think_language_score = cls.compute_language_score(response=parsed.think, prompt=question)
+            answer_language_score = cls.compute_language_score(response=parsed.answer, prompt=question)
             result[i]["reward"] -= (1.0 - think_language_score) / 10.0
             result[i]["reward"] -= (1.0 - answer_language_score) / 10.0
-            think_length_score = cls.compute_think_length_score(response_str)
+            think_length_score = cls.compute_think_length_score(response_str, parsed=parsed)
             result[i]["reward"] -= (1.0 - think_length_score) / 10.0
+            result[i]["reward"] -= repetition_penalty * repetition_scores[i]
         timeprint(f"### end calculating penalty")
         return result
\ No newline at end of file
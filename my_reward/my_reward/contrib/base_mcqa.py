@@ -85,12 +85,11 @@ VERIFY_USER_PROMPT_EN = """## Question:
 """.strip()
 
 import re
+import json
 import time
 from my_reward.utils.time_utils import timeprint
-from my_reward.api import oneapi_post_by_langchain, read_json
-from my_reward.auxiliary.format_reward import (
-    get_think_and_answer
-)
+from my_reward.utils.verdict_cache import get_verdict_cache, verdict_key
+from my_reward.api import oneapi_stream_by_async, read_json
 from my_reward.contrib.base import RewardActorBase
 from pydantic import BaseModel, Field
 
@@ -99,7 +98,9 @@ class Score(BaseModel):
     score: float = Field(..., title="Score", description="Score")
 
 class RewardActorMCQA(RewardActorBase):
-    
+
+    resource_profile = "network"
+
     @classmethod
     def normalize_score(cls, score: float):
         if score >= 2.0:
@@ -132,10 +133,11 @@ class RewardActorMCQA(RewardActorBase):
             })
 
         skip_index = set()
-        for i, (prompt_str, response_str, ground_truth, finish_reason) in enumerate(zip(
-            prompt_str_list, response_str_list, ground_truth_list, finish_reason_list)):
+        parsed_list = cls.parse_responses(prompt_str_list, response_str_list, finish_reason_list)
+        for i, (prompt_str, response_str, ground_truth, finish_reason, parsed) in enumerate(zip(
+            prompt_str_list, response_str_list, ground_truth_list, finish_reason_list, parsed_list)):
 
-            format_score = cls.compute_format_score(prompt_str, response_str, finish_reason)
+            format_score = cls.compute_format_score(prompt_str, response_str, finish_reason, parsed=parsed)
             if format_score != 1.0:
                 result[i] = {
                     "reason": "FORMAT_WRONG",
@@ -143,49 +145,92 @@ class RewardActorMCQA(RewardActorBase):
                 }
                 skip_index.add(i)
 
+        params = dict(params)
+        cache_size = params.pop("verdict_cache_size", 100000)
+        cache_path = params.pop("verdict_cache_path", None)
+        cache = get_verdict_cache(cache_path, capacity=cache_size) if cache_size and cache_size > 0 else None
+
+        # look up verdicts by content before building any judge prompt
+        key_list = [None] * len(response_str_list)
+        answer_list = [None] * len(response_str_list)
+        for i, (response_str, ground_truth, extra_info) in enumerate(zip(response_str_list, ground_truth_list, extra_info_list)):
+            if i in skip_index:
+                continue
+            answer_str = parsed_list[i].answer
+            answer_list[i] = answer_str
+            if cache is not None:
+                key_list[i] = verdict_key(
+                    answer_str,
+                    ground_truth,
+                    extra_info["question"] + "\n" + json.dumps(extra_info["options"], ensure_ascii=False, sort_keys=True),
+                    params.get("model", ""),
+                )
+        cached = cache.get_many([key for key in key_list if key is not None]) if cache is not None else {}
+
         system_prompt = VERIFY_SYSTEM_PROMPT_EN
+        # duplicated answers share one judge call
         index_list = []
         prompt_list = []
-        for i, (data_source, prompt_str, response_str, ground_truth, extra_info) in enumerate(zip(data_source_list, prompt_str_list, response_str_list, ground_truth_list, extra_info_list)):
+        pending = {}
+        for i, (ground_truth, extra_info) in enumerate(zip(ground_truth_list, extra_info_list)):
             if i in skip_index:
                 continue
-            _, answer_str = get_think_and_answer(response_str)
+            key = key_list[i]
+            if key is not None:
+                if key in cached:
+                    result[i] = dict(cached[key])
+                    continue
+                if key in pending:
+                    pending[key].append(i)
+                    continue
+                pending[key] = [i]
             options = extra_info["options"]
             misleading_options = [v for k, v in options.items() if v != ground_truth]
             prompt = VERIFY_USER_PROMPT_EN.format(
                 question=extra_info["question"],
-                answer=answer_str,
+                answer=answer_list[i],
                 correct_answer=ground_truth,
                 misleading_options=misleading_options
             )
             prompt_list.append(prompt)
             index_list.append(i)
 
-        batch_size = 256
-        response_list = []
-        for i in range(0, len(prompt_list), batch_size):
-            stt = time.time()
-            response_list += oneapi_post_by_langchain(
-                prompt=prompt_list[i:i+batch_size],
-                system_prompt=system_prompt,
-                # base_model=Score,
-                **params
-            )
-            edt = time.time()
-            timeprint(f"-------- base mcqa compute score batch size: {len(prompt_list[i:i+batch_size])}, oneapi time: {edt - stt} s")
-        
-        for index, res in zip(index_list, response_list):
+        stt = time.time()
+        new_verdicts = []
+        # verdicts are consumed as soon as each judge reply arrives
+        for j, res in oneapi_stream_by_async(
+            prompt=prompt_list,
+            system_prompt=system_prompt,
+            # base_model=Score,
+            **params
+        ):
+            index = index_list[j]
             try:
                 res_json = read_json(res)
-                result[index] = {
+                verdict = {
                     "reason": res_json["reason"],
                     "reward": cls.normalize_score(float(res_json["score"]))
                 }
+                if key_list[index] is not None:
+                    new_verdicts.append((key_list[index], verdict))
             except Exception as e:
-                result[index] = {
+                verdict = {
                     "reason": f"ERROR IN VERIFY: {res}",
                     "reward": cls.default,
                     "exception": str(e)
                 }
-
-        return cls.add_penalty(result, prompt_str_list, response_str_list, extra_info_list)
+            for i in (pending[key_list[index]] if key_list[index] is not None else [index]):
+                result[i] = dict(verdict)
+        edt = time.time()
+        timeprint(f"-------- base mcqa compute score size: {len(prompt_list)}, oneapi time: {edt - stt} s")
+
+        if cache is not None:
+            cache.put_many(new_verdicts)
+            timeprint(f"-------- base mcqa verdict cache: {cache.stats()}")
+
+        return cls.add_penalty(
+            result, prompt_str_list, response_str_list, extra_info_list,
+            repetition_penalty=params.get("repetition_penalty", 0.0),
+            repetition_num_workers=params.get("repetition_num_workers", 0),
+            parsed_list=parsed_list,
+        )
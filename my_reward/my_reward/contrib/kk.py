@@ -2,9 +2,6 @@ import re
 import time
 from typing import Optional, Dict
 
-from my_reward.auxiliary.format_reward import (
-    get_think_and_answer
-)
 from my_reward.contrib.base import RewardActorBase
 
 def parse_solution_text_format(solution_text: str) -> Dict[str, str]:
@@ -97,10 +94,11 @@ class RewardActorKK(RewardActorBase):
                 "reward": cls.default
             })
 
-        for i, (prompt_str, response_str, ground_truth, finish_reason) in enumerate(zip(
-            prompt_str_list, response_str_list, ground_truth_list, finish_reason_list)):
+        parsed_list = cls.parse_responses(prompt_str_list, response_str_list, finish_reason_list)
+        for i, (prompt_str, response_str, ground_truth, finish_reason, parsed) in enumerate(zip(
+            prompt_str_list, response_str_list, ground_truth_list, finish_reason_list, parsed_list)):
 
-            format_score = cls.compute_format_score(prompt_str, response_str, finish_reason)
+            format_score = cls.compute_format_score(prompt_str, response_str, finish_reason, parsed=parsed)
             if format_score != 1.0:
                 result[i] = {
                     "reason": "FORMAT_WRONG",
@@ -113,8 +111,7 @@ class RewardActorKK(RewardActorBase):
             # print(f"[Ground Truth] Final identities: {gt_status}")
 
             # Extract model answer
-            _, answer_str = get_think_and_answer(response_str)
-            pred_status = parse_model_answer(answer_str, expected_names)
+            pred_status = parse_model_answer(parsed.answer, expected_names)
             if pred_status:
                 # print(f"\n[Content Validation]")
                 # print(f"  Expected: {gt_status}")
@@ -135,6 +132,11 @@ class RewardActorKK(RewardActorBase):
                     "reward": 0.05
                 }
 
-        return cls.add_penalty(result, prompt_str_list, response_str_list, extra_info_list)
+        return cls.add_penalty(
+            result, prompt_str_list, response_str_list, extra_info_list,
+            repetition_penalty=params.get("repetition_penalty", 0.0),
+            repetition_num_workers=params.get("repetition_num_workers", 0),
+            parsed_list=parsed_list,
+        )
 
         
\ No newline at end of file
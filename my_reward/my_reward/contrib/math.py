@@ -1,22 +1,31 @@
 import re
 import time
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from my_reward.utils.time_utils import timeprint
-from my_reward.auxiliary.format_reward import (
-    get_think_and_answer
-)
 from my_reward.auxiliary.math_utils import (
-    is_equal,
+    batch_is_equal,
     solution2answer
 )
+from my_reward.auxiliary.math_verify_pool import get_math_verify_pool
+from my_reward.auxiliary.response_parser import parse_response
 from my_reward.contrib.base import RewardActorBase
+from my_reward.utils.verdict_cache import normalize_answer
 
-async def get_task(tasks):
-    return await asyncio.gather(*tasks)
-    
 class RewardActorMath(RewardActorBase):
-    
+
+    # math_verify runs in MathVerifyPool
+    resource_profile = "pooled"
+
+    @classmethod
+    def extract_answer(
+        cls,
+        response,
+        parsed=None
+    ):
+        if parsed is None:
+            parsed = parse_response(response)
+        _match = re.findall(r".*?(\\boxed{.*}).*?", parsed.answer, re.DOTALL)
+        return normalize_answer(solution2answer(_match[-1])) if _match else ""
+
     @classmethod
     def batch_compute_score(
         cls, 
@@ -45,10 +54,11 @@ class RewardActorMath(RewardActorBase):
         index_list = []
         extracted_answer_list = []
 
-        for i, (prompt_str, response_str, ground_truth, finish_reason) in enumerate(zip(
-            prompt_str_list, response_str_list, ground_truth_list, finish_reason_list)):
+        parsed_list = cls.parse_responses(prompt_str_list, response_str_list, finish_reason_list)
+        for i, (prompt_str, response_str, ground_truth, finish_reason, parsed) in enumerate(zip(
+            prompt_str_list, response_str_list, ground_truth_list, finish_reason_list, parsed_list)):
 
-            format_score = cls.compute_format_score(prompt_str, response_str, finish_reason)
+            format_score = cls.compute_format_score(prompt_str, response_str, finish_reason, parsed=parsed)
             if format_score != 1.0:
                 result[i] = {
                     "reason": "FORMAT_WRONG",
@@ -57,8 +67,7 @@ class RewardActorMath(RewardActorBase):
                 skip_index.add(i)
                 continue
 
-            _, answer_str = get_think_and_answer(response_str)
-            _match = re.findall(pattern, answer_str)
+            _match = re.findall(pattern, parsed.answer)
             extracted_answer = _match[-1] if _match else ""
             if not extracted_answer:
                 result[i] = {
@@ -71,11 +80,15 @@ class RewardActorMath(RewardActorBase):
             index_list.append(i)
         
         stt = time.time()
-        executor = ThreadPoolExecutor(max_workers=64)
-        equal_tasks = []
-        for index, extracted_answer in zip(index_list, extracted_answer_list):
-            equal_tasks.append(is_equal(solution2answer(ground_truth_list[index]), solution2answer(extracted_answer), executor, math_mode="math_verify"))
-        equal_results = asyncio.run(get_task(equal_tasks))
+        pool = get_math_verify_pool(
+            num_workers=params.get("math_verify_num_workers"),
+            timeout=params.get("math_verify_timeout", 1.0),
+        )
+        equal_results = batch_is_equal(
+            [(solution2answer(ground_truth_list[index]), solution2answer(extracted_answer))
+             for index, extracted_answer in zip(index_list, extracted_answer_list)],
+            pool,
+        )
         edt = time.time()
         timeprint(f"####### math is_equal time: {edt - stt} s for {len(index_list)} items")
 
@@ -99,6 +112,11 @@ class RewardActorMath(RewardActorBase):
                     "reward": 0.1
                 }
         timeprint(f"####### math timeout count: {timeout_count} / {len(index_list)}")
-        return cls.add_penalty(result, prompt_str_list, response_str_list, extra_info_list)
+        return cls.add_penalty(
+            result, prompt_str_list, response_str_list, extra_info_list,
+            repetition_penalty=params.get("repetition_penalty", 0.0),
+            repetition_num_workers=params.get("repetition_num_workers", 0),
+            parsed_list=parsed_list,
+        )
 
         
\ No newline at end of file
@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, defaultdict
+
+def normalize_answer(s):
+    """
+    Canonical form of an answer string for cache keys: lowercase, collapsed whitespace,
+    no surrounding quotes or trailing punctuation.
+    """
+    if s is None:
+        return ""
+    s = str(s).lower().strip()
+    s = re.sub(r"\s+", " ", s)
+    s = s.strip(" \"'`")
+    s = s.rstrip(" .;,。；，")
+    return s
+
+def hash_text(s):
+    return hashlib.sha1(str(s).encode("utf-8")).hexdigest()
+
+def verdict_key(answer, ground_truth, question, model=""):
+    """
+    Content address of a judge verdict. `question` should cover everything in the judge prompt
+    besides the answer and ground truth (e.g. the question and its options).
+    """
+    payload = json.dumps(
+        [normalize_answer(answer), normalize_answer(ground_truth), hash_text(question), model],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_thread_stats = threading.local()
+
+@contextmanager
+def collect_cache_stats():
+    """
+    Count what the verdict caches do for the calling thread inside the block, e.g. one batch_compute_score.
+    Yields a dict of hits / disk_hits / misses / evictions / writes that is filled in as the block runs.
+    """
+    stats = defaultdict(int)
+    outer = getattr(_thread_stats, "stats", None)
+    _thread_stats.stats = stats
+    try:
+        yield stats
+    finally:
+        _thread_stats.stats = outer
+        if outer is not None:
+            for name, value in stats.items():
+                outer[name] += value
+
+
+class VerdictCache:
+    """
+    Two-tier cache of LLM-judge verdicts: an in-memory LRU in front of an optional SQLite file
+    that survives restarts. Values are the `{"reason", "reward"}` dicts produced by the actors
+    before any penalty is applied.
+    """
+
+    def __init__(self, path=None, capacity: int=100000):
+        self.path = path
+        self.capacity = capacity
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+        self._conn = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "key TEXT PRIMARY KEY, reason TEXT, reward REAL, created REAL)"
+            )
+            self._conn.commit()
+
+    def _count(self, name, n=1):
+        setattr(self, name, getattr(self, name) + n)
+        stats = getattr(_thread_stats, "stats", None)
+        if stats is not None:
+            stats[name] += n
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+            self._count("evictions")
+
+    def get_many(self, keys):
+        """
+        Return `{key: verdict}` for the keys found in either tier.
+        """
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in found:
+                    continue
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = value
+                else:
+                    missing.append(key)
+
+            if self._conn is not None and missing:
+                unique_missing = list(dict.fromkeys(missing))
+                # stay below SQLITE_MAX_VARIABLE_NUMBER
+                for i in range(0, len(unique_missing), 512):
+                    chunk = unique_missing[i:i+512]
+                    rows = self._conn.execute(
+                        f"SELECT key, reason, reward FROM verdicts WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for key, reason, reward in rows:
+                        value = {"reason": reason, "reward": reward}
+                        found[key] = value
+                        self._remember(key, value)
+                        self._count("disk_hits")
+
+            hits = sum(1 for key in keys if key in found)
+            self._count("hits", hits)
+            self._count("misses", len(keys) - hits)
+        return found
+
+    def put_many(self, items):
+        """
+        Store `(key, verdict)` pairs in both tiers.
+        """
+        items = [(key, {"reason": value["reason"], "reward": float(value["reward"])}) for key, value in items]
+        if not items:
+            return
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+            if self._conn is not None:
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO verdicts (key, reason, reward, created) VALUES (?, ?, ?, ?)",
+                    [(key, value["reason"], value["reward"], now) for key, value in items],
+                )
+                self._conn.commit()
+            self._count("writes", len(items))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "size": len(self._memory),
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_verdict_caches = {}
+_verdict_caches_lock = threading.Lock()
+
+def get_verdict_cache(path=None, capacity: int=100000):
+    """
+    Return the process-wide `VerdictCache` for `path`, creating it on first use.
+    """
+    with _verdict_caches_lock:
+        cache = _verdict_caches.get(path)
+        if cache is None:
+            cache = VerdictCache(path=path, capacity=capacity)
+            _verdict_caches[path] = cache
+    return cache
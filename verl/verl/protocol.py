@@ -370,6 +370,21 @@ class DataProto:
 
         return DataProto(batch=sub_batch, non_tensor_batch=non_tensor_batch, meta_info=sub_meta_info)
 
+    def select_idxs(self, idxs) -> 'DataProto':
+        """Select a subset of the rows, in the given order
+
+        Args:
+            idxs (torch.Tensor, np.ndarray or list): integer indices of the rows to keep
+
+        Returns:
+            DataProto: a new DataProto holding the selected rows, meta_info is shared
+        """
+        idxs = torch.as_tensor(np.asarray(idxs), dtype=torch.long)
+        idxs_np = idxs.numpy()
+        sub_batch = self.batch[idxs] if self.batch is not None else None
+        non_tensor_batch = {key: val[idxs_np] for key, val in self.non_tensor_batch.items()}
+        return DataProto(batch=sub_batch, non_tensor_batch=non_tensor_batch, meta_info=self.meta_info)
+
     def pop(self, batch_keys=None, non_tensor_batch_keys=None, meta_info_keys=None) -> 'DataProto':
         """Pop a subset of the DataProto via `batch_keys` and `meta_info_keys`
 
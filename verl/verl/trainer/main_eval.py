@@ -12,57 +12,179 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
-Offline evaluate the performance of a generated file using reward model and ground truth verifier.
-The input is a parquet file that contains N generated sequences and (optional) the ground truth.
-
+Offline evaluate the performance of a generated file using the my_reward actors.
+The input is a parquet file that contains N generated sequences per prompt (see main_generation) and the
+ground truth. pass@k, avg@k and maj@k are reported for every data_source.
 """
 
+import os
+import json
+import time
+from collections import Counter, defaultdict
+
 import hydra
-from verl.utils.fs import copy_to_local
-from verl.utils.reward_score import math, gsm8k
-import pandas as pd
 import numpy as np
+import pandas as pd
 
+from verl.utils.fs import copy_to_local
+from verl.workers.reward_manager.remote import compute_score_by_actor, get_my_reward_params
 
-def select_reward_fn(data_source):
-    if data_source == 'lighteval/MATH':
-        return math.compute_score
-    else:
-        raise NotImplementedError
+
+def pass_at_k(n, c, k):
+    """Unbiased pass@k estimator of n samples with c correct ones: 1 - C(n - c, k) / C(n, k)"""
+    if n - c < k:
+        return 1.0
+    return 1.0 - float(np.prod(1.0 - k / np.arange(n - c + 1, n + 1)))
+
+
+def majority_correct(answers, correct):
+    """Whether the most frequent answer is correct, ties go to the answer seen first. Empty answers do not vote."""
+    votes = Counter(answer for answer in answers if answer)
+    if not votes:
+        return False
+    top = max(votes.values())
+    for answer, is_correct in zip(answers, correct):
+        if answer and votes[answer] == top:
+            return bool(is_correct)
+
+
+def summarize(records, k_list):
+    """
+    records: `(data_source, correct_list, answer_list)` of every prompt.
+    Returns `{data_source: metrics}` with an extra "all" entry averaged over all prompts. pass@k uses all
+    the samples of a prompt, avg@k and maj@k its first k samples.
+    """
+    by_source = defaultdict(list)
+    for record in records:
+        by_source[record[0]].append(record)
+    by_source['all'] = list(records)
+
+    summary = {}
+    for data_source, source_records in by_source.items():
+        metrics = {
+            'num_prompts': len(source_records),
+            'num_samples': sum(len(correct) for _, correct, _ in source_records),
+        }
+        for k in k_list:
+            # prompts with less than k samples do not count for k
+            usable = [(correct, answers) for _, correct, answers in source_records if len(correct) >= k]
+            if not usable:
+                continue
+            metrics[f'pass@{k}'] = float(np.mean([pass_at_k(len(correct), sum(correct), k) for correct, _ in usable]))
+            metrics[f'avg@{k}'] = float(np.mean([np.mean(correct[:k]) for correct, _ in usable]))
+            metrics[f'maj@{k}'] = float(np.mean([majority_correct(answers[:k], correct[:k]) for correct, answers in usable]))
+        summary[data_source] = metrics
+    return summary
+
+
+def result_key(actor, prompt, response, ground_truth, model):
+    # the verdict of a response only depends on what its actor sees
+    from my_reward.utils.verdict_cache import hash_text
+    return hash_text(json.dumps([actor, prompt, response, str(ground_truth), model], ensure_ascii=False))
+
+
+def prompt_to_str(prompt):
+    if isinstance(prompt, str):
+        return prompt
+    # chat format, the actors only look at the text
+    return '\n'.join(message['content'] for message in prompt)
 
 
 @hydra.main(config_path='config', config_name='evaluation', version_base=None)
 def main(config):
+    import my_reward
+    from my_reward.utils.verdict_cache import get_verdict_cache
+
     local_path = copy_to_local(config.data.path)
     dataset = pd.read_parquet(local_path)
-    prompts = dataset[config.data.prompt_key]
-    responses = dataset[config.data.response_key]
-    data_sources = dataset[config.data.data_source_key]
-    reward_model_data = dataset[config.data.reward_model_key]
-
-    passes = 0
-
-    total = len(dataset)
-
-    for i in range(total):
-        response_lst = responses[i]
-        data_source = data_sources[i]
-        # select reward score based on data_source
-        prompt = prompts[i]
-        reward_data = reward_model_data[i]
-        reward_fn = select_reward_fn(data_source)
-        ground_truth = reward_data['ground_truth']
-        score_lst = []
-        for r in response_lst:
-            score = reward_fn(r, ground_truth)
-            score_lst.append(score)
-
-        max_score = np.max(score_lst)
-
-        if max_score == 1:
-            passes += 1
-
-    print(f'pass@5: {passes / total}')
+    prompts = dataset[config.data.prompt_key].tolist()
+    responses = dataset[config.data.response_key].tolist()
+    data_sources = dataset[config.data.data_source_key].tolist()
+    reward_model_data = dataset[config.data.reward_model_key].tolist()
+    reward_actors = dataset[config.data.reward_actor_key].tolist()
+    if config.data.extra_info_key in dataset:
+        extra_infos = dataset[config.data.extra_info_key].tolist()
+    else:
+        # the penalties only need the question, which is the prompt then. The judge of RewardActorMCQA
+        # also reads the options, which only the column has
+        mcqa_actors = sorted(actor for actor in set(reward_actors)
+                             if issubclass(getattr(my_reward.contrib, actor), my_reward.contrib.RewardActorMCQA))
+        if mcqa_actors:
+            raise ValueError(f'{config.data.path} has no "{config.data.extra_info_key}" column with the question '
+                             f'and options that {", ".join(mcqa_actors)} need')
+        extra_infos = [{'question': prompt_to_str(prompt)} for prompt in prompts]
+
+    params = get_my_reward_params(config)
+    k_list = sorted(set(config.eval.k_list))
+
+    # one entry per (prompt, sample)
+    flat = defaultdict(list)
+    row_index = []
+    for i in range(len(dataset)):
+        prompt_str = prompt_to_str(prompts[i])
+        for response in responses[i]:
+            flat['actor_list'].append(reward_actors[i])
+            flat['data_source_list'].append(data_sources[i])
+            flat['prompt_str_list'].append(prompt_str)
+            flat['response_str_list'].append(response)
+            flat['ground_truth_list'].append(reward_model_data[i]['ground_truth'])
+            flat['extra_info_list'].append(extra_infos[i])
+            flat['finish_reason_list'].append(None)
+            row_index.append(i)
+    total = len(row_index)
+
+    cache = get_verdict_cache(config.eval.cache_path) if config.eval.cache_path else None
+    keys = [
+        result_key(actor, prompt_str, response, ground_truth, params['model'])
+        for actor, prompt_str, response, ground_truth in zip(flat['actor_list'], flat['prompt_str_list'],
+                                                             flat['response_str_list'], flat['ground_truth_list'])
+    ]
+    verdicts = cache.get_many(keys) if cache is not None else {}
+    todo = [j for j in range(total) if keys[j] not in verdicts]
+    print(f'{total} responses of {len(dataset)} prompts, {total - len(todo)} found in the verdict cache')
+
+    stt = time.time()
+    if todo:
+        # all samples go out at once: cpu actors are spread over the process pool, the judge requests of
+        # RewardActorMCQA stream through its async client and math_verify runs in its pool, concurrently
+        timing = {}
+        results = compute_score_by_actor(params=params,
+                                         timing_raw=timing,
+                                         **{name: [values[j] for j in todo] for name, values in flat.items()})
+        new_verdicts = []
+        for j, result in zip(todo, results):
+            if not isinstance(result, dict) or result.get('exception'):
+                # not cached, a rerun retries it
+                verdicts[keys[j]] = {'reason': str(result), 'reward': 0.0}
+                continue
+            verdict = {'reason': result.get('reason', ''), 'reward': float(result.get('verdict_reward', result['reward']))}
+            verdicts[keys[j]] = verdict
+            new_verdicts.append((keys[j], verdict))
+        if cache is not None:
+            cache.put_many(new_verdicts)
+        print(f'scored {len(todo)} responses in {time.time() - stt:.1f}s, by actor: '
+              + ', '.join(f'{actor} {seconds:.1f}s' for actor, seconds in timing.items()))
+
+    actor_classes = {actor: getattr(my_reward.contrib, actor) for actor in set(reward_actors)}
+    correct = defaultdict(list)
+    answers = defaultdict(list)
+    for j, i in enumerate(row_index):
+        correct[i].append(verdicts[keys[j]]['reward'] >= 1.0)
+        answers[i].append(actor_classes[flat['actor_list'][j]].extract_answer(flat['response_str_list'][j]))
+    records = [(data_sources[i], correct[i], answers[i]) for i in range(len(dataset)) if correct[i]]
+
+    summary = summarize(records, k_list)
+    for data_source, metrics in summary.items():
+        print(f'{data_source}: ' + ', '.join(
+            f'{name}={value:.4f}' if isinstance(value, float) else f'{name}={value}' for name, value in metrics.items()))
+
+    if config.data.output_path:
+        output_dir = os.path.dirname(config.data.output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(config.data.output_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
 
 
 if __name__ == '__main__':
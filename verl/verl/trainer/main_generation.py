@@ -18,6 +18,7 @@ import ray
 import numpy as np
 import hydra
 import os
+import time
 
 os.environ['NCCL_DEBUG'] = 'WARN'
 os.environ['TOKENIZERS_PARALLELISM'] = 'true'
@@ -36,6 +37,28 @@ from verl.utils.hdfs_io import makedirs
 from verl.single_controller.ray import RayClassWithInitArgs, RayResourcePool, RayWorkerGroup
 
 
+def pending_shards(total_samples, shard_dir, shard_size):
+    """
+    Row indices still to generate, cut into shards of `shard_size` prompts. Rows found in the
+    shards of `shard_dir` are done, so a crashed run resumes where it stopped.
+    """
+    done = np.zeros(total_samples, dtype=bool)
+    for name in os.listdir(shard_dir):
+        if name.startswith('part-') and name.endswith('.parquet'):
+            done[pd.read_parquet(os.path.join(shard_dir, name), columns=['index'])['index'].to_numpy()] = True
+    todo = np.nonzero(~done)[0]
+    shard_size = shard_size or max(len(todo), 1)
+    return [todo[i:i + shard_size] for i in range(0, len(todo), shard_size)], int(done.sum())
+
+
+def write_shard(shard_dir, indices, responses):
+    """Write the responses of one shard, the file only appears once it is complete."""
+    path = os.path.join(shard_dir, f'part-{int(indices[0]):08d}.parquet')
+    pd.DataFrame({'index': indices, 'responses': responses}).to_parquet(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+
 @hydra.main(config_path='config', config_name='generation', version_base=None)
 def main(config):
     from pprint import pprint
@@ -59,21 +82,34 @@ def main(config):
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
-    ray_cls_with_init = RayClassWithInitArgs(cls=ray.remote(ActorRolloutRefWorker), config=config, role='actor_rollout')
-    resource_pool = RayResourcePool(process_on_nodes=[config.trainer.n_gpus_per_node] * config.trainer.nnodes)
-    wg = RayWorkerGroup(resource_pool=resource_pool, ray_cls_with_init=ray_cls_with_init)
-    wg.init_model()
+    n_samples = config.data.n_samples
+    # vllm samples the n responses of a prompt in the same request, the engine schedules all of them
+    # together. hf rollout has no `n`, the prompts are repeated instead.
+    repeat_prompts = config.rollout.name != 'vllm'
+    if not repeat_prompts:
+        config.rollout.n = n_samples
 
     total_samples = len(dataset)
-    # real_batch_size = data.batch['input_ids'].shape[0]
-    config_batch_size = config.data.batch_size
-    dp_size = wg.world_size // config.rollout.tensor_model_parallel_size
-    num_batch = (total_samples // config_batch_size) + 1
-    output_lst = [[] for _ in range(config.data.n_samples)]
-
-    for batch_idx in range(num_batch):
-        print(f'[{batch_idx+1}/{num_batch}] Start to process.')
-        batch_chat_lst = chat_lst[batch_idx * config_batch_size:(batch_idx + 1) * config_batch_size]
+    shard_dir = config.data.get('shard_dir', None) or config.data.output_path + '.shards'
+    makedirs(shard_dir, exist_ok=True)
+    shards, num_done = pending_shards(total_samples, shard_dir, config.data.get('shard_size', None))
+    if num_done:
+        print(f'resume: {num_done}/{total_samples} prompts already generated in {shard_dir}')
+
+    if shards:
+        ray_cls_with_init = RayClassWithInitArgs(cls=ray.remote(ActorRolloutRefWorker),
+                                                 config=config,
+                                                 role='actor_rollout')
+        resource_pool = RayResourcePool(process_on_nodes=[config.trainer.n_gpus_per_node] * config.trainer.nnodes)
+        wg = RayWorkerGroup(resource_pool=resource_pool, ray_cls_with_init=ray_cls_with_init)
+        wg.init_model()
+        dp_size = wg.world_size // config.rollout.tensor_model_parallel_size
+
+    pad_token = tokenizer.pad_token
+    total_tokens = 0
+    total_time = 0.
+    for shard_idx, indices in enumerate(shards):
+        batch_chat_lst = [chat_lst[i] for i in indices]
         inputs = tokenizer.apply_chat_template(batch_chat_lst,
                                                add_generation_prompt=True,
                                                padding=True,
@@ -97,40 +133,50 @@ def main(config):
             print(
                 f'dp_size {dp_size} is not divisible by real_batch_size {real_batch_size}, add {dummy_data_size} dummy data'
             )
+        if repeat_prompts:
+            data = data.repeat(repeat_times=n_samples, interleave=True)
 
         batch_size = data.batch['input_ids'].shape[0]
         assert batch_size % dp_size == 0, f'batch_size {batch_size} is not divisible by dp_size {dp_size}'
 
-        print(f'[{batch_idx+1}/{num_batch}] Start to generate.')
-        # START TO GENERATE FOR n_samples TIMES
-        for i in range(config.data.n_samples):
-            output = wg.generate_sequences(data)
-            # remove dummy data
-            output = output[:real_batch_size]
-            output_text = tokenizer.batch_decode(output.batch['input_ids'][:, -config.rollout.response_length:],
-                                                 skip_special_tokens=False)
-
-            # remove the padding
-            pad_token = tokenizer.pad_token
-            output_text_unpad = []
-            for text in output_text:
-                output_text_unpad.append(text.replace(pad_token, ''))
-
-            output_lst[i].extend(output_text_unpad)
-
-    # convert output_lst from (n_samples, n_data) to (n_data, n_sampels)
-    output_lst = np.array(output_lst, dtype=object)
-    output_lst = np.transpose(output_lst, axes=(1, 0)).tolist()
-
-    # add to the data frame
-    dataset[f'responses'] = output_lst
+        print(f'[{shard_idx+1}/{len(shards)}] Start to generate {real_batch_size} prompts x {n_samples} samples.')
+        stt = time.time()
+        output = wg.generate_sequences(data)
+        elapsed = time.time() - stt
+        # (prompt, sample) rows in prompt order, remove dummy data
+        output = output[:real_batch_size * n_samples]
+        responses = output.batch['responses']
+        num_tokens = int(output.batch['attention_mask'][:, -responses.shape[-1]:].sum())
+        total_tokens += num_tokens
+        total_time += elapsed
+
+        output_text = tokenizer.batch_decode(responses, skip_special_tokens=False)
+        # remove the padding
+        output_text = [text.replace(pad_token, '') for text in output_text]
+        output_lst = [output_text[i * n_samples:(i + 1) * n_samples] for i in range(real_batch_size)]
+
+        path = write_shard(shard_dir, indices, output_lst)
+        print(f'[{shard_idx+1}/{len(shards)}] {num_tokens} tokens in {elapsed:.1f}s '
+              f'({num_tokens / max(elapsed, 1e-6):.0f} tokens/s), saved {path}')
+
+    if shards:
+        print(f'generated {total_tokens} tokens in {total_time:.1f}s '
+              f'({total_tokens / max(total_time, 1e-6):.0f} tokens/s)')
+
+    # merge the shards back into the order of the dataset
+    merged = pd.concat([
+        pd.read_parquet(os.path.join(shard_dir, name))
+        for name in sorted(os.listdir(shard_dir))
+        if name.startswith('part-') and name.endswith('.parquet')
+    ]).set_index('index').sort_index()
+    assert len(merged) == total_samples, f'{len(merged)} of {total_samples} prompts generated'
+    dataset['responses'] = merged['responses'].tolist()
 
     # write to a new parquet
     output_dir = os.path.dirname(config.data.output_path)
     makedirs(output_dir, exist_ok=True)
-    dataset.to_parquet(config.data.output_path)
-
-    return output_text
+    dataset.to_parquet(config.data.output_path + '.tmp')
+    os.replace(config.data.output_path + '.tmp', config.data.output_path)
 
 
 if __name__ == '__main__':
@@ -131,9 +131,15 @@ def main_task(config, compute_score=None):
     else:
         raise NotImplementedError
     
-    reward_fn = reward_manager_cls(tokenizer=tokenizer, num_examine=4, compute_score=compute_score)
+    reward_kwargs = {}
+    if reward_manager_name == 'prime_save':
+        # jsonl (one line per sample) or parquet (samples + deduplicated prompt side table), opt in with
+        # reward_model.my_reward_save_format=parquet
+        reward_kwargs['save_format'] = config.reward_model.get('my_reward_save_format', 'jsonl')
+
+    reward_fn = reward_manager_cls(tokenizer=tokenizer, num_examine=4, compute_score=compute_score, **reward_kwargs)
     # Note that we always use function-based RM for validation
-    val_reward_fn = reward_manager_cls(tokenizer=tokenizer, num_examine=12, compute_score=compute_score)
+    val_reward_fn = reward_manager_cls(tokenizer=tokenizer, num_examine=12, compute_score=compute_score, **reward_kwargs)
 
     resource_pool_manager = ResourcePoolManager(resource_pool_spec=resource_pool_spec, mapping=mapping)
 
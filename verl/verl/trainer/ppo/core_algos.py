@@ -20,7 +20,6 @@ implement PPO
 
 import numpy as np
 import torch
-from collections import defaultdict
 
 import verl.utils.torch_functional as verl_F
 
@@ -107,10 +106,36 @@ def compute_gae_advantage_return(token_level_rewards: torch.Tensor, values: torc
     return advantages, returns
 
 
+def index_to_group_ids(index):
+    """
+    Map group keys (e.g. the numpy array of uid strings) to contiguous integer group ids.
+
+    Returns:
+        group_ids: `(torch.Tensor)`
+            shape: (bs,), dtype long
+        num_groups: `(int)`
+    """
+    _, inverse = np.unique(np.asarray(index), return_inverse=True)
+    group_ids = torch.from_numpy(inverse.reshape(-1).astype(np.int64))
+    return group_ids, int(group_ids.max().item()) + 1 if group_ids.numel() > 0 else 0
+
+
+def _group_mean_std(scores: torch.Tensor, group_ids: torch.Tensor, num_groups: int):
+    """Per-group count, mean and unbiased std computed with segment (scatter) reductions."""
+    group_ids = group_ids.to(scores.device)
+    counts = torch.bincount(group_ids, minlength=num_groups).to(scores.dtype)
+    sums = torch.zeros(num_groups, dtype=scores.dtype, device=scores.device).scatter_add_(0, group_ids, scores)
+    means = sums / counts
+    sq_dev = (scores - means[group_ids])**2
+    sq_sums = torch.zeros(num_groups, dtype=scores.dtype, device=scores.device).scatter_add_(0, group_ids, sq_dev)
+    stds = torch.sqrt(sq_sums / (counts - 1).clamp(min=1))
+    return counts, means, stds
+
+
 # NOTE(sgm): this implementation only consider outcome supervision, where the reward is a scalar.
 def compute_grpo_outcome_advantage(token_level_rewards: torch.Tensor,
                                    eos_mask: torch.Tensor,
-                                   index: torch.Tensor,
+                                   index: np.ndarray,
                                    epsilon: float = 1e-6):
     """
     Compute advantage for GRPO, operating only on Outcome reward 
@@ -120,6 +145,8 @@ def compute_grpo_outcome_advantage(token_level_rewards: torch.Tensor,
             shape: (bs, response_length)
         eos_mask: `(torch.Tensor)`
             shape: (bs, response_length)
+        index: `(np.ndarray)`
+            shape: (bs,). group key (uid) of each response
     
     Returns:
         advantages: `(torch.Tensor)`
@@ -130,25 +157,15 @@ def compute_grpo_outcome_advantage(token_level_rewards: torch.Tensor,
     response_length = token_level_rewards.shape[-1]
     scores = token_level_rewards.sum(dim=-1)
 
-    id2score = defaultdict(list)
-    id2mean = {}
-    id2std = {}
-
     with torch.no_grad():
-        bsz = scores.shape[0]
-        for i in range(bsz):
-            id2score[index[i]].append(scores[i])
-        for idx in id2score:
-            if len(id2score[idx]) == 1:
-                id2mean[idx] = torch.tensor(0.0)
-                id2std[idx] = torch.tensor(1.0)
-            elif len(id2score[idx]) > 1:
-                id2mean[idx] = torch.mean(torch.tensor(id2score[idx]))
-                id2std[idx] = torch.std(torch.tensor([id2score[idx]]))
-            else:
-                raise ValueError(f"no score in prompt index: {idx}")
-        for i in range(bsz):
-            scores[i] = (scores[i] - id2mean[index[i]]) / (id2std[index[i]] + epsilon)
+        group_ids, num_groups = index_to_group_ids(index)
+        counts, means, stds = _group_mean_std(scores, group_ids, num_groups)
+        # a singleton group is left unnormalized: mean 0, std 1
+        singleton = counts == 1
+        means = torch.where(singleton, torch.zeros_like(means), means)
+        stds = torch.where(singleton, torch.ones_like(stds), stds)
+        group_ids = group_ids.to(scores.device)
+        scores = (scores - means[group_ids]) / (stds[group_ids] + epsilon)
         scores = scores.unsqueeze(-1).tile([1, response_length]) * eos_mask
 
     return scores, scores
@@ -156,7 +173,7 @@ def compute_grpo_outcome_advantage(token_level_rewards: torch.Tensor,
 
 def compute_rloo_outcome_advantage(token_level_rewards: torch.Tensor,
                                    eos_mask: torch.Tensor,
-                                   index: torch.Tensor,
+                                   index: np.ndarray,
                                    epsilon: float = 1e-6):
     """
     Compute advantage for RLOO based on https://arxiv.org/abs/2402.14740
@@ -165,6 +182,8 @@ def compute_rloo_outcome_advantage(token_level_rewards: torch.Tensor,
             shape: (bs, response_length)
         eos_mask: `(torch.Tensor)`
             shape: (bs, response_length)
+        index: `(np.ndarray)`
+            shape: (bs,). group key (uid) of each response
 
     Returns:
         advantages: `(torch.Tensor)`
@@ -175,25 +194,16 @@ def compute_rloo_outcome_advantage(token_level_rewards: torch.Tensor,
     response_length = token_level_rewards.shape[-1]
     scores = token_level_rewards.sum(dim=-1)
 
-    id2score = defaultdict(list)
-    id2mean = {}
-
     with torch.no_grad():
-        bsz = scores.shape[0]
-        for i in range(bsz):
-            id2score[index[i]].append(scores[i])
-        for idx in id2score:
-            if len(id2score[idx]) == 1:
-                id2mean[idx] = torch.tensor(0.0)
-            elif len(id2score[idx]) > 1:
-                id2mean[idx] = torch.mean(torch.tensor(id2score[idx]))
-            else:
-                raise ValueError(f"no score in prompt index: {idx}")
-        for i in range(bsz):
-            response_num = len(id2score[index[i]])
-            if response_num > 1:
-                scores[i] = scores[i] * response_num / (response_num -
-                                                        1) - id2mean[index[i]] * response_num / (response_num - 1)
+        group_ids, num_groups = index_to_group_ids(index)
+        group_ids = group_ids.to(scores.device)
+        counts = torch.bincount(group_ids, minlength=num_groups).to(scores.dtype)
+        sums = torch.zeros(num_groups, dtype=scores.dtype, device=scores.device).scatter_add_(0, group_ids, scores)
+        means = sums / counts
+        response_num = counts[group_ids]
+        # leave-one-out baseline; singleton groups keep their raw score
+        loo = scores * response_num / (response_num - 1) - means[group_ids] * response_num / (response_num - 1)
+        scores = torch.where(response_num > 1, loo, scores)
         scores = scores.unsqueeze(-1).tile([1, response_length]) * eos_mask
 
     return scores, scores
@@ -18,6 +18,7 @@ This trainer supports model-agonistic model initialization with huggingface
 
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from enum import Enum
@@ -34,13 +35,15 @@ from verl.single_controller.base import Worker
 from verl.single_controller.ray import RayResourcePool, RayWorkerGroup, RayClassWithInitArgs
 from verl.single_controller.ray.base import create_colocated_worker_cls
 from verl.trainer.ppo import core_algos
-from verl.utils.seqlen_balancing import get_seqlen_balanced_partitions, log_seqlen_unbalance
+from verl.utils.seqlen_balancing import get_seqlen_balanced_partitions, log_seqlen_unbalance, seqlen_cost
 from verl.utils.checkpoint.checkpoint_manager import find_latest_ckpt_path
 from verl.utils.dataset.rl_dataset import RLHFDataset, collate_fn
+from verl.utils.dataset.curriculum_sampler import CurriculumSampler, zero_adv_mask, zero_adv_metrics
 from torch.utils.data import RandomSampler, SequentialSampler
 from torchdata.stateful_dataloader import StatefulDataLoader
 
 from verl.utils.logging_utils import timestamp
+from verl.workers.reward_manager.decode import DECODED_KEYS
 
 WorkerType = Type[Worker]
 
@@ -346,6 +349,15 @@ def compute_timing_metrics(batch, timing_raw):
         },
     }
 
+    # with pipeline_reward_fn, reward_fn runs in the background and the driver only blocks for reward_wait
+    overlap_metrics = {}
+    if 'reward_fn' in timing_raw and 'reward_wait' in timing_raw:
+        reward_overlap = max(timing_raw['reward_fn'] - timing_raw['reward_wait'], 0.)
+        overlap_metrics = {
+            'timing_s/reward_overlap': reward_overlap,
+            'timing_overlap_ratio/reward_fn': reward_overlap / timing_raw['reward_fn'] if timing_raw['reward_fn'] > 0 else 0.,
+        }
+
     return {
         **{
             f'timing_s/{name}': value for name, value in timing_raw.items()
@@ -354,6 +366,7 @@ def compute_timing_metrics(batch, timing_raw):
             f'timing_per_token_ms/{name}': timing_raw[name] * 1000 / num_tokens_of_section[name] for name in set(num_tokens_of_section.keys(
             )) & set(timing_raw.keys())
         },
+        **overlap_metrics,
     }
 
 
@@ -399,6 +412,14 @@ class RayPPOTrainer(object):
         self.use_rm = Role.RewardModel in role_worker_mapping
         self.ray_worker_group_cls = ray_worker_group_cls
 
+        # reward_fn consumes rm_scores when a reward model is used, so it can only be pipelined without one
+        self.pipeline_reward_fn = config.reward_model.get('pipeline_reward_fn', False) and not self.use_rm
+        self._reward_executor = None
+        # drop the groups whose rollouts all got the same score before the log_prob / ref / update passes
+        self.filter_groups = config.algorithm.get('filter_groups', {}).get('enable', False)
+        # global step of the async checkpoint that is still being written
+        self._pending_checkpoint_step = None
+
         # define KL control
         if self.use_reference_policy:
             if config.algorithm.kl_ctrl.type == 'fixed':
@@ -503,6 +524,11 @@ class RayPPOTrainer(object):
                 assert config.critic.model.use_remove_padding, \
                     "When using sequence parallelism for critic, you must enable `use_remove_padding`."
 
+        if self.filter_groups:
+            assert config.algorithm.adv_estimator in [AdvantageEstimator.GRPO, AdvantageEstimator.RLOO], \
+                f"filter_groups needs a group based advantage estimator, got {config.algorithm.adv_estimator}"
+            assert config.actor_rollout_ref.rollout.n > 1, "filter_groups needs rollout.n > 1"
+
         if config.data.get('val_batch_size', None) is not None:
             print(
                 f"WARNING: val_batch_size is deprecated. Validation datasets are sent to inference engines as a whole batch, which will schedule the memory themselves."
@@ -519,9 +545,26 @@ class RayPPOTrainer(object):
                                          filter_prompts=True,
                                          return_raw_chat=self.config.data.get('return_raw_chat', False),
                                          apply_chat_template=self.config.data.get('apply_chat_template', False),
-                                         truncation='error')
+                                         truncation='error',
+                                         tokenize_num_workers=self.config.data.get('tokenize_num_workers', 8),
+                                         columns=self.config.data.get('columns', None))
         # use sampler for better ckpt resume
-        if self.config.data.shuffle:
+        curriculum_config = self.config.data.get('curriculum', {})
+        self.curriculum_sampler = None
+        if curriculum_config.get('enable', False):
+            # pass-rate driven sampling, its table is saved with the dataloader state
+            train_dataloader_generator = torch.Generator()
+            train_dataloader_generator.manual_seed(self.config.data.get('seed', 1))
+            sampler = CurriculumSampler(keys=self.train_dataset.prompt_keys(),
+                                        generator=train_dataloader_generator,
+                                        ema=curriculum_config.get('ema', 0.5),
+                                        low=curriculum_config.get('low', 0.0),
+                                        high=curriculum_config.get('high', 1.0),
+                                        skip_weight=curriculum_config.get('skip_weight', 0.1),
+                                        correct_threshold=curriculum_config.get('correct_threshold', 0.9),
+                                        chunk_size=self.config.data.train_batch_size)
+            self.curriculum_sampler = sampler
+        elif self.config.data.shuffle:
             train_dataloader_generator = torch.Generator()
             train_dataloader_generator.manual_seed(self.config.data.get('seed', 1))
             sampler = RandomSampler(data_source=self.train_dataset, generator=train_dataloader_generator)
@@ -532,7 +575,8 @@ class RayPPOTrainer(object):
                                                    batch_size=self.config.data.train_batch_size,
                                                    drop_last=True,
                                                    collate_fn=collate_fn,
-                                                   sampler=sampler)
+                                                   sampler=sampler,
+                                                   num_workers=self.config.data.get('dataloader_num_workers', 0))
 
         self.val_dataset = RLHFDataset(parquet_files=self.config.data.val_files,
                                        tokenizer=self.tokenizer,
@@ -541,7 +585,9 @@ class RayPPOTrainer(object):
                                        filter_prompts=True,
                                        return_raw_chat=self.config.data.get('return_raw_chat', False),
                                        apply_chat_template=self.config.data.get('apply_chat_template', False),
-                                       truncation='error')
+                                       truncation='error',
+                                       tokenize_num_workers=self.config.data.get('tokenize_num_workers', 8),
+                                       columns=self.config.data.get('columns', None))
         self.val_dataloader = StatefulDataLoader(
             dataset=self.val_dataset,
             # Validation datasets are sent to inference engines as a whole batch,
@@ -566,6 +612,9 @@ class RayPPOTrainer(object):
 
         self.total_training_steps = total_training_steps
         print(f'Total training steps: {self.total_training_steps}')
+        if self.filter_groups:
+            print('WARNING: filter_groups takes more than one batch for some steps, the data may run out before '
+                  'total_training_steps and the lr schedule would not reach its end')
 
         OmegaConf.set_struct(self.config, True)
         with open_dict(self.config):
@@ -770,10 +819,17 @@ class RayPPOTrainer(object):
 
         actor_remote_path = None if self.config.trainer.default_hdfs_dir is None else os.path.join(
             self.config.trainer.default_hdfs_dir, f'global_step_{self.global_steps}', 'actor')
+        # with async_save the workers only snapshot their shards here and write them in the background
+        async_save = self._use_async_save()
+        if async_save:
+            # at most one save in flight, commit the previous one first
+            self._commit_checkpoint(block=True)
+
         self.actor_rollout_wg.save_checkpoint(actor_local_path,
                                               actor_remote_path,
                                               self.global_steps,
-                                              remove_previous_ckpt=self.config.trainer.remove_previous_ckpt_in_save)
+                                              remove_previous_ckpt=self.config.trainer.remove_previous_ckpt_in_save,
+                                              async_save=async_save)
 
         if self.use_critic:
             critic_local_path = os.path.join(local_global_step_folder, 'critic')
@@ -782,18 +838,56 @@ class RayPPOTrainer(object):
             self.critic_wg.save_checkpoint(critic_local_path,
                                            critic_remote_path,
                                            self.global_steps,
-                                           remove_previous_ckpt=self.config.trainer.remove_previous_ckpt_in_save)
+                                           remove_previous_ckpt=self.config.trainer.remove_previous_ckpt_in_save,
+                                           async_save=async_save)
 
         # save dataloader
         dataloader_local_path = os.path.join(local_global_step_folder, 'data.pt')
         dataloader_state_dict = self.train_dataloader.state_dict()
         torch.save(dataloader_state_dict, dataloader_local_path)
 
+        # make sure the reward samples of this step are on disk before the checkpoint is committed
+        self._flush_reward_samples()
+
+        if async_save:
+            # committed by _commit_checkpoint once every shard is on disk
+            self._pending_checkpoint_step = self.global_steps
+        else:
+            self._write_latest_checkpointed_iteration(self.global_steps)
+
+    def _use_async_save(self):
+        if not self.config.trainer.get('async_save_checkpoint', False):
+            return False
+        # only the fsdp workers implement async save
+        return self.config.actor_rollout_ref.actor.strategy == 'fsdp' and \
+            (not self.use_critic or self.config.critic.strategy == 'fsdp')
+
+    def _write_latest_checkpointed_iteration(self, global_steps):
         # latest checkpointed iteration tracker (for atomic usage)
         local_latest_checkpointed_iteration = os.path.join(self.config.trainer.default_local_dir,
                                                            'latest_checkpointed_iteration.txt')
-        with open(local_latest_checkpointed_iteration, 'w') as f:
-            f.write(str(self.global_steps))
+        with open(local_latest_checkpointed_iteration + '.tmp', 'w') as f:
+            f.write(str(global_steps))
+        os.replace(local_latest_checkpointed_iteration + '.tmp', local_latest_checkpointed_iteration)
+
+    def _commit_checkpoint(self, block=False):
+        """Commit the pending async checkpoint if every rank has written its shards.
+        Returns the time the slowest rank spent writing in the background, once committed."""
+        if self._pending_checkpoint_step is None:
+            return {}
+        worker_groups = [self.actor_rollout_wg] + ([self.critic_wg] if self.use_critic else [])
+        outputs = [output for wg in worker_groups for output in wg.wait_checkpoint(block=block)]
+        if not all(done for done, _ in outputs):
+            return {}
+        self._write_latest_checkpointed_iteration(self._pending_checkpoint_step)
+        print(f'Committed checkpoint of global step {self._pending_checkpoint_step}')
+        self._pending_checkpoint_step = None
+        return {'timing_s/save_checkpoint_background': max(seconds for _, seconds in outputs)}
+
+    def _flush_reward_samples(self):
+        for reward_fn in (self.reward_fn, self.val_reward_fn):
+            if hasattr(reward_fn, 'flush'):
+                reward_fn.flush()
 
     def _load_checkpoint(self):
         if self.config.trainer.resume_mode == 'disable':
@@ -857,9 +951,14 @@ class RayPPOTrainer(object):
         batch_size = attention_mask.shape[0]
         global_seqlen_lst = batch.batch['attention_mask'].view(batch_size, -1).sum(-1).tolist()  # (train_batch_size,)
         world_size = self.actor_rollout_wg.world_size
-        global_partition_lst = get_seqlen_balanced_partitions(global_seqlen_lst,
+        group_ids = None
+        if self.config.trainer.get('balance_keep_groups', False) and 'uid' in batch.non_tensor_batch:
+            group_ids = batch.non_tensor_batch['uid']
+        global_partition_lst = get_seqlen_balanced_partitions(seqlen_cost(global_seqlen_lst,
+                                                                          self.config.trainer.get('balance_attn_coef', 0.)),
                                                               k_partitions=world_size,
-                                                              equal_size=True)
+                                                              equal_size=True,
+                                                              group_ids=group_ids)
         # reorder based on index. The data will be automatically equally partitioned by dispatch function
         global_idx = torch.tensor([j for partition in global_partition_lst for j in partition])
         batch.reorder(global_idx)
@@ -868,6 +967,153 @@ class RayPPOTrainer(object):
                                                     prefix=logging_prefix)
         metrics.update(global_balance_stats)
 
+    def _submit_reward_fn(self, batch: DataProto):
+        """Run reward_fn in a background thread on a shallow snapshot of the batch.
+        The snapshot shares tensors with the batch but not its key sets, so later unions on the driver are safe.
+        """
+        if self._reward_executor is None:
+            self._reward_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reward_fn')
+
+        reward_batch = batch.select(batch_keys=list(batch.batch.keys()),
+                                    non_tensor_batch_keys=list(batch.non_tensor_batch.keys()),
+                                    meta_info_keys=list(batch.meta_info.keys()))
+
+        def _run():
+            with Timer(name='reward_fn', logger=None) as timer:
+                reward_tensor = self.reward_fn(reward_batch)
+            # hand the strings decoded by the reward manager back to the driver for the metrics
+            decoded = {key: reward_batch.non_tensor_batch[key] for key in DECODED_KEYS if key in reward_batch.non_tensor_batch}
+            return reward_tensor, decoded, timer.last
+
+        return self._reward_executor.submit(_run)
+
+    def _rollout(self, batch_dict, timing_raw):
+        """Generate the responses of a dataloader batch, returns the prompts repeated rollout.n times with the responses"""
+        batch: DataProto = DataProto.from_single_dict(batch_dict)
+
+        # pop those keys for generation
+        gen_batch = batch.pop(batch_keys=['input_ids', 'attention_mask', 'position_ids'])
+
+        # generate a batch
+        with _timer('gen', timing_raw):
+            gen_batch_output = self.actor_rollout_wg.generate_sequences(gen_batch)
+
+        # print(f"{timestamp()} ############ generate_sequences finish, spend time: {timing_raw['gen']}")
+
+        if self.config.algorithm.adv_estimator == AdvantageEstimator.REMAX:
+            with _timer('gen_max', timing_raw):
+                gen_baseline_batch = deepcopy(gen_batch)
+                gen_baseline_batch.meta_info['do_sample'] = False
+                gen_baseline_output = self.actor_rollout_wg.generate_sequences(gen_baseline_batch)
+
+                batch = batch.union(gen_baseline_output)
+                reward_baseline_tensor = self.reward_fn(batch)
+                reward_baseline_tensor = reward_baseline_tensor.sum(dim=-1)
+
+                batch.pop(batch_keys=list(gen_baseline_output.batch.keys()))
+
+                batch.batch['reward_baselines'] = reward_baseline_tensor
+
+                del gen_baseline_batch, gen_baseline_output
+
+        batch.non_tensor_batch['uid'] = np.array([str(uuid.uuid4()) for _ in range(len(batch.batch))], dtype=object)
+        # repeat to align with repeated responses in rollout
+        batch = batch.repeat(repeat_times=self.config.actor_rollout_ref.rollout.n, interleave=True)
+        batch = batch.union(gen_batch_output)
+        return batch
+
+    def _compute_reward(self, batch: DataProto, metrics, timing_raw, reward_future=None):
+        """Set token_level_scores, from the pipelined reward_fn when reward_future is given"""
+        # compute scores. Support both model and function-based.
+        # We first compute the scores using reward model. Then, we call reward_fn to combine
+        # the results from reward model and rule-based results.
+        if self.use_rm:
+            # we first compute reward model score
+            reward_tensor = self.rm_wg.compute_rm_score(batch)
+            batch = batch.union(reward_tensor)
+
+        if reward_future is not None:
+            with _timer('reward_wait', timing_raw):
+                reward_tensor, decoded, timing_raw['reward_fn'] = reward_future.result()
+                batch.batch['token_level_scores'] = reward_tensor
+                batch.non_tensor_batch.update(decoded)
+        else:
+            with _timer('reward_fn', timing_raw):
+                # we combine with rule-based rm
+                reward_tensor = self.reward_fn(batch)
+                batch.batch['token_level_scores'] = reward_tensor
+        for actor, actor_time in getattr(self.reward_fn, 'actor_timing', {}).items():
+            timing_raw[f'reward_actor/{actor}'] = actor_time
+        cache_stats = getattr(self.reward_fn, 'cache_stats', {})
+        if cache_stats:
+            # summed over the generation rounds of filter_groups, like timing_raw
+            for name in ('hits', 'disk_hits', 'misses', 'evictions'):
+                key = f'reward/verdict_cache_{name}'
+                metrics[key] = metrics.get(key, 0) + cache_stats.get(name, 0)
+            hits, misses = metrics['reward/verdict_cache_hits'], metrics['reward/verdict_cache_misses']
+            metrics['reward/verdict_cache_hit_rate'] = hits / (hits + misses) if hits + misses > 0 else 0.
+
+        # print(f"{timestamp()} ############ reward_fn finish, spend time: {timing_raw['reward_fn']}")
+
+        if self.curriculum_sampler is not None:
+            prompt_keys = [
+                f'{data_source}/{index}' for data_source, index in zip(batch.non_tensor_batch['data_source'],
+                                                                       batch.non_tensor_batch['index'])
+            ]
+            metrics.update(self.curriculum_sampler.update(prompt_keys, batch.batch['token_level_scores'].sum(-1).tolist()))
+        return batch
+
+    def _filtered_rollout(self, batch_dict, data_iter, metrics, timing_raw):
+        """
+        Generate and score rounds of prompts, pulling more batches from data_iter, until train_batch_size groups
+        whose responses did not all get the same score are collected. Those zero-advantage groups are dropped;
+        if algorithm.filter_groups.max_num_gen_batches rounds or the epoch run out first, dropped groups fill
+        the rest so the batch size stays fixed.
+        """
+        n = self.config.actor_rollout_ref.rollout.n
+        target_groups = self.config.data.train_batch_size
+        max_num_gen_batches = self.config.algorithm.filter_groups.get('max_num_gen_batches', 0)
+        save_path = getattr(self.reward_fn, 'save_path', None)
+
+        kept, dropped, generated = [], [], []
+        num_kept_groups = 0
+        num_gen_batches = 0
+        while batch_dict is not None:
+            if save_path is not None and num_gen_batches > 0:
+                # one shard of samples per generation round
+                base, ext = os.path.splitext(save_path)
+                self.reward_fn.save_path = f'{base}_gen_{num_gen_batches}{ext}'
+            round_timing = {}
+            batch = self._rollout(batch_dict, round_timing)
+            batch = self._compute_reward(batch, metrics, round_timing)
+            for name, value in round_timing.items():
+                timing_raw[name] = timing_raw.get(name, 0.) + value
+            num_gen_batches += 1
+
+            scores = batch.batch['token_level_scores'].sum(-1).numpy()
+            zero_adv = zero_adv_mask(batch.non_tensor_batch['uid'], scores)
+            generated.append((batch.non_tensor_batch['uid'], scores, _compute_response_info(batch)['response_length'].numpy()))
+            kept.append(batch.select_idxs(np.nonzero(~zero_adv)[0]))
+            dropped.append(batch.select_idxs(np.nonzero(zero_adv)[0]))
+            num_kept_groups += len(kept[-1]) // n
+            if num_kept_groups >= target_groups or 0 < max_num_gen_batches <= num_gen_batches:
+                break
+            batch_dict = next(data_iter, None)
+        if save_path is not None:
+            self.reward_fn.save_path = save_path
+
+        # responses of a group stay contiguous, so cutting at a multiple of n keeps whole groups
+        batch = DataProto.concat([b for b in kept + dropped if len(b) > 0])
+        batch = batch.select_idxs(np.arange(target_groups * n))
+
+        metrics.update(zero_adv_metrics(*[np.concatenate(columns) for columns in zip(*generated)]))
+        metrics.update({
+            'filter_groups/num_gen_batches': num_gen_batches,
+            'filter_groups/kept_group_frac': num_kept_groups / (sum(len(uids) for uids, _, _ in generated) // n),
+            'filter_groups/filled_groups': max(target_groups - num_kept_groups, 0),
+        })
+        return batch
+
     def fit(self):
         """
         The training loop of PPO.
@@ -900,60 +1146,48 @@ class RayPPOTrainer(object):
 
         # we start from step 1
         self.global_steps += 1
+        first_step = self.global_steps
 
         for epoch in range(self.config.trainer.total_epochs):
-            for batch_dict in self.train_dataloader:
+            # filter_groups pulls extra batches for the same step from this iterator
+            data_iter = iter(self.train_dataloader)
+            for batch_dict in data_iter:
                 metrics = {}
                 timing_raw = {}
 
                 # only reward_manager == prime_save
+                save_suffix = '.jsonl' if self.config.reward_model.get('my_reward_save_format', 'jsonl') == 'jsonl' else '.parquet'
                 if self.config.reward_model.get('my_reward_train_save_path') is not None:
-                    self.reward_fn.save_path = self.config.reward_model.my_reward_train_save_path + f"_step_{self.global_steps}.jsonl"
+                    self.reward_fn.save_path = self.config.reward_model.my_reward_train_save_path + f"_step_{self.global_steps}{save_suffix}"
                 if self.config.reward_model.get('my_reward_val_save_path') is not None:
-                    self.val_reward_fn.save_path = self.config.reward_model.my_reward_val_save_path + f"_step_{self.global_steps}.jsonl"
-
-                batch: DataProto = DataProto.from_single_dict(batch_dict)
-
-                # pop those keys for generation
-                gen_batch = batch.pop(batch_keys=['input_ids', 'attention_mask', 'position_ids'])
+                    self.val_reward_fn.save_path = self.config.reward_model.my_reward_val_save_path + f"_step_{self.global_steps}{save_suffix}"
 
                 with _timer('step', timing_raw):
-                    # generate a batch
-                    with _timer('gen', timing_raw):
-                        gen_batch_output = self.actor_rollout_wg.generate_sequences(gen_batch)
-
-                    # print(f"{timestamp()} ############ generate_sequences finish, spend time: {timing_raw['gen']}")
-
-                    if self.config.algorithm.adv_estimator == AdvantageEstimator.REMAX:
-                        with _timer('gen_max', timing_raw):
-                            gen_baseline_batch = deepcopy(gen_batch)
-                            gen_baseline_batch.meta_info['do_sample'] = False
-                            gen_baseline_output = self.actor_rollout_wg.generate_sequences(gen_baseline_batch)
-
-                            batch = batch.union(gen_baseline_output)
-                            reward_baseline_tensor = self.reward_fn(batch)
-                            reward_baseline_tensor = reward_baseline_tensor.sum(dim=-1)
-
-                            batch.pop(batch_keys=list(gen_baseline_output.batch.keys()))
-
-                            batch.batch['reward_baselines'] = reward_baseline_tensor
-
-                            del gen_baseline_batch, gen_baseline_output
-
-                    batch.non_tensor_batch['uid'] = np.array([str(uuid.uuid4()) for _ in range(len(batch.batch))],
-                                                             dtype=object)
-                    # repeat to align with repeated responses in rollout
-                    batch = batch.repeat(repeat_times=self.config.actor_rollout_ref.rollout.n, interleave=True)
-                    batch = batch.union(gen_batch_output)
+                    if self.filter_groups:
+                        # the reward decides which groups are kept, so it is computed right after generation
+                        batch = self._filtered_rollout(batch_dict, data_iter, metrics, timing_raw)
+                    else:
+                        batch = self._rollout(batch_dict, timing_raw)
 
                     # balance the number of valid tokens on each dp rank.
                     # Note that this breaks the order of data inside the batch.
                     # Please take care when you implement group based adv computation such as GRPO and rloo
                     self._balance_batch(batch, metrics=metrics)
 
+                    # decoded strings are only used on the driver, keep them out of the worker RPCs.
+                    # With filter_groups the reward already attached them, they are popped after
+                    # _balance_batch so that they are reordered with the batch
+                    decoded = {key: batch.non_tensor_batch.pop(key) for key in DECODED_KEYS if key in batch.non_tensor_batch}
+
                     # compute global_valid tokens
                     batch.meta_info['global_token_num'] = torch.sum(batch.batch['attention_mask'], dim=-1).tolist()
 
+                    # start scoring now so that it overlaps with the log_prob passes below.
+                    # It is submitted after _balance_batch because reorder modifies the batch in place.
+                    reward_future = None
+                    if self.pipeline_reward_fn and not self.filter_groups:
+                        reward_future = self._submit_reward_fn(batch)
+
                     # recompute old_log_probs
                     with _timer('old_log_prob', timing_raw):
                         old_log_prob = self.actor_rollout_wg.compute_log_prob(batch)
@@ -978,20 +1212,12 @@ class RayPPOTrainer(object):
                         # print(f"{timestamp()} ############ compute_values finish, spend time: {timing_raw['values']}")
 
                     with _timer('adv', timing_raw):
-                        # compute scores. Support both model and function-based.
-                        # We first compute the scores using reward model. Then, we call reward_fn to combine
-                        # the results from reward model and rule-based results.
-                        if self.use_rm:
-                            # we first compute reward model score
-                            reward_tensor = self.rm_wg.compute_rm_score(batch)
-                            batch = batch.union(reward_tensor)
-
-                        with _timer('reward_fn', timing_raw):
-                            # we combine with rule-based rm
-                            reward_tensor = self.reward_fn(batch)
-                            batch.batch['token_level_scores'] = reward_tensor
-                        
-                        # print(f"{timestamp()} ############ reward_fn finish, spend time: {timing_raw['reward_fn']}")
+                        if not self.filter_groups:
+                            batch = self._compute_reward(batch, metrics, timing_raw, reward_future)
+                            metrics.update(
+                                zero_adv_metrics(batch.non_tensor_batch['uid'],
+                                                 batch.batch['token_level_scores'].sum(-1).tolist(),
+                                                 _compute_response_info(batch)['response_length'].tolist()))
 
                         # compute rewards. apply_kl_penalty if available
                         if not self.config.actor_rollout_ref.actor.get('use_kl_loss', False):
@@ -1014,6 +1240,9 @@ class RayPPOTrainer(object):
                     
                     # print(f"{timestamp()} ############ adv finish, spend time: {timing_raw['adv']}")    
 
+                    # the pipelined or inline reward attaches them again
+                    decoded.update({key: batch.non_tensor_batch.pop(key) for key in DECODED_KEYS if key in batch.non_tensor_batch})
+
                     # update critic
                     if self.use_critic:
                         with _timer('update_critic', timing_raw):
@@ -1035,6 +1264,8 @@ class RayPPOTrainer(object):
                         actor_output_metrics = reduce_metrics(actor_output.meta_info['metrics'])
                         metrics.update(actor_output_metrics)
 
+                    batch.non_tensor_batch.update(decoded)
+
                     # validate
                     if self.val_reward_fn is not None and self.config.trainer.test_freq > 0 and \
                         self.global_steps % self.config.trainer.test_freq == 0:
@@ -1051,6 +1282,8 @@ class RayPPOTrainer(object):
                 metrics.update(compute_data_metrics(batch=batch, use_critic=self.use_critic))
                 metrics.update(compute_timing_metrics(batch=batch, timing_raw=timing_raw))
                 metrics.update(self.custom_metric(batch))
+                # timing_s/save_checkpoint is the stall of the training loop, the write is reported on commit
+                metrics.update(self._commit_checkpoint(block=False))
 
                 # TODO: make a canonical logger that supports various backend
                 logger.log(data=metrics, step=self.global_steps)
@@ -1058,18 +1291,31 @@ class RayPPOTrainer(object):
                 self.global_steps += 1
 
                 if self.global_steps >= self.total_training_steps:
-
-                    # perform validation after training
-                    if self.val_reward_fn is not None:
-                        val_metrics = self._validate()
-                        pprint(f'Final validation metrics: {val_metrics}')
-                        logger.log(data=val_metrics, step=self.global_steps)
-                    if self.config.trainer.save_freq > 0 and \
-                            (self.global_steps - 1) % self.config.trainer.save_freq != 0:
-                        with _timer('save_checkpoint', timing_raw):
-                            self._save_checkpoint()
+                    self._finish_training(logger)
                     return
 
+        # the data ran out before total_training_steps, which filter_groups makes likely: every extra
+        # generation round takes one more batch. Validate and save the last step all the same
+        print(f'Training data exhausted after {self.global_steps - 1} of {self.total_training_steps} steps')
+        if self.global_steps > first_step:
+            self._finish_training(logger)
+        else:
+            self._commit_checkpoint(block=True)
+            self._flush_reward_samples()
+
+    def _finish_training(self, logger):
+        """Validate, save the last step unless save_freq just did, and commit the checkpoint"""
+        # perform validation after training
+        if self.val_reward_fn is not None:
+            val_metrics = self._validate()
+            pprint(f'Final validation metrics: {val_metrics}')
+            logger.log(data=val_metrics, step=self.global_steps)
+        if self.config.trainer.save_freq > 0 and \
+                (self.global_steps - 1) % self.config.trainer.save_freq != 0:
+            self._save_checkpoint()
+        self._commit_checkpoint(block=True)
+        self._flush_reward_samples()
+
     def custom_metric(self, batch):
         from verl.workers.reward_manager.metric import metric_experience
         custom_metric_result = metric_experience(self.tokenizer, batch)
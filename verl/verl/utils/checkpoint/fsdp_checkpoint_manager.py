@@ -14,6 +14,8 @@
 
 import ray
 import os
+import time
+import threading
 
 import warnings
 
@@ -21,7 +23,10 @@ import torch
 import torch.distributed
 from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType
 from torch.distributed.fsdp import ShardedStateDictConfig, ShardedOptimStateDictConfig
+from torch.distributed._shard.sharded_tensor import ShardedTensor
+from torch.distributed._tensor import DTensor
 
+from verl.utils import hdfs_io
 from verl.utils.fs import copy_to_local, is_non_local
 
 from transformers import PreTrainedTokenizer
@@ -47,6 +52,11 @@ class FSDPCheckpointManager(BaseCheckpointManager):
     def __init__(self, model: FSDP, optimizer: torch.optim.Optimizer,
                  lr_scheduler: torch.optim.lr_scheduler.LRScheduler, tokenizer: PreTrainedTokenizer, *args, **kwargs):
         super().__init__(model, optimizer, lr_scheduler, tokenizer)
+        # async save state, see save_checkpoint
+        self._save_thread = None
+        self._save_error = None
+        self._pinned_buffers = {}
+        self.last_save_time = 0.
 
     def load_checkpoint(self, path=None, del_local_after_load=False, *args, **kwargs):
         if path is None:
@@ -93,7 +103,23 @@ class FSDPCheckpointManager(BaseCheckpointManager):
         if self.lr_scheduler is not None:
             self.lr_scheduler.load_state_dict(lr_scheduler_state_dict)
 
-    def save_checkpoint(self, local_path: str, global_step: int, remove_previous_ckpt=False, *args, **kwargs):
+    def save_checkpoint(self,
+                        local_path: str,
+                        global_step: int,
+                        remove_previous_ckpt=False,
+                        hdfs_path=None,
+                        async_save=False,
+                        *args,
+                        **kwargs):
+        """Save the sharded states of this rank to local_path, and upload them to hdfs_path if given.
+
+        With async_save, the states are copied into reusable pinned CPU buffers and the files are written by
+        a background thread, so this returns as soon as the snapshot is taken. Call wait_save() before
+        relying on the files; at most one save is in flight.
+        """
+        # the previous save must be complete before its folder is removed or its buffers are reused
+        self.wait_save()
+
         # record the previous global step
         self.previous_global_step = global_step
 
@@ -131,19 +157,92 @@ class FSDPCheckpointManager(BaseCheckpointManager):
                 print(f'[rank-{self.rank}]: Saving model to {os.path.abspath(model_path)}')
                 print(f'[rank-{self.rank}]: Saving checkpoint to {os.path.abspath(model_path)}')
                 print(f'[rank-{self.rank}]: Saving extra_state to {os.path.abspath(extra_path)}')
-                torch.save(model_state_dict, model_path)
-                torch.save(optimizer_state_dict, optim_path)  # TODO: address optimizer is None
-                torch.save(extra_state_dict, extra_path)
+                files = [(model_state_dict, model_path), (optimizer_state_dict, optim_path),
+                         (extra_state_dict, extra_path)]  # TODO: address optimizer is None
+
+                if async_save:
+                    # offloaded states may share storage with live CPU tensors, so always take a real copy
+                    files = [(self._snapshot(state, name), path)
+                             for (state, path), name in zip(files, ('model', 'optim', 'extra'))]
+                    if torch.cuda.is_available():
+                        torch.cuda.synchronize()
+                    self._save_thread = threading.Thread(target=self._write_files,
+                                                         args=(files, hdfs_path),
+                                                         name='async_checkpoint',
+                                                         daemon=True)
+                    self._save_thread.start()
+                else:
+                    self._write_files(files, hdfs_path)
 
-        # wait for everyone to dump to local
-        torch.distributed.barrier()
+        if not async_save:
+            # wait for everyone to dump to local
+            torch.distributed.barrier()
 
         if self.rank == 0:
             hf_local_path = os.path.join(local_path, 'huggingface')
             os.makedirs(hf_local_path, exist_ok=True)
             self.model._fsdp_wrapped_module.config.save_pretrained(hf_local_path)
             self.tokenizer.save_pretrained(hf_local_path)
+            if hdfs_path is not None:
+                hdfs_io.makedirs(hdfs_path, exist_ok=True)
+                hdfs_io.copy(src=hf_local_path, dst=hdfs_path)
 
         torch.distributed.barrier()
 
         self.previous_save_local_path = local_path
+
+    def _snapshot(self, obj, name):
+        """Copy every tensor of a (nested) state dict into a pinned CPU buffer kept for the next save."""
+        if isinstance(obj, dict):
+            return {k: self._snapshot(v, f'{name}.{k}') for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v, f'{name}.{i}') for i, v in enumerate(obj))
+        if isinstance(obj, ShardedTensor):
+            for i, shard in enumerate(obj.local_shards()):
+                shard.tensor = self._snapshot(shard.tensor, f'{name}.shard{i}')
+            return obj
+        if isinstance(obj, DTensor):
+            return DTensor.from_local(self._snapshot(obj.to_local(), f'{name}.local'),
+                                      obj.device_mesh,
+                                      obj.placements,
+                                      run_check=False,
+                                      shape=obj.shape,
+                                      stride=obj.stride())
+        if isinstance(obj, torch.Tensor):
+            buffer = self._pinned_buffers.get(name)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=torch.cuda.is_available())
+                self._pinned_buffers[name] = buffer
+            buffer.copy_(obj, non_blocking=True)
+            return buffer
+        return obj
+
+    def _write_files(self, files, hdfs_path=None):
+        stt = time.time()
+        try:
+            for state, path in files:
+                # a file is either complete or absent
+                torch.save(state, path + '.tmp')
+                os.replace(path + '.tmp', path)
+            if hdfs_path is not None:
+                hdfs_io.makedirs(hdfs_path, exist_ok=True)
+                for _, path in files:
+                    hdfs_io.copy(src=path, dst=hdfs_path)
+            self._save_error = None
+        except Exception as e:
+            print(f'[rank-{self.rank}]: Saving checkpoint failed: {e}')
+            self._save_error = e
+        self.last_save_time = time.time() - stt
+
+    def save_done(self):
+        """Whether no save of this rank is in flight."""
+        return self._save_thread is None or not self._save_thread.is_alive()
+
+    def wait_save(self):
+        """Block until the in-flight save of this rank is on disk (and uploaded). Returns the seconds it took."""
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+            if self._save_error is not None:
+                raise RuntimeError(f'[rank-{self.rank}]: async checkpoint save failed') from self._save_error
+        return self.last_save_time
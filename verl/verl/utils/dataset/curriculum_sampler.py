@@ -0,0 +1,187 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Training sampler that follows the online pass rate of every prompt.
+
+A prompt whose rollouts all pass (saturated) or all fail (impossible) gets a zero GRPO advantage, the
+generation spent on it is wasted. The sampler keeps a running pass rate per prompt, fed back from the
+reward of every step, and samples such prompts with a lower weight.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def group_scores(keys, scores):
+    """`{key: [score, ...]}` of the responses of every prompt in the batch"""
+    groups = defaultdict(list)
+    for key, score in zip(keys, scores):
+        groups[key].append(float(score))
+    return groups
+
+
+def zero_adv_mask(uids, scores):
+    """Per response: True when every response of its group (same uid) got the same score, i.e. a zero GRPO advantage"""
+    uids = np.asarray(uids)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(uids) == 0:
+        return np.zeros(0, dtype=bool)
+    _, inverse = np.unique(uids, return_inverse=True)
+    num_groups = inverse.max() + 1
+    group_max = np.full(num_groups, -np.inf)
+    group_min = np.full(num_groups, np.inf)
+    np.maximum.at(group_max, inverse, scores)
+    np.minimum.at(group_min, inverse, scores)
+    return ((group_max - group_min) <= 1e-6)[inverse]
+
+
+def zero_adv_metrics(uids, scores, response_lengths):
+    """
+    Share of the groups, and of their generated tokens, where every response got the same score.
+    The advantage of those responses is zero, their generation and training compute is wasted.
+    """
+    uids = np.asarray(uids)
+    response_lengths = np.asarray(response_lengths, dtype=np.float64)
+    zero_adv = zero_adv_mask(uids, scores)
+    num_groups = len(np.unique(uids))
+    return {
+        'curriculum/zero_adv_group_frac': len(np.unique(uids[zero_adv])) / num_groups if num_groups else 0.0,
+        'curriculum/zero_adv_token_frac': float(response_lengths[zero_adv].sum() / max(response_lengths.sum(), 1.0)),
+    }
+
+
+class CurriculumSampler(Sampler[int]):
+    """
+    Weighted sampler over the prompts of a dataset, without replacement within a pass.
+
+    `keys[i]` identifies the prompt at position i, e.g. `data_source/extra_info.index`. Positions with the same
+    key share one pass rate. Unseen prompts have weight 1; prompts whose pass rate is `<= low` (impossible) or
+    `>= high` (saturated) get `skip_weight`, 0 skips them. Items are drawn `chunk_size` at a time with the
+    weights of that moment, so feedback from a step already shapes the next batch. An epoch always yields
+    `len(keys)` items: once the positive-weight prompts of a pass are used up, a new pass starts.
+
+    The pass-rate table and the position in the pass are part of `state_dict`, which StatefulDataLoader stores
+    in the dataloader checkpoint.
+    """
+
+    def __init__(self,
+                 keys: List[str],
+                 generator: torch.Generator = None,
+                 ema: float = 0.5,
+                 low: float = 0.0,
+                 high: float = 1.0,
+                 skip_weight: float = 0.1,
+                 correct_threshold: float = 0.9,
+                 chunk_size: int = 256):
+        self.keys = list(keys)
+        self.generator = generator if generator is not None else torch.Generator()
+        self.ema = ema
+        self.low = low
+        self.high = high
+        self.skip_weight = skip_weight
+        self.correct_threshold = correct_threshold
+        self.chunk_size = chunk_size
+
+        self.key_positions = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            self.key_positions[key].append(position)
+        # key -> [running pass rate, number of rollouts seen]
+        self.pass_rates: Dict[str, List[float]] = {}
+        self.weights = torch.ones(len(self.keys), dtype=torch.float64)
+
+        # position in the current pass, restored by load_state_dict
+        self.remaining = None
+        self.yielded = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _weight(self, pass_rate):
+        if pass_rate <= self.low or pass_rate >= self.high:
+            return self.skip_weight
+        return 1.0
+
+    def __iter__(self) -> Iterator[int]:
+        if self.remaining is None or self.yielded >= len(self):
+            self.remaining = torch.ones(len(self.keys), dtype=torch.bool)
+            self.yielded = 0
+        while self.yielded < len(self):
+            weights = self.weights * self.remaining
+            if not bool((weights > 0).any()):
+                # every prompt with a positive weight was drawn in this pass, start a new one
+                self.remaining = torch.ones(len(self.keys), dtype=torch.bool)
+                weights = self.weights.clone()
+                if not bool((weights > 0).any()):
+                    weights = torch.ones_like(weights)
+            num = min(self.chunk_size, len(self) - self.yielded, int((weights > 0).sum()))
+            chunk = torch.multinomial(weights, num, replacement=False, generator=self.generator)
+            for position in chunk.tolist():
+                self.remaining[position] = False
+                self.yielded += 1
+                yield position
+
+    def update(self, keys, scores) -> Dict[str, float]:
+        """
+        Feed back the sequence scores of a batch, `keys[i]` is the prompt key of response i.
+        Returns metrics about the pass-rate table.
+        """
+        for key, group in group_scores(keys, scores).items():
+            pass_rate = float(np.mean([score > self.correct_threshold for score in group]))
+            entry = self.pass_rates.get(key)
+            if entry is None:
+                entry = [pass_rate, 0]
+                self.pass_rates[key] = entry
+            else:
+                entry[0] = (1.0 - self.ema) * entry[0] + self.ema * pass_rate
+            entry[1] += len(group)
+            weight = self._weight(entry[0])
+            for position in self.key_positions.get(key, []):
+                self.weights[position] = weight
+
+        rates = np.array([entry[0] for entry in self.pass_rates.values()])
+        num_prompts = max(len(self.key_positions), 1)
+        return {
+            'curriculum/tracked_frac': len(self.pass_rates) / num_prompts,
+            'curriculum/saturated_frac': float((rates >= self.high).sum()) / num_prompts,
+            'curriculum/impossible_frac': float((rates <= self.low).sum()) / num_prompts,
+            'curriculum/mean_pass_rate': float(rates.mean()) if len(rates) else 0.0,
+        }
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            'pass_rates': {key: list(entry) for key, entry in self.pass_rates.items()},
+            'generator': self.generator.get_state(),
+            'remaining': None if self.remaining is None else self.remaining.clone(),
+            'yielded': self.yielded,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.pass_rates = {key: list(entry) for key, entry in state_dict['pass_rates'].items()}
+        self.weights = torch.ones(len(self.keys), dtype=torch.float64)
+        for key, entry in self.pass_rates.items():
+            for position in self.key_positions.get(key, []):
+                self.weights[position] = self._weight(entry[0])
+        self.generator.set_state(state_dict['generator'])
+        remaining = state_dict['remaining']
+        # the dataset may have changed since the checkpoint, then the pass restarts
+        if remaining is not None and len(remaining) == len(self.keys):
+            self.remaining = remaining.clone()
+            self.yielded = state_dict['yielded']
+        else:
+            self.remaining = None
+            self.yielded = 0
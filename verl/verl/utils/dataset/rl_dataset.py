@@ -14,9 +14,15 @@
 
 from omegaconf import ListConfig
 import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Union
 import copy
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 import torch
 import numpy as np
@@ -54,6 +60,120 @@ def collate_fn(data_list: list[dict]) -> dict:
     return output
 
 
+def file_hash(path, block_size=1 << 24):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cached_file_hash(path, cache_dir):
+    """
+    `file_hash` memoized on (path, size, mtime), so an unchanged file is only read once.
+    """
+    stat = os.stat(path)
+    stat_key = hashlib.sha256(json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns]).encode()).hexdigest()
+    hash_path = os.path.join(cache_dir, 'file_hashes', stat_key)
+    if os.path.exists(hash_path):
+        with open(hash_path) as f:
+            return f.read().strip()
+    content_hash = file_hash(path)
+    os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+    with open(f'{hash_path}.{os.getpid()}.tmp', 'w') as f:
+        f.write(content_hash)
+    os.replace(f'{hash_path}.{os.getpid()}.tmp', hash_path)
+    return content_hash
+
+
+def write_arrow(path, schema, batches):
+    """Write record batches into an uncompressed Arrow IPC file, which can be memory mapped zero-copy."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write(batch)
+    os.replace(tmp_path, path)
+
+
+def read_arrow(path, columns=None):
+    """Memory map an Arrow IPC file, the pages are shared by every process that maps it."""
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def parquet_to_arrow(parquet_files, path, batch_size=8192):
+    """
+    Stream parquet files into one Arrow file with their unified schema, one record batch at a time.
+    A column missing from a file is filled with nulls.
+    """
+    schema = pa.unify_schemas([pq.read_schema(f) for f in parquet_files], promote_options='permissive')
+    schema = schema.remove_metadata()
+
+    def batches():
+        for parquet_file in parquet_files:
+            for batch in pq.ParquetFile(parquet_file).iter_batches(batch_size=batch_size):
+                yield pa.record_batch([
+                    batch.column(field.name).cast(field.type)
+                    if field.name in batch.schema.names else pa.nulls(len(batch), field.type)
+                    for field in schema
+                ], schema=schema)
+
+    write_arrow(path, schema, batches())
+
+
+def tokenizer_hash(tokenizer):
+    """Fingerprint of everything that changes the token ids of a prompt: vocab, merges, normalizer and chat template"""
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode())
+    if getattr(tokenizer, 'is_fast', False):
+        h.update(tokenizer.backend_tokenizer.to_str().encode())
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    h.update(str(getattr(tokenizer, 'chat_template', None)).encode())
+    return h.hexdigest()
+
+
+_worker_tokenizer = None
+
+
+def _init_tokenize_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _tokenize_chunk(texts, tokenizer=None):
+    tokenizer = tokenizer or _worker_tokenizer
+    # same encoding as tokenize_and_postprocess_data, the fast tokenizer encodes the chunk in parallel
+    ids = tokenizer(texts, add_special_tokens=False, return_attention_mask=False)['input_ids']
+    lengths = np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+    values = np.concatenate([np.asarray(x, dtype=np.int32) for x in ids]) if ids else np.zeros(0, dtype=np.int32)
+    return lengths, values
+
+
+def batch_tokenize(texts, tokenizer, num_workers=0, chunk_size=4096):
+    """
+    Token ids of every text as `(offsets, values)`: the ids of text i are `values[offsets[i]:offsets[i + 1]]`.
+    With `num_workers > 0` the chunks are encoded by a process pool.
+    """
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if num_workers > 0 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(chunks)),
+                                 mp_context=multiprocessing.get_context('forkserver'),
+                                 initializer=_init_tokenize_worker,
+                                 initargs=(tokenizer,)) as executor:
+            results = list(executor.map(_tokenize_chunk, chunks))
+    else:
+        results = [_tokenize_chunk(chunk, tokenizer) for chunk in chunks]
+    lengths = np.concatenate([r[0] for r in results]) if results else np.zeros(0, dtype=np.int64)
+    values = np.concatenate([r[1] for r in results]) if results else np.zeros(0, dtype=np.int32)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets, values
+
+
 class RLHFDataset(Dataset):
     """
     We assume the dataset contains a column that contains prompts and other information
@@ -69,7 +189,9 @@ class RLHFDataset(Dataset):
                  chat_template_func=None,
                  apply_chat_template=True,
                  return_raw_chat=False,
-                 truncation='error'
+                 truncation='error',
+                 tokenize_num_workers=8,
+                 columns=None
         ):
         if not isinstance(parquet_files, (List, ListConfig)):
             parquet_files = [parquet_files]
@@ -88,6 +210,9 @@ class RLHFDataset(Dataset):
 
         self.return_raw_chat = return_raw_chat        
         self.truncation = truncation
+        self.tokenize_num_workers = tokenize_num_workers
+        # columns returned by __getitem__ besides the prompt, None for all of them
+        self.columns = list(columns) if columns is not None else None
 
         # whether to store the dataset in state_dict()
         # default not store
@@ -102,29 +227,83 @@ class RLHFDataset(Dataset):
             self.parquet_files[i] = copy_to_local(src=parquet_file, cache_dir=self.cache_dir)
 
     def _read_files_and_tokenize(self):
-        dataframes = []
-        for parquet_file in self.parquet_files:
-            # read parquet files and cache
-            dataframe = pd.read_parquet(parquet_file)
-            dataframes.append(dataframe)
-        self.dataframe = pd.concat(dataframes)
-
-        print(f'original dataset len: {len(self.dataframe)}')
-
-        # filter out too long prompts
+        file_hashes = [cached_file_hash(parquet_file, self.cache_dir) for parquet_file in self.parquet_files]
+        # the parquet files are converted once into an uncompressed Arrow file that is memory mapped:
+        # nothing is loaded upfront and dataloader workers share its pages through the OS cache
+        self.arrow_path = os.path.join(self.cache_dir, 'arrow',
+                                       hashlib.sha256(json.dumps(file_hashes).encode()).hexdigest() + '.arrow')
+        if not os.path.exists(self.arrow_path):
+            parquet_to_arrow(self.parquet_files, self.arrow_path)
+        table = read_arrow(self.arrow_path)
+
+        print(f'original dataset len: {len(table)}')
+
+        # filter out too long prompts, the token ids of the kept ones are reused by __getitem__
+        self.pretokenized_path = self._pretokenized_path(file_hashes)
+        if not os.path.exists(self.pretokenized_path):
+            self._tokenize(table)
+        self._open()
+
+        print(f'filter dataset len: {len(self)}')
+
+    def _pretokenized_path(self, file_hashes):
+        key = hashlib.sha256(
+            json.dumps([
+                file_hashes,
+                tokenizer_hash(self.tokenizer),
+                self.max_prompt_length,
+                self.prompt_key,
+                self.apply_chat_template,
+            ]).encode()).hexdigest()
+        return os.path.join(self.cache_dir, 'pretokenized', f'{key}.arrow')
+
+    def _tokenize(self, table):
+        """
+        Store the positions of the prompts that fit in max_prompt_length and their token ids in an Arrow file
+        keyed by the content of the parquet files, the tokenizer and max_prompt_length, so a restart or a
+        resume memory maps it instead of tokenizing again.
+        """
         tokenizer = self.tokenizer
-        prompt_key = self.prompt_key
-
+        prompts = table.column(self.prompt_key).to_pylist()
         if self.apply_chat_template:
-            self.dataframe = self.dataframe[
-                self.dataframe.apply(lambda doc: len(tokenizer.apply_chat_template(doc[prompt_key], add_generation_prompt=True)) <= self.max_prompt_length, axis=1)
-            ]
+            texts = [tokenizer.apply_chat_template(chat, add_generation_prompt=True, tokenize=False) for chat in prompts]
         else:
-            self.dataframe = self.dataframe[
-                self.dataframe.apply(lambda doc: len(tokenizer.tokenize(doc[prompt_key])) <= self.max_prompt_length, axis=1)
-            ]
-
-        print(f'filter dataset len: {len(self.dataframe)}')
+            texts = prompts
+        offsets, values = batch_tokenize(texts, tokenizer, num_workers=self.tokenize_num_workers)
+        lengths = np.diff(offsets)
+        keep = lengths <= self.max_prompt_length
+        rows = np.nonzero(keep)[0]
+        # the ids of the kept rows only, in their order
+        kept_values = values[np.repeat(keep, lengths)]
+        kept_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths[rows], out=kept_offsets[1:])
+        pretokenized = pa.table({
+            'row': pa.array(rows, type=pa.int64()),
+            'input_ids': pa.LargeListArray.from_arrays(pa.array(kept_offsets), pa.array(kept_values, type=pa.int32())),
+        })
+        write_arrow(self.pretokenized_path, pretokenized.schema, pretokenized.to_batches())
+        print(f'pre-tokenized {len(texts)} prompts into {self.pretokenized_path}')
+
+    def _open(self):
+        """Memory map the dataset and its token ids, also called by dataloader workers after unpickling."""
+        columns = None
+        if self.columns is not None:
+            columns = [self.prompt_key] + [c for c in self.columns if c != self.prompt_key]
+        self.table = read_arrow(self.arrow_path, columns)
+        pretokenized = read_arrow(self.pretokenized_path)
+        input_ids = pretokenized.column('input_ids').combine_chunks()
+        # views into the memory mapped files
+        self.rows = pretokenized.column('row').to_numpy()
+        self.prompt_offsets = input_ids.offsets.to_numpy()
+        self.prompt_values = input_ids.values.to_numpy()
+
+    def prompt_keys(self):
+        """`data_source/extra_info.index` of every prompt, the identity used by CurriculumSampler"""
+        table = read_arrow(self.arrow_path, ['data_source', 'extra_info']).take(pa.array(self.rows))
+        data_sources = table.column('data_source').to_pylist()
+        indices = pc.struct_field(table.column('extra_info'), 'index').to_pylist()
+        # same default as the `index` of __getitem__
+        return [f'{data_source}/{0 if index is None else index}' for data_source, index in zip(data_sources, indices)]
 
     def resume_dataset_state(self):
         self.serialize_dataset = False if hasattr(self, 'original_parquet_files') else True
@@ -136,27 +315,29 @@ class RLHFDataset(Dataset):
             print(r'old dataloader ckpt file is used, please train from scratch for better ckpt performance')
 
     def __len__(self):
-        return len(self.dataframe)
+        if 'rows' not in self.__dict__:
+            self._open()
+        return len(self.rows)
 
     def __getitem__(self, item):
         """
         Note that we also return the raw_input_ids so that it can be combined with other chat template
         """
-        row_dict = self.dataframe.iloc[item].to_dict()
+        if 'table' not in self.__dict__:
+            self._open()
+        # only this row of the projected columns is converted to python objects
+        row_dict = self.table.slice(int(self.rows[item]), 1).to_pylist()[0]
 
         chat = row_dict.pop(self.prompt_key)
 
-        if self.apply_chat_template:
-            prompt_with_chat_template = self.tokenizer.apply_chat_template(chat, add_generation_prompt=True, tokenize=False)
-        else:
-            prompt_with_chat_template = chat
-
-        input_ids, attention_mask = verl_F.tokenize_and_postprocess_data(prompt=prompt_with_chat_template,
-                                                                         tokenizer=self.tokenizer,
-                                                                         max_length=self.max_prompt_length,
-                                                                         pad_token_id=self.tokenizer.pad_token_id,
-                                                                         left_pad=True,
-                                                                         truncation=self.truncation)
+        # pre-tokenized ids, left padded to max_prompt_length. Longer prompts were filtered out.
+        ids = self.prompt_values[self.prompt_offsets[item]:self.prompt_offsets[item + 1]]
+        input_ids = np.full((1, self.max_prompt_length), self.tokenizer.pad_token_id, dtype=np.int64)
+        input_ids[0, self.max_prompt_length - len(ids):] = ids
+        attention_mask = np.zeros((1, self.max_prompt_length), dtype=np.int64)
+        attention_mask[0, self.max_prompt_length - len(ids):] = 1
+        input_ids = torch.from_numpy(input_ids)
+        attention_mask = torch.from_numpy(attention_mask)
 
         position_ids = compute_position_id_with_mask(attention_mask)
 
@@ -166,7 +347,7 @@ class RLHFDataset(Dataset):
 
         # encode prompts without chat template
         if self.return_raw_chat:
-            row_dict['raw_prompt'] = chat.tolist()
+            row_dict['raw_prompt'] = list(chat)
 
         # add index for each prompt
         index = row_dict.get("extra_info", {}).get("index", 0)
@@ -178,7 +359,8 @@ class RLHFDataset(Dataset):
         if not self.serialize_dataset:
             state = self.__dict__.copy()
 
-            if 'dataframe' in state:
-                del state['dataframe']
+            # memory maps are reopened by _open on first access
+            for key in ('table', 'rows', 'prompt_offsets', 'prompt_values'):
+                state.pop(key, None)
             return state
         return self.__dict__.copy()
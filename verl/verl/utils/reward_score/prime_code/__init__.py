@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from .utils import check_correctness as apps_check_correctness
+from .utils import check_correctness_many as apps_check_correctness_many
 import json
 import re
 import traceback
@@ -49,8 +50,13 @@ def compute_score(completion, test_cases, continuous=False):
             # do not test all samples cuz some problems have enormous test cases
             metadata_list = []
             res_list = []
-            for test_case_id, test_case in enumerate(test_cases_list):
-                res, metadata = apps_check_correctness(in_outs=test_case, generation=solution, timeout=5, debug=False)
+            # submitted together, the sandbox pool runs them in parallel
+            test_cases_list = test_cases_list[:10]
+            outputs = apps_check_correctness_many(in_outs_list=test_cases_list,
+                                                  generation=solution,
+                                                  timeout=5,
+                                                  debug=False)
+            for test_case, (res, metadata) in zip(test_cases_list, outputs):
                 try:
                     metadata = dict(enumerate(metadata))[0]  # metadata can be empty occasionally
                 except Exception as e:
@@ -61,9 +67,6 @@ def compute_score(completion, test_cases, continuous=False):
                 metadata["test_case"]["res"] = str(res)
                 metadata_list.append(metadata)
                 res_list.extend(res)
-
-                if test_case_id >= 9:
-                    break
             res_count = len(res_list) if len(res_list) > 0 else 1
             success = sum(map(lambda x: x == True, res_list)) / res_count
     except Exception as e:
@@ -0,0 +1,252 @@
+# Copyright 2024 PRIME team and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Persistent pool of warm sandbox processes for run_test.
+
+check_correctness used to start a multiprocessing.Manager and a fresh Process for every completion, which costs
+more than most test cases. Here every worker imports the prelude of the generated code once, applies
+reliability_guard once, and then runs jobs received over a pipe.
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+# the modules star-imported by the prelude run_test puts in front of every solution
+PRELUDE_MODULES = [
+    'string', 're', 'datetime', 'collections', 'heapq', 'bisect', 'copy', 'math', 'random', 'statistics', 'itertools',
+    'functools', 'operator', 'io', 'json', 'typing'
+]
+
+
+def _sandbox_worker(conn, max_jobs):
+    """
+    Worker loop: import the prelude, guard the process, then answer `(in_outs, generation, timeout, debug)`
+    jobs with `(results, metadata)` until `max_jobs` jobs are done or the pipe is closed.
+    """
+    import importlib
+    for module in PRELUDE_MODULES:
+        importlib.import_module(module)
+    from .testing_util import run_test, reliability_guard
+
+    devnull = open(os.devnull, 'w')
+    sys.stdout = devnull
+    sys.stderr = devnull
+    reliability_guard()
+    conn.send("READY")
+    for _ in range(max_jobs):
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+        in_outs, generation, timeout, debug = msg
+        try:
+            result = run_test(in_outs=in_outs, test=generation, debug=debug, timeout=timeout, guard=False)
+        except BaseException:
+            # SystemExit and the like from the generated code must not end the worker loop
+            result = ([-1 for _ in range(len(in_outs['inputs']))], {})
+        # the generated code may have replaced them
+        sys.stdout = devnull
+        sys.stderr = devnull
+        try:
+            conn.send(result)
+        except Exception:
+            # e.g. an output that does not pickle
+            conn.send(([-1 for _ in range(len(in_outs['inputs']))], {}))
+
+
+class _Worker:
+
+    def __init__(self, ctx, max_jobs):
+        self.conn, child_conn = ctx.Pipe(duplex=True)
+        self.process = ctx.Process(target=_sandbox_worker, args=(child_conn, max_jobs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.num_jobs = 0
+        self.ready = False
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Persistent pool of warm, guarded run_test worker processes.
+
+    A job still running `timeout + grace` seconds after it was sent has its worker killed and replaced, and counts
+    as failed on every test case like the global timeout of check_correctness. Workers are recycled after
+    `max_jobs_per_worker` jobs, since the generated code runs in the worker and may leave state behind.
+    """
+
+    def __init__(self,
+                 num_workers: int = None,
+                 max_jobs_per_worker: int = 64,
+                 grace: float = 1.0,
+                 mp_context: str = "forkserver"):
+        self.num_workers = num_workers or default_num_workers()
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.grace = grace
+        self._ctx = multiprocessing.get_context(mp_context)
+        if mp_context == "forkserver":
+            # workers fork from a server that already imported verl and run_test, instead of importing them each.
+            # No effect if the forkserver of this process was already started by someone else
+            self._ctx.set_forkserver_preload(['__main__', __name__, f'{__package__}.testing_util'])
+        self._lock = threading.Lock()
+        self._workers = [_Worker(self._ctx, self.max_jobs_per_worker) for _ in range(self.num_workers)]
+        self.timeout_count = 0
+        self.restart_count = 0
+        # start ups failed in a row, run_many gives up on its pending jobs past max_start_failures
+        self._start_failures = 0
+        self.max_start_failures = 3 * self.num_workers
+
+    def _replace(self, worker):
+        worker.kill()
+        self._workers[self._workers.index(worker)] = _Worker(self._ctx, self.max_jobs_per_worker)
+        self.restart_count += 1
+
+    def _check_ready(self, worker):
+        # the first message of a worker announces that it is warm and guarded,
+        # so the start up never counts against a job timeout
+        try:
+            worker.ready = worker.conn.recv() == "READY"
+        except (EOFError, OSError):
+            worker.ready = False
+        if worker.ready:
+            self._start_failures = 0
+        else:
+            # e.g. killed by the OOM killer while importing, a dead worker must not stay in the pool
+            print("prime_code sandbox worker failed to start, restarting it")
+            self._start_failures += 1
+            self._replace(worker)
+
+    def run_many(self, jobs):
+        """
+        Run `run_test` for every `(in_outs, generation, timeout, debug)` in `jobs`, in parallel over the workers.
+
+        Returns a list of `(results, metadata)` in input order, metadata is None for a job that timed out or
+        whose worker died.
+        """
+        outputs = [None] * len(jobs)
+        with self._lock:
+            pending = deque(range(len(jobs)))
+            busy = {}
+            while pending or busy:
+                for worker in list(self._workers):
+                    if not pending:
+                        break
+                    if worker in busy or not worker.ready:
+                        continue
+                    index = pending.popleft()
+                    try:
+                        worker.conn.send(jobs[index])
+                    except (BrokenPipeError, OSError):
+                        pending.appendleft(index)
+                        self._replace(worker)
+                        continue
+                    busy[worker] = (index, time.monotonic() + jobs[index][2] + self.grace)
+
+                starting = [worker for worker in self._workers if not worker.ready]
+                if busy:
+                    wait_timeout = max(0.0, min(deadline for _, deadline in busy.values()) - time.monotonic())
+                else:
+                    wait_timeout = None
+                ready = set(wait([worker.conn for worker in list(busy.keys()) + starting], timeout=wait_timeout))
+
+                for worker in starting:
+                    if worker.conn in ready:
+                        self._check_ready(worker)
+                if not busy and self._start_failures >= self.max_start_failures:
+                    # no worker comes up, fail the remaining jobs instead of restarting forever.
+                    # The next run_many tries again
+                    print(f"prime_code sandbox workers keep failing to start, {len(pending)} jobs failed")
+                    self._start_failures = 0
+                    break
+
+                for worker in list(busy.keys()):
+                    if worker.conn not in ready:
+                        continue
+                    index, _ = busy.pop(worker)
+                    try:
+                        outputs[index] = worker.conn.recv()
+                    except (EOFError, OSError):
+                        # the worker died, e.g. the generated code exhausted the memory
+                        self._replace(worker)
+                        continue
+                    worker.num_jobs += 1
+                    if worker.num_jobs >= self.max_jobs_per_worker:
+                        self._replace(worker)
+
+                now = time.monotonic()
+                for worker, (index, deadline) in list(busy.items()):
+                    if now >= deadline:
+                        busy.pop(worker)
+                        self.timeout_count += 1
+                        self._replace(worker)
+
+        for index, output in enumerate(outputs):
+            if output is None:
+                outputs[index] = ([-1 for _ in range(len(jobs[index][0]["inputs"]))], None)
+        return outputs
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                try:
+                    worker.conn.send(None)
+                except Exception:
+                    pass
+                worker.kill()
+            self._workers = []
+
+
+_sandbox_pool = None
+_sandbox_pool_lock = threading.Lock()
+
+
+def default_num_workers():
+    """
+    PRIME_CODE_SANDBOX_WORKERS, else the number of cores in a main process. A process of a pool, e.g. of the
+    ProcessPoolExecutor of PrimeRewardManager, gets 1 by default, every process of the pool has its own sandbox
+    pool and they would start processes * cores workers together.
+    """
+    if os.environ.get('PRIME_CODE_SANDBOX_WORKERS'):
+        return int(os.environ['PRIME_CODE_SANDBOX_WORKERS'])
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return os.cpu_count()
+
+
+def get_sandbox_pool(num_workers: int = None, **kwargs):
+    """
+    Return the process-wide `SandboxPool`, starting its workers on first use.
+    The number of workers defaults to `default_num_workers()`.
+    """
+    global _sandbox_pool
+    with _sandbox_pool_lock:
+        if _sandbox_pool is None:
+            _sandbox_pool = SandboxPool(num_workers=num_workers or default_num_workers(), **kwargs)
+            atexit.register(_sandbox_pool.shutdown)
+    return _sandbox_pool
@@ -15,118 +15,123 @@
 from typing import List, Tuple, Callable
 import heapq
 
+import numpy as np
 import torch
 from torch import distributed as dist
 
 from tensordict import TensorDict
-import copy
 
 
 def karmarkar_karp(seqlen_list: List[int], k_partitions: int, equal_size: bool):
     # see: https://en.wikipedia.org/wiki/Largest_differencing_method
-    class Set:
-
-        def __init__(self) -> None:
-            self.sum = 0
-            self.items = []
-
-        def add(self, idx: int, val: int):
-            self.items.append((idx, val))
-            self.sum += val
-
-        def merge(self, other):
-            for idx, val in other.items:
-                self.items.append((idx, val))
-                self.sum += val
-
-        def __lt__(self, other):
-            if self.sum != other.sum:
-                return self.sum < other.sum
-            if len(self.items) != len(other.items):
-                return len(self.items) < len(other.items)
-            return self.items < other.items
-
-    class State:
-
-        def __init__(self, items: List[Tuple[int, int]], k: int) -> None:
-            self.k = k
-            # sets should always be decreasing order
-            self.sets = [Set() for _ in range(k)]
-            assert len(items) in [1, k], f"{len(items)} not in [1, {k}]"
-            for i, (idx, seqlen) in enumerate(items):
-                self.sets[i].add(idx=idx, val=seqlen)
-            self.sets = sorted(self.sets, reverse=True)
-
-        def spread(self):
-            return self.sets[0].sum - self.sets[-1].sum
-
-        def get_partitions(self):
-            partitions = []
-            for i in range(len(self.sets)):
-                cur_partition = []
-                for idx, _ in self.sets[i].items:
-                    cur_partition.append(idx)
-                partitions.append(cur_partition)
-            return partitions
-
-        def merge(self, other):
-            for i in range(self.k):
-                self.sets[i].merge(other.sets[self.k - 1 - i])
-            self.sets = sorted(self.sets, reverse=True)
-
-        @property
-        def spread(self) -> int:
-            return self.sets[0].sum - self.sets[-1].sum
-
-        def __lt__(self, other):
-            # least heap, let the state with largest spread to be popped first,
-            # if the spread is the same, let the state who has the largest set
-            # to be popped first.
-            if self.spread != other.spread:
-                return self.spread > other.spread
-            return self.sets[0] > other.sets[0]
-
-        def __repr__(self) -> str:
-            repr_str = "["
-            for i in range(self.k):
-                if i > 0:
-                    repr_str += ","
-                repr_str += "{"
-                for j, (_, seqlen) in enumerate(self.sets[i].items):
-                    if j > 0:
-                        repr_str += ","
-                    repr_str += str(seqlen)
-                repr_str += "}"
-            repr_str += "]"
-            return repr_str
-
-    sorted_seqlen_list = sorted([(seqlen, i) for i, seqlen in enumerate(seqlen_list)])
+    # A state is k partitions, each one a (sum, count, head, tail) entry sorted by decreasing sum. The items
+    # of a partition form a linked list through next_item, so merging two states costs O(k), not O(items).
+    seqlens = np.asarray(seqlen_list)
+    n = len(seqlens)
+    order = np.argsort(seqlens, kind='stable').tolist()
+    seqlens = seqlens.tolist()
+    next_item = [-1] * n
+    states = []
     states_pq = []
+
+    def _push(partitions):
+        partitions.sort(key=lambda x: (x[0], x[1]), reverse=True)
+        # least heap, let the state with largest spread to be popped first,
+        # if the spread is the same, let the state who has the largest set to be popped first.
+        heapq.heappush(states_pq, (partitions[-1][0] - partitions[0][0], -partitions[0][0], len(states)))
+        states.append(partitions)
+
+    empty = (0, 0, -1, -1)
     if equal_size:
-        assert len(seqlen_list) % k_partitions == 0, f"{len(seqlen_list)} % {k_partitions} != 0"
-        for offset in range(0, len(sorted_seqlen_list), k_partitions):
-            items = []
-            for i in range(k_partitions):
-                seqlen, idx = sorted_seqlen_list[offset + i]
-                items.append((idx, seqlen))
-            heapq.heappush(states_pq, State(items=items, k=k_partitions))
+        assert n % k_partitions == 0, f"{n} % {k_partitions} != 0"
+        for offset in range(0, n, k_partitions):
+            _push([(seqlens[idx], 1, idx, idx) for idx in order[offset:offset + k_partitions]])
     else:
-        for seqlen, idx in sorted_seqlen_list:
-            heapq.heappush(states_pq, State(items=[(idx, seqlen)], k=k_partitions))
+        for idx in order:
+            _push([(seqlens[idx], 1, idx, idx)] + [empty] * (k_partitions - 1))
 
     while len(states_pq) > 1:
-        state0 = heapq.heappop(states_pq)
-        state1 = heapq.heappop(states_pq)
-        # merge states
-        state0.merge(state1)
-        heapq.heappush(states_pq, state0)
-
-    final_state = states_pq[0]
-    partitions = final_state.get_partitions()
+        state0 = states[heapq.heappop(states_pq)[-1]]
+        state1 = states[heapq.heappop(states_pq)[-1]]
+        # merge states, the largest partition of one with the smallest of the other
+        merged = []
+        for (sum0, count0, head0, tail0), (sum1, count1, head1, tail1) in zip(state0, reversed(state1)):
+            if tail0 != -1 and head1 != -1:
+                next_item[tail0] = head1
+            merged.append((sum0 + sum1, count0 + count1, head0 if head0 != -1 else head1,
+                           tail1 if tail1 != -1 else tail0))
+        _push(merged)
+
+    partitions = []
+    for _, _, head, _ in states[states_pq[0][-1]]:
+        partition = []
+        while head != -1:
+            partition.append(head)
+            head = next_item[head]
+        partitions.append(partition)
     if equal_size:
         for i, partition in enumerate(partitions):
             assert len(partition) * \
-                k_partitions == len(seqlen_list), f"{len(partition)} * {k_partitions} != {len(seqlen_list)}"
+                k_partitions == n, f"{len(partition)} * {k_partitions} != {n}"
+    return partitions
+
+
+def karmarkar_karp_vectorized(seqlen_list: List[int], k_partitions: int, equal_size: bool):
+    """ Largest differencing method in rounds: all states are sorted by spread and merged pairwise at once,
+        the first with the second, the third with the fourth and so on, so there are O(log n) rounds of
+        numpy operations instead of n heap operations. An item is tracked by its (state, slot).
+        The spreads are close to karmarkar_karp and it is much faster for thousands of items.
+    """
+    seqlens = np.asarray(seqlen_list, dtype=np.float64)
+    n = len(seqlens)
+    k = k_partitions
+    order = np.argsort(seqlens, kind='stable')[::-1]
+    rank = np.arange(n)
+    item_state = np.empty(n, dtype=np.int64)
+    item_slot = np.empty(n, dtype=np.int64)
+    if equal_size:
+        assert n % k == 0, f"{n} % {k} != 0"
+        # the k largest items form the first state, the next k the second, ...
+        sums = seqlens[order].reshape(n // k, k)
+        counts = np.ones((n // k, k), dtype=np.int64)
+        item_state[order], item_slot[order] = rank // k, rank % k
+    else:
+        sums = np.zeros((n, k))
+        sums[:, 0] = seqlens[order]
+        counts = np.zeros((n, k), dtype=np.int64)
+        counts[:, 0] = 1
+        item_state[order], item_slot[order] = rank, 0
+
+    slots = np.arange(k)
+    while len(sums) > 1:
+        # states by decreasing spread, the partitions of a state are sorted by decreasing (sum, count)
+        by_spread = np.argsort(sums[:, -1] - sums[:, 0], kind='stable')
+        state_rank = np.empty_like(by_spread)
+        state_rank[by_spread] = np.arange(len(by_spread))
+        sums, counts, item_state = sums[by_spread], counts[by_spread], state_rank[item_state]
+
+        # merge state 2i with state 2i + 1, the largest partition of one with the smallest of the other
+        m = len(sums) // 2
+        merged_sums = sums[0:2 * m:2] + sums[1:2 * m:2, ::-1]
+        merged_counts = counts[0:2 * m:2] + counts[1:2 * m:2, ::-1]
+        perm = np.lexsort((merged_counts, merged_sums), axis=-1)[:, ::-1]
+        new_slot = np.empty_like(perm)
+        np.put_along_axis(new_slot, perm, np.broadcast_to(slots, perm.shape), axis=-1)
+
+        paired = item_state < 2 * m
+        pos = np.where(item_state % 2 == 1, k - 1 - item_slot, item_slot)
+        item_slot = np.where(paired, new_slot[np.minimum(item_state // 2, max(m - 1, 0)), pos], item_slot)
+        # an odd state left over is carried to the next round as the last one
+        item_state = np.where(paired, item_state // 2, m)
+        sums = np.concatenate([np.take_along_axis(merged_sums, perm, -1), sums[2 * m:]])
+        counts = np.concatenate([np.take_along_axis(merged_counts, perm, -1), counts[2 * m:]])
+
+    partitions = [[] for _ in range(k)]
+    for idx, slot in enumerate(item_slot.tolist()):
+        partitions[slot].append(idx)
+    if equal_size:
+        for partition in partitions:
+            assert len(partition) * k == n, f"{len(partition)} * {k} != {n}"
     return partitions
 
 
@@ -149,18 +154,43 @@ def greedy_partition(seqlen_list: List[int], k_partitions: int, equal_size: bool
     return partitions
 
 
-def get_seqlen_balanced_partitions(seqlen_list: List[int], k_partitions: int, equal_size: bool):
+def seqlen_cost(seqlen_list: List[int], attn_coef: float = 0.0):
+    """ cost of every sequence for balancing: seqlen + attn_coef * seqlen^2.
+        The quadratic term models attention, whose FLOPs grow with the square of the length.
+        For a decoder with hidden size h, attn_coef is about 1 / (6 * h). 0 balances token counts.
+    """
+    if not attn_coef:
+        return seqlen_list
+    seqlens = np.asarray(seqlen_list, dtype=np.float64)
+    return (seqlens + attn_coef * seqlens * seqlens).tolist()
+
+
+# from this many items on, the rounds of karmarkar_karp_vectorized beat the heap of karmarkar_karp
+VECTORIZED_KK_MIN_ITEMS = 1024
+
+
+def _balanced_partitions(seqlen_list, k_partitions, equal_size):
+    if len(seqlen_list) >= VECTORIZED_KK_MIN_ITEMS:
+        return karmarkar_karp_vectorized(seqlen_list=seqlen_list, k_partitions=k_partitions, equal_size=equal_size)
+    return karmarkar_karp(seqlen_list=seqlen_list, k_partitions=k_partitions, equal_size=equal_size)
+
+
+def get_seqlen_balanced_partitions(seqlen_list: List[int], k_partitions: int, equal_size: bool, group_ids=None):
     """ get order of seq lengths to make partitions balanced, this is
         used in balacing sum of seqlength across dp ranks and microbatches
     Parameters:
         seqlen_list (List[int]):
-            seq lengths of each items
+            seq lengths (or costs, see seqlen_cost) of each items
         k_partitions (int):
             resulting number of partitions
         equal_size (bool):
             if True, number of items in each partitions must be equal.
             if False, only consider balancing the sum, each partition can have
             variable number of items
+        group_ids (array-like, optional):
+            group of each item, e.g. the GRPO uid. Items of a group are kept in the same partition
+            when possible; with equal_size this needs equally sized groups and a number of groups
+            divisible by k_partitions, otherwise items are balanced individually.
     Returns:
         partitions (List[List[int]]):
             return k_partitions list containing the index of items.
@@ -169,17 +199,32 @@ def get_seqlen_balanced_partitions(seqlen_list: List[int], k_partitions: int, eq
 
     def _check_and_sort_partitions(partitions):
         assert len(partitions) == k_partitions, f"{len(partitions)} != {k_partitions}"
-        seen_idx = set()
+        seen = np.zeros(len(seqlen_list), dtype=np.int64)
         sorted_partitions = [None] * k_partitions
         for i, partition in enumerate(partitions):
             assert len(partition) > 0, f"the {i}-th partition is empty"
-            for idx in partition:
-                seen_idx.add(idx)
+            seen[partition] += 1
             sorted_partitions[i] = sorted(partition)
-        assert seen_idx == set(range(len(seqlen_list)))
+        assert np.all(seen == 1)
         return sorted_partitions
 
-    partitions = karmarkar_karp(seqlen_list=seqlen_list, k_partitions=k_partitions, equal_size=equal_size)
+    if group_ids is not None:
+        _, group_index = np.unique(np.asarray(group_ids), return_inverse=True)
+        group_index = group_index.reshape(-1)
+        group_sizes = np.bincount(group_index)
+        groups_fit = len(group_sizes) >= k_partitions and \
+            (not equal_size or (np.all(group_sizes == group_sizes[0]) and len(group_sizes) % k_partitions == 0))
+        if groups_fit:
+            group_seqlens = np.bincount(group_index, weights=np.asarray(seqlen_list, dtype=np.float64))
+            group_partitions = _balanced_partitions(group_seqlens, k_partitions, equal_size)
+            order = np.argsort(group_index, kind='stable')
+            members = np.split(order, np.cumsum(group_sizes)[:-1])
+            partitions = [np.concatenate([members[g] for g in partition]).tolist() for partition in group_partitions]
+            return _check_and_sort_partitions(partitions)
+        print(f"WARNING: {len(group_sizes)} groups cannot be split into {k_partitions} equal partitions, "
+              f"balancing items individually")
+
+    partitions = _balanced_partitions(seqlen_list, k_partitions, equal_size)
     return _check_and_sort_partitions(partitions)
 
 
@@ -221,9 +266,10 @@ def ceildiv(a, b):
     return -(a // -b)
 
 
-def rearrange_micro_batches(batch: TensorDict, max_token_len, dp_group=None):
+def rearrange_micro_batches(batch: TensorDict, max_token_len, dp_group=None, attn_coef: float = 0.0):
     """Split the batch into a list of micro_batches, where the max_token_len is smaller than max_token_len
     and the number of valid tokens in each micro batch is well balanced.
+    With attn_coef > 0 the micro batches are balanced on seqlen_cost instead of token counts.
     """
     # this is per local micro_bsz
     max_seq_len = batch['attention_mask'].shape[-1]
@@ -241,25 +287,20 @@ def rearrange_micro_batches(batch: TensorDict, max_token_len, dp_group=None):
     seq_len_effective = seq_len_effective.tolist()
     assert num_micro_batches <= len(seq_len_effective)
 
-    micro_bsz_idx = get_seqlen_balanced_partitions(seq_len_effective, num_micro_batches, equal_size=False)
+    micro_bsz_idx = get_seqlen_balanced_partitions(seqlen_cost(seq_len_effective, attn_coef),
+                                                   num_micro_batches,
+                                                   equal_size=False)
 
     micro_batches = []
 
     for partition in micro_bsz_idx:
-        curr_micro_batch = []
-        for idx in partition:
-            curr_micro_batch.append(batch[idx:idx + 1])
-        curr_micro_batch = torch.cat(curr_micro_batch)
-
-        micro_batches.append(curr_micro_batch)
+        # one gather per tensor instead of concatenating one-row slices
+        index = torch.tensor(partition, dtype=torch.long, device=batch.device)
+        micro_batches.append(batch[index])
 
     return micro_batches, micro_bsz_idx
 
 
 def get_reverse_idx(idx_map):
-    reverse_idx_map = copy.deepcopy(idx_map)
-
-    for i, idx in enumerate(idx_map):
-        reverse_idx_map[idx] = i
-
-    return reverse_idx_map
+    # inverse permutation: reverse_idx_map[idx_map[i]] = i
+    return np.argsort(np.asarray(idx_map), kind='stable').tolist()
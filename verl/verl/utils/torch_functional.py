@@ -78,20 +78,112 @@ def logprobs_from_logits_v2(logits: torch.FloatTensor, labels):
     """
     A memory efficient implementation of logprobs_from_logits
     """
-    if logits.dtype in [torch.float32, torch.float64]:
-        logits_labels = torch.gather(logits, dim=-1, index=labels.unsqueeze(-1)).squeeze(-1)
-        # loop to reduce peak mem consumption
-        logsumexp_values = torch.stack([torch.logsumexp(l, dim=-1) for l in logits])
-        logprobs_labels = logits_labels - logsumexp_values  # log_softmax(x_i) = x_i - logsumexp(x)
-    else:
-        # logsumexp approach is unstable with bfloat16, fall back to slightly less efficent approach
-        logprobs_labels = []
-        for row_logits, row_labels in zip(logits, labels):  # loop to reduce peak mem consumption
-            row_logprobs = F.log_softmax(row_logits, dim=-1)
-            row_logprobs_labels = row_logprobs.gather(dim=-1, index=row_labels.unsqueeze(-1)).squeeze(-1)
-            logprobs_labels.append(row_logprobs_labels)
-        logprobs_labels = torch.stack(logprobs_labels)
-    return logprobs_labels
+    # blocks are upcast to fp32, so bfloat16 logits are as stable as float32 ones
+    logprobs_labels, _ = logprobs_and_entropy_from_logits(logits, labels, compute_entropy=False)
+    return logprobs_labels.to(logits.dtype)
+
+
+class _ChunkedLogprobEntropy(torch.autograd.Function):
+    """
+    log_softmax(logits)[label] and the entropy of softmax(logits), for 2D logits (num_tokens, vocab_size).
+
+    The forward is a single pass over (token_chunk_size, vocab_chunk_size) blocks, upcast to fp32 (fp64 stays fp64) one at a time,
+    with an online logsumexp: per token it keeps the running max m, s = sum(exp(x - m)) and d = sum(exp(x - m) * x),
+    so logsumexp = m + log(s) and entropy = logsumexp - d / s. The backward recomputes the probabilities block by
+    block from the saved logsumexp. No (num_tokens, vocab_size) temporary is allocated besides the logits gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, labels, compute_entropy, token_chunk_size, vocab_chunk_size):
+        num_tokens, vocab_size = logits.shape
+        dtype = torch.float64 if logits.dtype == torch.float64 else torch.float32
+        logsumexp = torch.empty(num_tokens, dtype=dtype, device=logits.device)
+        logprobs = torch.empty(num_tokens, dtype=dtype, device=logits.device)
+        entropy = torch.empty(num_tokens, dtype=dtype, device=logits.device) if compute_entropy else None
+
+        for start in range(0, num_tokens, token_chunk_size):
+            end = min(start + token_chunk_size, num_tokens)
+            running_max = torch.full((end - start,), float('-inf'), dtype=dtype, device=logits.device)
+            running_sum = torch.zeros(end - start, dtype=dtype, device=logits.device)
+            running_dot = torch.zeros_like(running_sum) if compute_entropy else None
+            for vocab_start in range(0, vocab_size, vocab_chunk_size):
+                block = logits[start:end, vocab_start:vocab_start + vocab_chunk_size].to(dtype)
+                new_max = torch.maximum(running_max, block.max(dim=-1).values)
+                scale = torch.exp(running_max - new_max)
+                exp_block = torch.exp(block - new_max.unsqueeze(-1))
+                running_sum = running_sum * scale + exp_block.sum(dim=-1)
+                if compute_entropy:
+                    running_dot = running_dot * scale + (exp_block * block).sum(dim=-1)
+                running_max = new_max
+            chunk_logsumexp = running_max + torch.log(running_sum)
+            logsumexp[start:end] = chunk_logsumexp
+            label_logits = logits[start:end].gather(-1, labels[start:end].unsqueeze(-1)).squeeze(-1).to(dtype)
+            logprobs[start:end] = label_logits - chunk_logsumexp
+            if compute_entropy:
+                entropy[start:end] = chunk_logsumexp - running_dot / running_sum
+
+        ctx.compute_entropy = compute_entropy
+        ctx.token_chunk_size = token_chunk_size
+        ctx.vocab_chunk_size = vocab_chunk_size
+        ctx.save_for_backward(logits, labels, logsumexp, entropy if compute_entropy else logsumexp)
+        if compute_entropy:
+            return logprobs, entropy
+        return logprobs
+
+    @staticmethod
+    def backward(ctx, grad_logprobs, grad_entropy=None):
+        # d logprob / dx = onehot(label) - p,  d entropy / dx = -p * (x - logsumexp + entropy)
+        logits, labels, logsumexp, entropy = ctx.saved_tensors
+        dtype = logsumexp.dtype
+        num_tokens, vocab_size = logits.shape
+        grad_logits = torch.empty_like(logits)
+        token_chunk_size, vocab_chunk_size = ctx.token_chunk_size, ctx.vocab_chunk_size
+        for start in range(0, num_tokens, token_chunk_size):
+            end = min(start + token_chunk_size, num_tokens)
+            chunk_logsumexp = logsumexp[start:end].unsqueeze(-1)
+            chunk_grad_logprobs = grad_logprobs[start:end].to(dtype).unsqueeze(-1)
+            chunk_labels = labels[start:end]
+            rows = torch.arange(end - start, device=logits.device)
+            for vocab_start in range(0, vocab_size, vocab_chunk_size):
+                vocab_end = min(vocab_start + vocab_chunk_size, vocab_size)
+                block = logits[start:end, vocab_start:vocab_end].to(dtype)
+                probs = torch.exp(block - chunk_logsumexp)
+                coeff = chunk_grad_logprobs
+                if ctx.compute_entropy and grad_entropy is not None:
+                    coeff = coeff + grad_entropy[start:end].to(dtype).unsqueeze(-1) * \
+                        (block - chunk_logsumexp + entropy[start:end].unsqueeze(-1))
+                block_grad = -probs * coeff
+                in_block = (chunk_labels >= vocab_start) & (chunk_labels < vocab_end)
+                block_grad[rows[in_block], chunk_labels[in_block] - vocab_start] += chunk_grad_logprobs[in_block, 0]
+                grad_logits[start:end, vocab_start:vocab_end] = block_grad
+        return grad_logits, None, None, None, None
+
+
+def logprobs_and_entropy_from_logits(logits: torch.Tensor,
+                                     labels: torch.Tensor,
+                                     compute_entropy: bool = True,
+                                     token_chunk_size: int = 1024,
+                                     vocab_chunk_size: int = 32768):
+    """
+    Log prob of the labels and entropy, computed over blocks of tokens and vocab so that the peak memory is
+    bounded by the block size instead of a full-vocab softmax copy. Differentiable, CPU and GPU.
+
+    Args:
+        logits: (..., vocab_size)
+        labels (torch.LongTensor): (...,)
+        compute_entropy: entropy is None when False
+
+    Returns:
+        logprobs: (...,) fp32, fp64 for fp64 logits
+        entropy: same as logprobs, or None
+    """
+    batch_dim = logits.shape[:-1]
+    outputs = _ChunkedLogprobEntropy.apply(logits.reshape(-1, logits.shape[-1]), labels.reshape(-1), compute_entropy,
+                                           token_chunk_size, vocab_chunk_size)
+    if compute_entropy:
+        logprobs, entropy = outputs
+        return logprobs.view(*batch_dim), entropy.view(*batch_dim)
+    return outputs.view(*batch_dim), None
 
 
 def clip_by_value(x, tensor_min, tensor_max):
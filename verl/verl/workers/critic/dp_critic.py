@@ -117,7 +117,9 @@ class DataParallelPPOCritic(BasePPOCritic):
         if use_dynamic_bsz:
             # split using dynamic bsz
             max_token_len = data.meta_info['max_token_len'] * self.ulysses_sequence_parallel_size
-            micro_batches, indices = rearrange_micro_batches(batch=batch, max_token_len=max_token_len)
+            micro_batches, indices = rearrange_micro_batches(batch=batch,
+                                                             max_token_len=max_token_len,
+                                                             attn_coef=self.config.get('balance_attn_coef', 0.))
         else:
             micro_batches = batch.split(micro_batch_size)
 
@@ -162,7 +164,9 @@ class DataParallelPPOCritic(BasePPOCritic):
                 mini_batch = data
                 if self.config.use_dynamic_bsz:
                     max_token_len = self.config.ppo_max_token_len_per_gpu * self.ulysses_sequence_parallel_size
-                    micro_batches, _ = rearrange_micro_batches(batch=mini_batch, max_token_len=max_token_len)
+                    micro_batches, _ = rearrange_micro_batches(batch=mini_batch,
+                                                               max_token_len=max_token_len,
+                                                               attn_coef=self.config.get('balance_attn_coef', 0.))
                 else:
                     micro_batches = mini_batch.split(self.config.ppo_micro_batch_size_per_gpu)
                     self.gradient_accumulation = self.config.ppo_mini_batch_size // self.config.ppo_micro_batch_size_per_gpu
@@ -558,7 +558,7 @@ class ActorRolloutRefWorker(Worker):
         return output
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
-    def save_checkpoint(self, local_path, hdfs_path=None, global_step=0, remove_previous_ckpt=False):
+    def save_checkpoint(self, local_path, hdfs_path=None, global_step=0, remove_previous_ckpt=False, async_save=False):
         # only support save and load ckpt for actor
         assert self._is_actor
         import torch
@@ -568,7 +568,8 @@ class ActorRolloutRefWorker(Worker):
         self.checkpoint_manager.save_checkpoint(local_path=local_path,
                                                 hdfs_path=hdfs_path,
                                                 global_step=global_step,
-                                                remove_previous_ckpt=remove_previous_ckpt)
+                                                remove_previous_ckpt=remove_previous_ckpt,
+                                                async_save=async_save)
 
         torch.distributed.barrier()
         if self._is_offload_param:
@@ -587,6 +588,13 @@ class ActorRolloutRefWorker(Worker):
         if self._is_offload_optimizer:
             offload_fsdp_optimizer(self.actor_optimizer)
 
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def wait_checkpoint(self, block=True):
+        """Returns (done, seconds spent writing) of the async checkpoint save of this rank."""
+        if not block and not self.checkpoint_manager.save_done():
+            return False, None
+        return True, self.checkpoint_manager.wait_save()
+
 
 class CriticWorker(Worker):
 
@@ -836,7 +844,7 @@ class CriticWorker(Worker):
         return output
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
-    def save_checkpoint(self, local_path, hdfs_path=None, global_step=0, remove_previous_ckpt=False):
+    def save_checkpoint(self, local_path, hdfs_path=None, global_step=0, remove_previous_ckpt=False, async_save=False):
         import torch
         if self._is_offload_param:
             load_fsdp_model_to_gpu(self.critic_module)
@@ -844,7 +852,8 @@ class CriticWorker(Worker):
         self.checkpoint_manager.save_checkpoint(local_path=local_path,
                                                 hdfs_path=hdfs_path,
                                                 global_step=global_step,
-                                                remove_previous_ckpt=remove_previous_ckpt)
+                                                remove_previous_ckpt=remove_previous_ckpt,
+                                                async_save=async_save)
 
         torch.distributed.barrier()
         if self._is_offload_param:
@@ -865,6 +874,13 @@ class CriticWorker(Worker):
         if self._is_offload_optimizer:
             offload_fsdp_optimizer(self.critic_optimizer)
 
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def wait_checkpoint(self, block=True):
+        """Returns (done, seconds spent writing) of the async checkpoint save of this rank."""
+        if not block and not self.checkpoint_manager.save_done():
+            return False, None
+        return True, self.checkpoint_manager.wait_save()
+
 
 # TODO(sgm): we may need to extract it to dp_reward_model.py
 class RewardModelWorker(Worker):
@@ -0,0 +1,99 @@
+# Copyright 2024 PRIME team and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Shared decode stage for the reward managers and metrics.
+
+Prompts and responses are decoded once per step and attached to `DataProto.non_tensor_batch`
+under DECODED_KEYS, so the reward manager, metric_experience and the sample writer reuse them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from verl import DataProto
+
+DECODED_KEYS = ('prompt_str', 'response_str')
+
+
+def decode_token_lists(tokenizer, token_lists, num_workers=8, bucket_size=256):
+    """Decode a list of token id lists, equivalent to `[tokenizer.decode(ids) for ids in token_lists]`.
+
+    Sequences are sorted by length and cut into buckets so every bucket has similar work. With a fast
+    tokenizer each bucket is decoded by one `decode_batch` call of the Rust backend, and buckets run on
+    a thread pool.
+    """
+    texts = [None] * len(token_lists)
+    if len(token_lists) == 0:
+        return texts
+
+    order = sorted(range(len(token_lists)), key=lambda i: len(token_lists[i]))
+    buckets = [order[i:i + bucket_size] for i in range(0, len(order), bucket_size)]
+    is_fast = getattr(tokenizer, 'is_fast', False)
+
+    def _decode(bucket):
+        seqs = [token_lists[i] for i in bucket]
+        if is_fast:
+            bucket_texts = tokenizer.backend_tokenizer.decode_batch(seqs, skip_special_tokens=False)
+            if getattr(tokenizer, 'clean_up_tokenization_spaces', False):
+                bucket_texts = [tokenizer.clean_up_tokenization(text) for text in bucket_texts]
+        else:
+            bucket_texts = [tokenizer.decode(seq) for seq in seqs]
+        return bucket, bucket_texts
+
+    with ThreadPoolExecutor(max_workers=max(1, min(num_workers, len(buckets)))) as executor:
+        for bucket, bucket_texts in executor.map(_decode, buckets):
+            for i, text in zip(bucket, bucket_texts):
+                texts[i] = text
+    return texts
+
+
+def attach_decoded_strings(tokenizer, data: DataProto, num_workers=8):
+    """Decode the valid prompt/response tokens of `data` and attach them as `prompt_str`/`response_str`.
+
+    Each distinct prompt is decoded only once, since every prompt is repeated `rollout.n` times.
+    Nothing is done if the strings are already attached.
+    """
+    if all(key in data.non_tensor_batch for key in DECODED_KEYS):
+        return data
+
+    prompt_ids = data.batch['prompts']
+    prompt_length = prompt_ids.shape[-1]
+    attention_mask = data.batch['attention_mask']
+    valid_prompt_length = attention_mask[:, :prompt_length].sum(dim=-1).tolist()
+    valid_response_length = attention_mask[:, prompt_length:].sum(dim=-1).tolist()
+
+    prompt_ids = prompt_ids.cpu().numpy()
+    response_ids = data.batch['responses'].cpu().numpy()
+
+    # prompts are left padded, responses are right padded
+    unique_prompt_index = {}
+    unique_prompt_tokens = []
+    prompt_slot = []
+    for i in range(len(prompt_ids)):
+        valid_prompt_ids = prompt_ids[i, prompt_length - valid_prompt_length[i]:]
+        key = valid_prompt_ids.tobytes()
+        if key not in unique_prompt_index:
+            unique_prompt_index[key] = len(unique_prompt_tokens)
+            unique_prompt_tokens.append(valid_prompt_ids.tolist())
+        prompt_slot.append(unique_prompt_index[key])
+
+    response_tokens = [response_ids[i, :valid_response_length[i]].tolist() for i in range(len(response_ids))]
+
+    unique_prompt_str = decode_token_lists(tokenizer, unique_prompt_tokens, num_workers=num_workers)
+    response_str = decode_token_lists(tokenizer, response_tokens, num_workers=num_workers)
+
+    data.non_tensor_batch['prompt_str'] = np.array([unique_prompt_str[slot] for slot in prompt_slot], dtype=object)
+    data.non_tensor_batch['response_str'] = np.array(response_str, dtype=object)
+    return data
@@ -24,33 +24,133 @@ import numpy as np
 from collections import defaultdict
 
 from verl import DataProto
+from verl.workers.reward_manager.decode import attach_decoded_strings
+
+_HASH_PRIME = np.uint64(1099511628211)
+_SKETCH_EMPTY = np.iinfo(np.uint64).max
+
+
+def _mix64(x):
+    # splitmix64 finalizer, makes the polynomial n-gram hashes uniform so the bottom-k sketch is unbiased
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    x = x ^ (x >> np.uint64(31))
+    return x
+
+
+def ngram_sketches(response_token_list, ngram_num=3, sketch_size=256):
+    """
+    Bottom-k sketches of the n-gram sets of the responses.
+
+    Every n-gram is hashed to a uint64 in one vectorized pass over all responses, and each
+    response keeps its `sketch_size` smallest distinct hashes. Returns an array of shape
+    (len(response_token_list), sketch_size), sorted along the last axis and padded with _SKETCH_EMPTY.
+    """
+    num_responses = len(response_token_list)
+    sketches = np.full((num_responses, sketch_size), _SKETCH_EMPTY, dtype=np.uint64)
+    lengths = np.array([len(x) for x in response_token_list], dtype=np.int64)
+    num_ngrams = np.maximum(lengths - ngram_num + 1, 0)
+    if num_ngrams.sum() == 0:
+        return sketches
+
+    tokens = np.concatenate([np.asarray(x, dtype=np.uint64) for x in response_token_list])
+    starts = np.cumsum(lengths) - lengths
+    # start offset of every n-gram that lies inside one response
+    response_id = np.repeat(np.arange(num_responses, dtype=np.uint64), num_ngrams)
+    offsets = np.arange(len(response_id)) + np.repeat(starts - (np.cumsum(num_ngrams) - num_ngrams), num_ngrams)
+
+    with np.errstate(over='ignore'):
+        # hash every window of the concatenated tokens with contiguous slices, then keep the valid ones
+        num_windows = len(tokens) - ngram_num + 1
+        hashes = np.zeros(num_windows, dtype=np.uint64)
+        for k in range(ngram_num):
+            hashes = hashes * _HASH_PRIME + tokens[k:k + num_windows] + np.uint64(1)
+        hashes = _mix64(hashes[offsets])
+
+    # pack (response id, hash) into one uint64 key, so a single sort groups by response and orders by hash
+    id_bits = max(1, (num_responses - 1).bit_length())
+    keys = np.sort((response_id << np.uint64(64 - id_bits)) | (hashes >> np.uint64(id_bits)))
+    keep = np.ones(len(keys), dtype=bool)
+    keep[1:] = keys[1:] != keys[:-1]
+    keys = keys[keep]
+    response_id = (keys >> np.uint64(64 - id_bits)).astype(np.int64)
+    hashes = keys & np.uint64((1 << (64 - id_bits)) - 1)
+    group_start = np.searchsorted(response_id, np.arange(num_responses))
+    rank = np.arange(len(hashes)) - group_start[response_id]
+    in_sketch = rank < sketch_size
+    sketches[response_id[in_sketch], rank[in_sketch]] = hashes[in_sketch]
+    return sketches
+
+
+def pairwise_sketch_jaccard(sketches, pair_chunk_size=4096):
+    """
+    Estimated Jaccard similarity of every pair (i < j) of bottom-k sketches, in np.triu_indices order.
+    The estimate is exact when the union of the two n-gram sets has at most `sketch_size` elements.
+    """
+    left, right = np.triu_indices(len(sketches), k=1)
+    return np.concatenate([np.zeros(0)] + [
+        _sketch_jaccard(sketches[left[i:i + pair_chunk_size]], sketches[right[i:i + pair_chunk_size]])
+        for i in range(0, len(left), pair_chunk_size)
+    ])
+
+
+def _sketch_jaccard(left_sketches, right_sketches):
+    sketch_size = left_sketches.shape[-1]
+    merged = np.sort(np.concatenate([left_sketches, right_sketches], axis=1), axis=1)
+    valid = merged != _SKETCH_EMPTY
+    same_as_prev = np.zeros_like(valid)
+    same_as_prev[:, 1:] = merged[:, 1:] == merged[:, :-1]
+    # rank of every value among the distinct values of the union, only the smallest sketch_size count
+    distinct_rank = np.cumsum(valid & ~same_as_prev, axis=1)
+    intersection = (valid & same_as_prev & (distinct_rank <= sketch_size)).sum(axis=1)
+    union = np.minimum(distinct_rank[:, -1], sketch_size)
+    return np.where(union > 0, intersection / np.maximum(union, 1), 0.0)
+
+
+def calculate_ngram_overlap(response_token_list, ngram_num=3, sketch_size=256):
+    """
+    Mean pairwise Jaccard similarity of the n-gram sets of the rollouts of one prompt.
+
+    Uses bottom-k sketches, so the cost is linear in the number of tokens plus
+    O(num_rollouts^2 * sketch_size) for the pairs. Returns None for a single rollout.
+    """
+    return calculate_ngram_overlap_by_group([response_token_list], ngram_num=ngram_num, sketch_size=sketch_size)[0]
+
+
+def calculate_ngram_overlap_by_group(response_token_lists, ngram_num=3, sketch_size=256):
+    """
+    `calculate_ngram_overlap` for every group of rollouts, hashing the whole batch in one pass.
+    """
+    flat = [response for group in response_token_lists for response in group]
+    sketches = ngram_sketches(flat, ngram_num=ngram_num, sketch_size=sketch_size)
+    overlaps = []
+    offset = 0
+    for group in response_token_lists:
+        if len(group) < 2:
+            overlaps.append(None)
+        else:
+            overlaps.append(float(pairwise_sketch_jaccard(sketches[offset:offset + len(group)]).mean()))
+        offset += len(group)
+    return overlaps
+
 
-def calculate_ngram_overlap(response_token_list, ngram_num=3):
-    response_ngram_list = []
-    for response_token in response_token_list:
-        response_ngram = []
-        for i in range(len(response_token) - ngram_num + 1):
-            response_ngram.append(tuple(response_token[i:i+ngram_num]))
-        response_ngram_list.append(response_ngram)
-    ngram_overlap_list = []
-    for i in range(len(response_ngram_list)):
-        for j in range(i+1, len(response_ngram_list)):
-            ngram_overlap = len(set(response_ngram_list[i]) & set(response_ngram_list[j])) * 1.0 / len(set(response_ngram_list[i]) | set(response_ngram_list[j]))
-            ngram_overlap_list.append(ngram_overlap)
-    return sum(ngram_overlap_list) * 1.0 / len(ngram_overlap_list)
-
-def metric_experience(tokenizer, data: DataProto, step: int = 0):
+def metric_experience(tokenizer, data: DataProto):
 
     # batched scoring
     prompt_ids = data.batch['prompts']
     prompt_length = prompt_ids.shape[-1]
-    valid_prompt_length = data.batch['attention_mask'][:,:prompt_length].sum(dim=-1)
 
     response_ids = data.batch['responses']
     valid_response_length = data.batch['attention_mask'][:,prompt_length:].sum(dim=-1)
 
     token_level_scores = data.batch['token_level_scores']
 
+    # reuse the strings decoded by the reward manager
+    attach_decoded_strings(tokenizer, data)
+    prompt_strs = data.non_tensor_batch['prompt_str']
+
     # data_source
     data_sources = data.non_tensor_batch.get('data_source')
     prompt_str_to_data_source = {}
@@ -66,13 +166,11 @@ def metric_experience(tokenizer, data: DataProto, step: int = 0):
     response_length_when_wrong = []
 
     for i in range(len(data)):
-        valid_prompt_ids = prompt_ids[i][-valid_prompt_length[i]:]
         valid_response_ids = response_ids[i][:valid_response_length[i]]
-        prompt_str = tokenizer.decode(valid_prompt_ids)
-        response_str = tokenizer.decode(valid_response_ids)
+        prompt_str = prompt_strs[i]
 
         prompt_str_to_data_source[prompt_str] = data_sources[i]
-        response_token_by_prompt_str[prompt_str].append(valid_response_ids.tolist())
+        response_token_by_prompt_str[prompt_str].append(valid_response_ids.cpu().numpy())
 
         # score > 0.90 表示正确
         if float(token_level_scores[i][valid_response_length[i].item()-1]) > 0.90:
@@ -115,9 +213,10 @@ def metric_experience(tokenizer, data: DataProto, step: int = 0):
     for data_source, count in response_zero_adv_count_by_data_source.items():
         result[f'response/zero_adv_count/{data_source}'] = count
             
-    # TODO Maybe slow if too many rollouts in one group
-    if step == 0 or step % 8 == 0:
-        response_ngram_overlap_by_prompt_str = {k: calculate_ngram_overlap(v) for k, v in response_token_by_prompt_str.items()}
-        result['response/ngram_overlap_score'] = np.mean(list(response_ngram_overlap_by_prompt_str.values()))
+    ngram_overlap_list = [
+        x for x in calculate_ngram_overlap_by_group(list(response_token_by_prompt_str.values())) if x is not None
+    ]
+    if len(ngram_overlap_list) > 0:
+        result['response/ngram_overlap_score'] = np.mean(ngram_overlap_list)
     
     return result
\ No newline at end of file
@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import asyncio
+import contextlib
 from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 
@@ -43,9 +45,25 @@ async def single_compute_score(evaluation_func, completion, reference, task, exe
         return None  # Default value for failed rows
 
 
-async def parallel_compute_score_async(evaluation_func, completions, references, tasks, num_processes=64):
+def _init_score_process(sandbox_workers):
+    # the prime_code sandbox pool of every process shares the cores with the other processes
+    os.environ.setdefault('PRIME_CODE_SANDBOX_WORKERS', str(sandbox_workers))
+
+
+def make_score_executor(num_processes=64):
+    """A process pool for compute_score whose processes together start about one sandbox worker per core"""
+    return ProcessPoolExecutor(max_workers=num_processes,
+                               initializer=_init_score_process,
+                               initargs=(max(1, (os.cpu_count() or 1) // num_processes),))
+
+
+async def parallel_compute_score_async(evaluation_func, completions, references, tasks, num_processes=64, executor=None):
+    """With `executor` the processes, and the warm sandbox pools in them, are kept for the next call"""
     scores = []
-    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+    owned = executor is None
+    if owned:
+        executor = make_score_executor(num_processes)
+    with (executor if owned else contextlib.nullcontext(executor)) as executor:
         # Create tasks for all rows
         tasks_async = [
             single_compute_score(evaluation_func, completion, reference, task, executor, timeout=300.)
@@ -79,10 +97,19 @@ class PrimeRewardManager:
     The Reward Manager used in https://github.com/PRIME-RL/PRIME
     """
 
-    def __init__(self, tokenizer, num_examine, compute_score=None) -> None:
+    def __init__(self, tokenizer, num_examine, compute_score=None, num_processes=64) -> None:
         self.tokenizer = tokenizer
         self.num_examine = num_examine  # the number of batches of decoded responses to print to the console
         self.compute_score = compute_score or _default_compute_score
+        self.num_processes = num_processes
+        # kept across steps so the prime_code sandbox workers in its processes stay warm
+        self.executor = None
+
+    def _drop_executor(self):
+        # parallel_compute_score_async killed its processes, the next call starts a new pool
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
 
     def __call__(self, data: DataProto):
         """We will expand this function gradually based on the available datasets"""
@@ -106,19 +133,24 @@ class PrimeRewardManager:
         data_sources = data.non_tensor_batch['data_source']
 
         assert len(sequences_str) == len(ground_truth) == len(data_sources)
+        if self.executor is None:
+            self.executor = make_score_executor(self.num_processes)
         try:
             scores = asyncio.run(
                 parallel_compute_score_async(self.compute_score,
                                              sequences_str,
                                              ground_truth,
                                              data_sources,
-                                             num_processes=64))
+                                             num_processes=self.num_processes,
+                                             executor=self.executor))
         except asyncio.TimeoutError as e:
             print('Global timeout in reward computing! Setting all as 0.')
             scores = [0. for _ in range(len(sequences_str))]
+            self._drop_executor()
         except Exception as e:
             print(f"Unexpected error in batched reward computing. Setting all as 0.: {e}")
             scores = [0. for _ in range(len(sequences_str))]
+            self._drop_executor()
 
         for i in range(len(data)):
             data_source = data_sources[i]
@@ -24,6 +24,8 @@ import torch
 
 from verl import DataProto
 from verl.utils.reward_score import _default_compute_score
+from verl.workers.reward_manager.decode import attach_decoded_strings
+from verl.workers.reward_manager.sample_writer import SampleWriter, prompt_uids
 from verl.utils.logging_utils import timestamp
 
 class PrimeSaveRewardManager:
@@ -31,11 +33,27 @@ class PrimeSaveRewardManager:
     The Reward Manager used in https://github.com/PRIME-RL/PRIME
     """
 
-    def __init__(self, tokenizer, num_examine, compute_score=None, save_path=None) -> None:
+    def __init__(self, tokenizer, num_examine, compute_score=None, save_path=None, save_format='jsonl') -> None:
         self.tokenizer = tokenizer
         self.num_examine = num_examine  # the number of batches of decoded responses to print to the console
         self.compute_score = compute_score or _default_compute_score
         self.save_path = save_path
+        self.save_format = save_format
+        self.writer = None
+        # seconds spent by every reward actor in the last call
+        self.actor_timing = {}
+        # verdict cache hits / misses / evictions of the last call
+        self.cache_stats = {}
+
+    def get_writer(self):
+        if self.writer is None:
+            self.writer = SampleWriter(save_format=self.save_format)
+        return self.writer
+
+    def flush(self):
+        """Wait until all submitted samples are written"""
+        if self.writer is not None:
+            self.writer.flush()
 
     def __call__(self, data: DataProto):
         """We will expand this function gradually based on the available datasets"""
@@ -75,18 +93,19 @@ class PrimeSaveRewardManager:
         
         assert len(prompt_ids) == len(response_ids) == len(ground_truth) == len(data_sources)
 
+        # decoded once and shared with metric_experience through non_tensor_batch
+        attach_decoded_strings(self.tokenizer, data)
+        prompt_strs = data.non_tensor_batch['prompt_str']
+        response_strs = data.non_tensor_batch['response_str']
+
         datas = []
 
         for i in range(len(data)):
-            valid_prompt_ids = prompt_ids[i][-valid_prompt_length[i]:]
-            valid_response_ids = response_ids[i][:valid_response_length[i]]
-            prompt_str = self.tokenizer.decode(valid_prompt_ids)
-            response_str = self.tokenizer.decode(valid_response_ids)
             datas.append({
                 'data_source': data_sources[i],
                 'reward_actor': reward_actors[i],
-                'prompt_str': prompt_str,
-                'response_str': response_str,
+                'prompt_str': prompt_strs[i],
+                'response_str': response_strs[i],
                 'ground_truth': ground_truth[i],
                 'extra_info': extra_infos[i],
                 'stop_reason': stop_reasons[i],
@@ -95,6 +114,8 @@ class PrimeSaveRewardManager:
 
         stt = time.time()
 
+        actor_timing = {}
+        cache_stats = {}
         try:
             results = self.compute_score(
                 actor_list=[x['reward_actor'] for x in datas],
@@ -103,61 +124,60 @@ class PrimeSaveRewardManager:
                 response_str_list=[x['response_str'] for x in datas],
                 ground_truth_list=[x['ground_truth'] for x in datas],
                 extra_info_list=[x['extra_info'] for x in datas],
-                finish_reason_list=[x['finish_reason'] for x in datas]
+                finish_reason_list=[x['finish_reason'] for x in datas],
+                timing_raw=actor_timing,
+                cache_stats=cache_stats,
             )
             scores = []
             reasons = []
             # Record the experience of `verify` exceptions without performing loss calculation.
             is_errors = []
 
+            for i in range(len(datas)):
+                result = results[i]
+
+                reason = ''
+                is_error = False
+                if isinstance(result, list):
+                    result = result[0]
+                if isinstance(result, Exception) or result is None:
+                    score = 0.0
+                elif isinstance(result, (int, float, bool)):
+                    score = float(result)
+                elif isinstance(result, (tuple, list)):
+                    score = float(result[0])
+                    reason = result[1] if len(result) > 1 else ''
+                elif isinstance(result, dict):
+                    score = float(result.get('reward', 0.0))
+                    reason = result.get('reason', '')
+                    if result.get("exception"):
+                        is_error = True
+                else:
+                    score = 0.0
+                    reason = "unexpected result type"
+
+                scores.append(score)
+                reasons.append(reason)
+                is_errors.append(is_error)
+
             if self.save_path is not None:
-                if not os.path.exists(os.path.dirname(self.save_path)):
-                    os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
-                with open(self.save_path, 'w', encoding='utf-8') as f:
-                    for i in range(len(datas)):
-                        result = results[i]
-                        
-                        reason = ''
-                        is_error = False
-                        if isinstance(result, list):
-                            result = result[0]
-                        if isinstance(result, Exception) or result is None:
-                            score = 0.0
-                        elif isinstance(result, (int, float, bool)):
-                            score = float(result)
-                        elif isinstance(result, (tuple, list)):
-                            score = float(result[0])
-                            reason = result[1] if len(result) > 1 else ''
-                        elif isinstance(result, dict):
-                            score = float(result.get('reward', 0.0))
-                            reason = result.get('reason', '')
-                            if result.get("exception"):
-                                is_error = True
-                        else:
-                            score = 0.0
-                            reason = "unexpected result type"
-
-                        extra_info = datas[i]['extra_info']
-                        extra_info = {k: v.tolist() if isinstance(v, (torch.Tensor, np.ndarray)) else v for k, v in extra_info.items()}
-
-                        f.write(json.dumps({
-                            'data_source': datas[i]['data_source'],
-                            'prompt_str': datas[i]['prompt_str'],
-                            'response_str': datas[i]['response_str'],
-                            'ground_truth': datas[i]['ground_truth'],
-                            'extra_info': extra_info,
-                            'finish_reason': finish_reasons[i],
-                            'stop_reason': stop_reasons[i],
-                            'prompt_str_length': valid_prompt_length[i].item(),
-                            'response_str_length': valid_response_length[i].item(),
-                            'score': score,
-                            'reason': reason,
-                            'is_error': is_error
-                        }, ensure_ascii=False) + '\n')   
-                        
-                        scores.append(score)
-                        reasons.append(reason)
-                        is_errors.append(is_error)
+                # serialization and disk io happen on the writer thread
+                self.get_writer().submit(self.save_path, {
+                    'data_source': list(data_sources),
+                    'reward_actor': list(reward_actors),
+                    'uid': prompt_uids(prompt_strs, data.non_tensor_batch.get('uid')),
+                    'prompt_str': list(prompt_strs),
+                    'response_str': list(response_strs),
+                    'ground_truth': ground_truth,
+                    'extra_info': list(extra_infos),
+                    'finish_reason': list(finish_reasons),
+                    'stop_reason': list(stop_reasons),
+                    'prompt_str_length': valid_prompt_length.tolist(),
+                    'response_str_length': valid_response_length.tolist(),
+                    'score': scores,
+                    'reason': reasons,
+                    'is_error': is_errors,
+                })
 
         except Exception as e:
             print(f"Unexpected error in batched reward computing. Setting all as 0.: {e}")
@@ -166,6 +186,8 @@ class PrimeSaveRewardManager:
             is_errors = [True for _ in range(len(ground_truth))]
 
         edt = time.time()
+        self.actor_timing = actor_timing
+        self.cache_stats = cache_stats
         # print(f"{timestamp()} ############## {len(data)} samples Reward computation time: {edt - stt:.2f}s")
         # print(f"{timestamp()} ############## {len(data)} samples with errors: {sum(is_errors)}")
 
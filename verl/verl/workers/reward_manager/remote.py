@@ -1,21 +1,85 @@
 import os
+import time
+import threading
+import multiprocessing
 from functools import partial
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from verl.workers.reward_manager.http_utils import do_parallel_request
 
 
-def compute_score_by_actor(params, actor_list, data_source_list, prompt_str_list, response_str_list, ground_truth_list, extra_info_list, finish_reason_list):
+def _run_actor(actor_name, **kwargs):
+    import my_reward
+    from my_reward.utils.verdict_cache import collect_cache_stats
+    actor = eval(f"my_reward.contrib.{actor_name}")
+    stt = time.time()
+    # counted where the actor runs, a process pool worker has its own caches
+    with collect_cache_stats() as cache_stats:
+        results = actor.batch_compute_score(**kwargs)
+    return results, stt, time.time(), dict(cache_stats)
+
+
+_actor_process_executors = {}
+_actor_process_executors_lock = threading.Lock()
+
+def _get_actor_process_executor(num_workers):
+    with _actor_process_executors_lock:
+        executor = _actor_process_executors.get(num_workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("forkserver"))
+            _actor_process_executors[num_workers] = executor
+    return executor
+
+
+def _drop_actor_process_executor(num_workers, executor):
+    """Forget a broken executor, the next _get_actor_process_executor starts a new one"""
+    with _actor_process_executors_lock:
+        if _actor_process_executors.get(num_workers) is executor:
+            del _actor_process_executors[num_workers]
+    executor.shutdown(wait=False)
+
+
+def _submit_actor_process(num_workers, actor, kwargs):
+    """Submit one "cpu" actor call, replacing the process pool once if a dead worker broke it"""
+    executor = _get_actor_process_executor(num_workers)
+    try:
+        return executor, executor.submit(_run_actor, actor, **kwargs)
+    except BrokenProcessPool:
+        print("WARNING: reward actor process pool is broken, restarting it")
+        _drop_actor_process_executor(num_workers, executor)
+        executor = _get_actor_process_executor(num_workers)
+        return executor, executor.submit(_run_actor, actor, **kwargs)
+
+
+def compute_score_by_actor(params, actor_list, data_source_list, prompt_str_list, response_str_list, ground_truth_list, extra_info_list, finish_reason_list, timing_raw=None, cache_stats=None):
+    """
+    Score every sample with its reward actor. Actor groups run concurrently by `resource_profile`:
+    "cpu" actors in a process pool, "network" and "pooled" actors in threads, so the reward time
+    is the slowest group instead of the sum. With `actor_chunk_size` a "cpu" group is also split
+    into chunks that run on different processes. The wall seconds of every actor, from the start of its first
+    chunk to the end of its last one, are written to `timing_raw`, a chunked actor also gets the summed seconds
+    of its chunks under `<actor>/chunk_sum`. The verdict cache hits / misses / evictions of all actors are added
+    up in `cache_stats`.
+    """
     import my_reward
     # Group by actor
     actor_order_list = list(enumerate(actor_list))
     actor_group = defaultdict(list)
     for i, actor in actor_order_list:
         actor_group[actor].append(i)
-    # Compute separately by actor
-    results = []
+
+    # (actor, index_list) of every batch_compute_score call
+    tasks = []
+    chunk_size = params.get("actor_chunk_size")
     for actor, index_list in actor_group.items():
-        actor = eval(f"my_reward.contrib.{actor}")
-        actor_results = actor.batch_compute_score(
+        is_cpu = getattr(eval(f"my_reward.contrib.{actor}"), "resource_profile", "cpu") == "cpu"
+        step = chunk_size if (is_cpu and chunk_size) else len(index_list)
+        for start in range(0, len(index_list), step):
+            tasks.append((actor, is_cpu, index_list[start:start + step]))
+
+    kwargs_list = [
+        dict(
             params=params,
             data_source_list=[data_source_list[i] for i in index_list],
             prompt_str_list=[prompt_str_list[i] for i in index_list],
@@ -23,28 +87,100 @@ def compute_score_by_actor(params, actor_list, data_source_list, prompt_str_list
             ground_truth_list=[ground_truth_list[i] for i in index_list],
             extra_info_list=[extra_info_list[i] for i in index_list],
             finish_reason_list=[finish_reason_list[i] for i in index_list],
-        )
+        ) for _, _, index_list in tasks
+    ]
+
+    futures = {}
+    process_executors = {}
+    thread_executor = None
+    num_process_workers = params.get("actor_process_workers", 4)
+    if params.get("concurrent_actors", True) and len(tasks) > 1:
+        thread_executor = ThreadPoolExecutor(max_workers=len(actor_group))
+        for j, ((actor, is_cpu, _), kwargs) in enumerate(zip(tasks, kwargs_list)):
+            if is_cpu:
+                process_executors[j], futures[j] = _submit_actor_process(num_process_workers, actor, kwargs_list[j])
+            else:
+                futures[j] = thread_executor.submit(_run_actor, actor, **kwargs)
+
+    # Compute separately by actor
+    results = []
+    # actor -> [first start, last end, summed chunk seconds, number of chunks]
+    actor_spans = {}
+    for j, (actor, _, index_list) in enumerate(tasks):
+        if j in futures:
+            try:
+                actor_results, start, end, actor_cache_stats = futures[j].result()
+            except BrokenProcessPool:
+                # a worker died (OOM, crash in a verifier) and took the pending calls with it.
+                # Run them again once on a new pool, the pool is replaced either way so later steps still work
+                print(f"WARNING: reward actor process pool broke while running {actor}, retrying on a new pool")
+                _drop_actor_process_executor(num_process_workers, process_executors[j])
+                process_executors[j], futures[j] = _submit_actor_process(num_process_workers, actor, kwargs_list[j])
+                try:
+                    actor_results, start, end, actor_cache_stats = futures[j].result()
+                except BrokenProcessPool:
+                    _drop_actor_process_executor(num_process_workers, process_executors[j])
+                    raise
+        else:
+            actor_results, start, end, actor_cache_stats = _run_actor(actor, **kwargs_list[j])
+        span = actor_spans.setdefault(actor, [start, end, 0.0, 0])
+        span[0], span[1] = min(span[0], start), max(span[1], end)
+        span[2] += end - start
+        span[3] += 1
+        if cache_stats is not None:
+            for name, value in actor_cache_stats.items():
+                cache_stats[name] = cache_stats.get(name, 0) + value
         results.extend([(index_list[i], actor_results[i]) for i in range(len(index_list))])
-    
+    if thread_executor is not None:
+        thread_executor.shutdown(wait=False)
+    if timing_raw is not None:
+        for actor, (start, end, chunk_sum, num_chunks) in actor_spans.items():
+            timing_raw[actor] = end - start
+            if num_chunks > 1:
+                timing_raw[f"{actor}/chunk_sum"] = chunk_sum
+
     results = sorted(results, key=lambda x: x[0])
     results = [x[1] for x in results]
     return results
 
 
+def get_my_reward_params(config):
+    """
+    Parameters of the my_reward actors, from the `my_reward_*` keys of `config.reward_model`.
+    """
+    params = {
+        "url": config.reward_model.get("my_reward_verify_url"),
+        "model": config.reward_model.get("my_reward_verify_model", ""),
+        "key": config.reward_model.get("my_reward_verify_key", "EMPTY"),
+    }
+    params["max_concurrency"] = config.reward_model.get("my_reward_verify_max_concurrency", 8)
+    # upper bound of the adaptive in-flight window of the judge client, defaults to 4x max_concurrency
+    params["max_concurrency_limit"] = config.reward_model.get("my_reward_verify_max_concurrency_limit", None)
+    params["max_tokens"] = config.reward_model.get("my_reward_verify_max_tokens", 4096)
+    # verdict cache: in-memory LRU (size 0 disables it) backed by an optional SQLite file
+    params["verdict_cache_size"] = config.reward_model.get("my_reward_verdict_cache_size", 100000)
+    params["verdict_cache_path"] = config.reward_model.get("my_reward_verdict_cache_path", None)
+    # warm process pool of RewardActorMath, a check running longer than the timeout is killed
+    params["math_verify_num_workers"] = config.reward_model.get("my_reward_math_verify_num_workers", 32)
+    params["math_verify_timeout"] = config.reward_model.get("my_reward_math_verify_timeout", 1.0)
+    # reward -= repetition_penalty * repeatness score of the response, 0 disables it
+    params["repetition_penalty"] = config.reward_model.get("my_reward_repetition_penalty", 0.0)
+    params["repetition_num_workers"] = config.reward_model.get("my_reward_repetition_num_workers", 0)
+    # run the actor groups of a batch concurrently, "cpu" actors use actor_process_workers processes
+    params["concurrent_actors"] = config.reward_model.get("my_reward_concurrent_actors", True)
+    params["actor_process_workers"] = config.reward_model.get("my_reward_actor_process_workers", 4)
+    # split the samples of a "cpu" actor into chunks of this size, null keeps one call per actor
+    params["actor_chunk_size"] = config.reward_model.get("my_reward_actor_chunk_size", None)
+    return params
+
+
 def get_compute_score_func(config):
     compute_score = None
 
     # remote model to verify + local actor
     if config.reward_model.get("my_reward_verify_url") is not None:
         import my_reward
-        my_reward_verify_url = config.reward_model.my_reward_verify_url
-        params = {
-            "url": my_reward_verify_url,
-            "model": config.reward_model.my_reward_verify_model,
-            "key": config.reward_model.my_reward_verify_key,
-        }
-        params["max_concurrency"] = config.reward_model.get("my_reward_verify_max_concurrency", 8)
-        params["max_tokens"] = config.reward_model.get("my_reward_verify_max_tokens", 4096)
+        params = get_my_reward_params(config)
         compute_score = partial(compute_score_by_actor, params=params)
 
-    return compute_score
\ No newline at end of file
+    return compute_score
@@ -0,0 +1,166 @@
+# Copyright 2024 PRIME team and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Background writer for the rollout/reward samples saved by PrimeSaveRewardManager.
+
+Each step is one shard. In parquet format a shard is `<save_path>` holding the samples plus
+`<save_path minus .parquet>.prompts.parquet` holding every distinct prompt once, referenced by uid.
+"""
+
+import os
+import json
+import queue
+import hashlib
+import threading
+import traceback
+
+import numpy as np
+import torch
+
+SAMPLE_COLUMNS = [
+    'data_source', 'reward_actor', 'uid', 'prompt_str', 'response_str', 'ground_truth', 'extra_info', 'finish_reason', 'stop_reason',
+    'prompt_str_length', 'response_str_length', 'score', 'reason', 'is_error'
+]
+
+
+def prompts_path_of(path):
+    base = path[:-len('.parquet')] if path.endswith('.parquet') else path
+    return base + '.prompts.parquet'
+
+
+def _to_serializable(value):
+    if isinstance(value, (torch.Tensor, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: _to_serializable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_serializable(v) for v in value]
+    return value
+
+
+class SampleWriter:
+    """Persist per-step samples on a background thread.
+
+    `submit` only enqueues references to the columns, so the driver does not serialize anything.
+    The queue is bounded: if the disk falls behind by `max_pending` steps, `submit` blocks.
+    """
+
+    def __init__(self, save_format='jsonl', max_pending=4, row_group_size=1024, compression='zstd'):
+        assert save_format in ('parquet', 'jsonl'), f'unsupported save_format {save_format}'
+        self.save_format = save_format
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='sample_writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, path, columns):
+        """Queue one shard. `columns` maps every name in SAMPLE_COLUMNS to a list of equal length."""
+        self._queue.put((path, columns))
+
+    def flush(self):
+        """Block until every submitted shard is on disk, e.g. before a checkpoint is committed."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path, columns = self._queue.get()
+            try:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.save_format == 'parquet':
+                    self._write_parquet(path, columns)
+                else:
+                    self._write_jsonl(path, columns)
+            except Exception as e:
+                print(f"Failed to save reward samples to {path}: {e}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def _write_parquet(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        prompt_by_uid = {}
+        for uid, prompt_str in zip(columns['uid'], columns['prompt_str']):
+            if uid not in prompt_by_uid:
+                prompt_by_uid[uid] = prompt_str
+        prompts = pa.table({
+            'uid': pa.array(list(prompt_by_uid.keys()), type=pa.string()),
+            'prompt_str': pa.array(list(prompt_by_uid.values()), type=pa.string()),
+        })
+
+        samples = pa.table({
+            'data_source': pa.array([str(x) for x in columns['data_source']], type=pa.string()),
+            'reward_actor': pa.array([str(x) for x in columns['reward_actor']], type=pa.string()),
+            'uid': pa.array(columns['uid'], type=pa.string()),
+            'response_str': pa.array(columns['response_str'], type=pa.string()),
+            'ground_truth': pa.array([json.dumps(_to_serializable(x), ensure_ascii=False) for x in columns['ground_truth']],
+                                     type=pa.string()),
+            # extra_info differs in structure between data sources, keep it as a json string
+            'extra_info': pa.array([json.dumps(_to_serializable(x), ensure_ascii=False) for x in columns['extra_info']],
+                                   type=pa.string()),
+            'finish_reason': pa.array([None if x is None else str(x) for x in columns['finish_reason']], type=pa.string()),
+            'stop_reason': pa.array([None if x is None else str(x) for x in columns['stop_reason']], type=pa.string()),
+            'prompt_str_length': pa.array(columns['prompt_str_length'], type=pa.int64()),
+            'response_str_length': pa.array(columns['response_str_length'], type=pa.int64()),
+            'score': pa.array(columns['score'], type=pa.float64()),
+            'reason': pa.array([str(x) for x in columns['reason']], type=pa.string()),
+            'is_error': pa.array(columns['is_error'], type=pa.bool_()),
+        })
+
+        # write to a temporary name first so readers never see a partial shard
+        for table, target in ((prompts, prompts_path_of(path)), (samples, path)):
+            tmp_path = target + '.tmp'
+            pq.write_table(table, tmp_path, row_group_size=self.row_group_size, compression=self.compression)
+            os.replace(tmp_path, target)
+
+    def _write_jsonl(self, path, columns):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for i in range(len(columns['uid'])):
+                record = {key: _to_serializable(columns[key][i]) for key in SAMPLE_COLUMNS if key != 'uid'}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+
+
+def prompt_uids(prompt_strs, uids=None):
+    """Prompt keys for the side table: the rollout uid when available, else a hash of the prompt."""
+    if uids is not None:
+        return [str(uid) for uid in uids]
+    return [hashlib.sha1(prompt_str.encode('utf-8')).hexdigest() for prompt_str in prompt_strs]
+
+
+def read_samples(path, with_prompts=True):
+    """Load one saved shard (parquet or jsonl) into a pandas DataFrame for offline analysis.
+
+    For parquet shards `prompt_str` is joined back from the prompt side table when `with_prompts` is True,
+    and `ground_truth`/`extra_info` are decoded from json.
+    """
+    import pandas as pd
+
+    if not path.endswith('.parquet'):
+        # no dtype inference, a ground truth like "42" must stay a string
+        return pd.read_json(path, lines=True, dtype=False, convert_dates=False)
+
+    samples = pd.read_parquet(path)
+    for column in ('ground_truth', 'extra_info'):
+        samples[column] = samples[column].map(json.loads)
+    if with_prompts and os.path.exists(prompts_path_of(path)):
+        prompts = pd.read_parquet(prompts_path_of(path))
+        samples = samples.merge(prompts, on='uid', how='left')
+    return samples